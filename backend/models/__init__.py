@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 
 
 # ============== User Models ==============
@@ -119,6 +119,11 @@ class AdvertisementCreate(BaseModel):
     link: Optional[str] = ""
     order: int = 1
     is_active: bool = True
+    weight: float = 1.0  # Relative share of rotation picks
+    max_impressions: Optional[int] = None  # Lifetime cap
+    daily_cap: Optional[int] = None
+    starts_at: Optional[str] = None  # ISO datetimes bounding when the ad is served
+    ends_at: Optional[str] = None
 
 class AdvertisementUpdate(BaseModel):
     image_data: Optional[str] = None
@@ -126,12 +131,36 @@ class AdvertisementUpdate(BaseModel):
     link: Optional[str] = None
     order: Optional[int] = None
     is_active: Optional[bool] = None
+    weight: Optional[float] = None
+    max_impressions: Optional[int] = None
+    daily_cap: Optional[int] = None
+    starts_at: Optional[str] = None
+    ends_at: Optional[str] = None
 
 
 # ============== Voting Models ==============
 class VoteCreate(BaseModel):
     talent_id: str
     voter_email: Optional[str] = ""
+    contest_id: Optional[str] = None  # Also count towards this contest's voting window
+
+
+# ============== Contest Models ==============
+class ContestCreate(BaseModel):
+    title: str
+    starts_at: str  # ISO datetime, voting opens
+    ends_at: str  # ISO datetime, voting closes
+    description: str = ""
+    category: str = ""
+    award_id: str = ""  # Award that receives the winner when the contest closes
+
+class ContestUpdate(BaseModel):
+    title: Optional[str] = None
+    starts_at: Optional[str] = None
+    ends_at: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    award_id: Optional[str] = None
 
 
 # ============== Password Reset Models ==============
@@ -192,3 +221,35 @@ class PartyEventUpdate(BaseModel):
 # ============== Admin Password Reset ==============
 class AdminPasswordReset(BaseModel):
     password: str
+
+
+# ============== Analytics Models ==============
+class AnalyticsEvent(BaseModel):
+    event_type: str = "page_view"  # page_view, talent_view, party_view, ad_click, vote
+    page: str = ""
+    talent_id: Optional[str] = None
+    party_id: Optional[str] = None
+    ad_id: Optional[str] = None
+    session_id: str = ""
+    user_agent: str = ""
+    referrer: str = ""
+
+
+class AnalyticsQuery(BaseModel):
+    metric: str = "count"  # count, uniques (distinct session_id)
+    group_by: List[str] = []
+    filters: Dict[str, Union[str, List[str]]] = {}
+    start: Optional[str] = None
+    end: Optional[str] = None
+    bucket: Optional[str] = None  # hour, day
+    limit: int = 100
+
+
+class FunnelStep(BaseModel):
+    event_type: Optional[str] = None
+    page: Optional[str] = None  # Exact path, or a prefix ending in "*"
+
+
+class FunnelQuery(BaseModel):
+    steps: List[FunnelStep]
+    days: int = 7
@@ -8,12 +8,14 @@ import csv
 
 from models import TalentResponse
 from services import hash_password
+from services.vote_reconciliation import reconcile_votes
+from services.vote_store import migrate_votes_to_buckets
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def create_admin_routes(db):
+def create_admin_routes(db, vote_store):
     router = APIRouter()
     
     @router.get("/admin/talents/pending", response_model=List[TalentResponse])
@@ -104,6 +106,36 @@ def create_admin_routes(db):
         return {"message": "Talent deleted"}
 
 
+    @router.post("/admin/votes/reconcile")
+    async def run_vote_reconciliation():
+        run = await reconcile_votes(db, vote_store)
+        if run is None:
+            raise HTTPException(status_code=409, detail="Reconciliation already running")
+        return run
+
+
+    @router.get("/admin/votes/reconcile/runs")
+    async def get_vote_reconciliation_runs(limit: int = 20):
+        runs = await db.vote_reconciliation_runs.find({}, {"_id": 0}).sort("started_at", -1).to_list(min(limit, 100))
+        return runs
+
+
+    @router.post("/admin/votes/migrate-buckets")
+    async def migrate_vote_buckets(batch_size: int = 5000, max_batches: int = 20):
+        """Move a slice of per-vote documents into hourly buckets; call repeatedly until remaining is 0"""
+        return await migrate_votes_to_buckets(db, batch_size=min(batch_size, 20000), max_batches=max_batches)
+
+
+    @router.get("/admin/votes/{talent_id}")
+    async def get_talent_vote_history(talent_id: str, limit: int = 50):
+        limit = min(limit, 500)
+        return {
+            "talent_id": talent_id,
+            "total": await vote_store.count_for(talent_id),
+            "recent": await vote_store.recent_votes(talent_id, limit)
+        }
+
+
     @router.get("/admin/talents/export")
     async def export_talents():
         talents = await db.talents.find({}, {"_id": 0}).to_list(1000)
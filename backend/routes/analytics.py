@@ -1,104 +1,208 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
-from datetime import datetime, timezone, timedelta
-import uuid
+from pydantic import TypeAdapter, ValidationError
+from datetime import datetime, timedelta
+from typing import List
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from bson import ObjectId
+import asyncio
+import json
 import csv
 import io
 
+from models import AnalyticsEvent, AnalyticsQuery, FunnelQuery
+from services.analytics_time import utc_now, day_start, days_ago, parse_time
+from services.analytics_codec import decode_basic, migrate_compact
+from services.analytics_rollups import hour_start, backfill_rollups, sum_counts, top_values, traffic_totals
+from services.analytics_series import GRANULARITIES, event_series
+from services.analytics_export import EXPORT_FORMATS, raw_event_rows, stream_export
+from services.analytics_engine import ENGINE_DIMENSIONS, ENGINE_METRICS, BUCKET_MS
+from services.ad_impressions import ctr_by_day
+from services.cache import SWRCache
+from services.enrichment import NameResolver
+from services.hll import HLL_ERROR, unique_visitors, backfill_sketches
+from services.live_activity import LiveActivity
+from services.funnels import FunnelAnalysis
+from services.bot_filter import filtered_by_day
+
 import logging
 logger = logging.getLogger(__name__)
 
 
-def create_analytics_routes(db):
+# Largest batch accepted by /analytics/track/batch
+MAX_BATCH_EVENTS = 100
+
+events_adapter = TypeAdapter(List[AnalyticsEvent])
+
+
+def event_document(event: AnalyticsEvent, user_agent: str = "") -> dict:
+    """Logical event for the ingest queue; the ObjectId minted here is also its timestamp."""
+    fields = {
+        "event_type": event.event_type,
+        "page": event.page,
+        "talent_id": event.talent_id,
+        "party_id": event.party_id,
+        "ad_id": event.ad_id,
+        "session_id": event.session_id,
+        "user_agent": event.user_agent or user_agent,
+        "referrer": event.referrer
+    }
+    return {"_id": ObjectId(), **{k: v for k, v in fields.items() if v}}
+
+
+def create_analytics_routes(db, vote_store, rate_limiter, analytics_ingestor, analytics_archive, analytics_engine,
+                            analytics_codec, bot_filter):
     router = APIRouter()
     
+    names = NameResolver(db)
+    live = LiveActivity(window_minutes=15)
+    funnels = FunnelAnalysis(db, analytics_codec)
+    
     # ============== Track Page Views ==============
     @router.post("/analytics/track")
-    async def track_page_view(data: dict):
+    async def track_page_view(event: AnalyticsEvent, request: Request):
         """Track a page view or event"""
-        doc = {
-            "id": str(uuid.uuid4()),
-            "event_type": data.get("event_type", "page_view"),  # page_view, talent_view, party_view, ad_click
-            "page": data.get("page", ""),
-            "talent_id": data.get("talent_id"),
-            "party_id": data.get("party_id"),
-            "ad_id": data.get("ad_id"),
-            "session_id": data.get("session_id", ""),
-            "user_agent": data.get("user_agent", ""),
-            "referrer": data.get("referrer", ""),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.analytics.insert_one(doc)
+        await rate_limiter.check("analytics_track", rate_limiter.client_ip(request))
+        doc = event_document(event, request.headers.get("user-agent", ""))
+        if bot_filter.check(doc) and analytics_ingestor.submit(doc):
+            live.record(doc)
         return {"message": "Tracked"}
     
     
+    @router.post("/analytics/track/batch")
+    async def track_events_batch(request: Request):
+        """Track a batch of events, either a JSON array or {"events": [...]}.
+        Reads the raw body so navigator.sendBeacon text/plain payloads are accepted too."""
+        await rate_limiter.check("analytics_track", rate_limiter.client_ip(request))
+        try:
+            payload = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON payload")
+        
+        if isinstance(payload, dict):
+            payload = payload.get("events", [])
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Expected a list of events")
+        if len(payload) > MAX_BATCH_EVENTS:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_EVENTS} events per batch")
+        
+        try:
+            events = events_adapter.validate_python(payload)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        
+        user_agent = request.headers.get("user-agent", "")
+        accepted = filtered = 0
+        for e in events:
+            doc = event_document(e, user_agent)
+            if not bot_filter.check(doc):
+                filtered += 1
+            elif analytics_ingestor.submit(doc):
+                live.record(doc)
+                accepted += 1
+        return {"message": "Tracked", "accepted": accepted, "filtered": filtered}
+    
+    
+    @router.post("/admin/analytics/migrate-compact")
+    async def migrate_analytics_compact(batch_size: int = 5000, max_batches: int = 20):
+        """Rewrite legacy events in the compact encoding; call repeatedly until remaining is 0"""
+        return await migrate_compact(db, analytics_codec, batch_size=min(batch_size, 20000), max_batches=max_batches)
+    
+    
+    @router.post("/admin/analytics/migrate-dates", deprecated=True)
+    async def migrate_analytics_dates(batch_size: int = 5000, max_batches: int = 20):
+        """Superseded by migrate-compact, which also converts ISO string created_at values"""
+        return await migrate_compact(db, analytics_codec, batch_size=min(batch_size, 20000), max_batches=max_batches)
+    
+    
+    @router.post("/admin/analytics/rollups/backfill")
+    async def backfill_analytics_rollups(days: int = 30):
+        """Rebuild rollups for the last `days` closed days from raw events"""
+        today = day_start(utc_now())
+        return await backfill_rollups(db, analytics_codec, today - timedelta(days=min(days, 366)), today)
+    
+    
+    @router.post("/admin/analytics/uniques/backfill")
+    async def backfill_unique_visitors(days: int = 30):
+        """Rebuild unique-visitor sketches for the last `days` closed days from raw events"""
+        today = day_start(utc_now())
+        return await backfill_sketches(db, today - timedelta(days=min(days, 366)), today)
+    
+    
+    @router.post("/admin/analytics/archive")
+    async def archive_analytics(older_than_days: int = 180, max_parts: int = 20):
+        """Move raw events older than `older_than_days` into the on-disk archive; call repeatedly until remaining is 0"""
+        if older_than_days < 1:
+            raise HTTPException(status_code=400, detail="older_than_days must be at least 1")
+        return await analytics_archive.archive(days_ago(older_than_days), max_parts=max_parts)
+    
+    
+    @router.get("/admin/analytics/storage")
+    async def get_storage_stats():
+        """Document and index bytes per stored event"""
+        stats = await db.command("collStats", "analytics")
+        count = stats.get("count", 0) or 1
+        return {
+            "events": stats.get("count", 0),
+            "avg_event_bytes": stats.get("avgObjSize", 0),
+            "index_bytes_per_event": round(stats.get("totalIndexSize", 0) / count, 1),
+            "indexes": stats.get("indexSizes", {})
+        }
+    
+    
+    @router.get("/admin/analytics/ingest-stats")
+    async def get_ingest_stats():
+        """Counters for the buffered analytics ingestion pipeline"""
+        sampler = analytics_ingestor.sampler
+        sampling = {"probability": round(sampler.probability, 4), "rate": round(sampler.rate, 1)} if sampler else None
+        return {
+            **analytics_ingestor.stats,
+            "queue_depth": analytics_ingestor.queue.qsize(),
+            "degraded": analytics_ingestor.degraded,
+            "spool": analytics_ingestor.spool.stats if analytics_ingestor.spool else None,
+            "bots": bot_filter.stats,
+            "sampling": sampling
+        }
+    
+    
+    @router.get("/admin/analytics/live")
+    async def get_live_activity(limit: int = 10):
+        """Active sessions, top pages and top talents over the last 1, 5 and 15 minutes (this worker, from memory)"""
+        return live.snapshot(limit=min(max(limit, 1), 50))
+    
+    
     # ============== Get Analytics Summary ==============
-    @router.get("/admin/analytics/summary")
-    async def get_analytics_summary():
-        """Get overall analytics summary for admin dashboard"""
-        now = datetime.now(timezone.utc)
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        week_ago = now - timedelta(days=7)
-        month_ago = now - timedelta(days=30)
-        
-        # Total page views
-        total_views = await db.analytics.count_documents({})
-        
-        # Today's views
-        today_views = await db.analytics.count_documents({
-            "created_at": {"$gte": today_start.isoformat()}
-        })
-        
-        # This week's views
-        week_views = await db.analytics.count_documents({
-            "created_at": {"$gte": week_ago.isoformat()}
-        })
-        
-        # This month's views
-        month_views = await db.analytics.count_documents({
-            "created_at": {"$gte": month_ago.isoformat()}
-        })
-        
-        # Unique sessions (approximate unique visitors)
-        unique_sessions_pipeline = [
-            {"$group": {"_id": "$session_id"}},
-            {"$count": "total"}
-        ]
-        unique_result = await db.analytics.aggregate(unique_sessions_pipeline).to_list(1)
-        unique_visitors = unique_result[0]["total"] if unique_result else 0
-        
-        # Unique visitors this week
-        unique_week_pipeline = [
-            {"$match": {"created_at": {"$gte": week_ago.isoformat()}}},
-            {"$group": {"_id": "$session_id"}},
-            {"$count": "total"}
-        ]
-        unique_week_result = await db.analytics.aggregate(unique_week_pipeline).to_list(1)
-        unique_visitors_week = unique_week_result[0]["total"] if unique_week_result else 0
-        
-        # Total registered talents
-        total_talents = await db.talents.count_documents({})
-        approved_talents = await db.talents.count_documents({"is_approved": True})
-        pending_talents = await db.talents.count_documents({"is_approved": False})
-        
-        # Total votes
-        total_votes = await db.votes.count_documents({})
-        
-        # Party events count
-        total_parties = await db.party_events.count_documents({})
-        active_parties = await db.party_events.count_documents({"is_active": True})
-        
-        # Ads count
-        total_ads = await db.advertisements.count_documents({})
+    summary_cache = SWRCache(fresh_for=30, stale_for=300)
+    
+    async def compute_summary():
+        now = utc_now()
+        (
+            traffic, unique_all, unique_week,
+            total_talents, approved_talents, pending_talents, total_votes,
+            total_parties, active_parties, total_ads
+        ) = await asyncio.gather(
+            traffic_totals(db, now),
+            unique_visitors(db),
+            unique_visitors(db, start=days_ago(7, now)),
+            db.talents.count_documents({}),
+            db.talents.count_documents({"is_approved": True}),
+            db.talents.count_documents({"is_approved": False}),
+            vote_store.count_total(),
+            db.party_events.count_documents({}),
+            db.party_events.count_documents({"is_active": True}),
+            db.advertisements.count_documents({})
+        )
         
         return {
             "traffic": {
-                "total_page_views": total_views,
-                "today_views": today_views,
-                "week_views": week_views,
-                "month_views": month_views,
-                "unique_visitors": unique_visitors,
-                "unique_visitors_week": unique_visitors_week
+                "total_page_views": traffic["total"],
+                "today_views": traffic["today"],
+                "week_views": traffic["week"],
+                "month_views": traffic["month"],
+                "unique_visitors": unique_all,
+                "unique_visitors_week": unique_week,
+                "unique_visitors_error": round(HLL_ERROR, 4)
             },
             "talents": {
                 "total": total_talents,
@@ -110,33 +214,33 @@ def create_analytics_routes(db):
                 "total_parties": total_parties,
                 "active_parties": active_parties,
                 "total_ads": total_ads
-            }
+            },
+            "generated_at": now
         }
     
+    @router.get("/admin/analytics/summary")
+    async def get_analytics_summary():
+        """Get overall analytics summary for admin dashboard (cached briefly, refreshed in the background)"""
+        return await summary_cache.get("summary", compute_summary)
+    
     
     # ============== Get Popular Talents ==============
     @router.get("/admin/analytics/popular-talents")
     async def get_popular_talents():
         """Get most viewed talents"""
-        pipeline = [
-            {"$match": {"event_type": "talent_view", "talent_id": {"$ne": None}}},
-            {"$group": {"_id": "$talent_id", "views": {"$sum": 1}}},
-            {"$sort": {"views": -1}},
-            {"$limit": 20}
-        ]
-        results = await db.analytics.aggregate(pipeline).to_list(20)
+        results = await top_values(db, "talent_id", "talent_view", 20)
+        talents = await names.resolve("talent", [talent_id for talent_id, _ in results], extra_fields=("profile_image",))
         
-        # Get talent names
         popular = []
-        for r in results:
-            talent = await db.talents.find_one({"id": r["_id"]}, {"_id": 0, "name": 1, "category": 1, "profile_image": 1})
+        for talent_id, views in results:
+            talent = talents.get(talent_id)
             if talent:
                 popular.append({
-                    "talent_id": r["_id"],
+                    "talent_id": talent_id,
                     "name": talent.get("name", "Unknown"),
                     "category": talent.get("category", ""),
                     "profile_image": talent.get("profile_image", ""),
-                    "views": r["views"]
+                    "views": views
                 })
         
         return popular
@@ -146,25 +250,19 @@ def create_analytics_routes(db):
     @router.get("/admin/analytics/party-stats")
     async def get_party_stats():
         """Get party event view statistics"""
-        pipeline = [
-            {"$match": {"event_type": "party_view", "party_id": {"$ne": None}}},
-            {"$group": {"_id": "$party_id", "views": {"$sum": 1}}},
-            {"$sort": {"views": -1}},
-            {"$limit": 20}
-        ]
-        results = await db.analytics.aggregate(pipeline).to_list(20)
+        results = await top_values(db, "party_id", "party_view", 20)
+        parties = await names.resolve("party", [party_id for party_id, _ in results])
         
-        # Get party details
         stats = []
-        for r in results:
-            party = await db.party_events.find_one({"id": r["_id"]}, {"_id": 0, "title": 1, "venue": 1, "event_date": 1})
+        for party_id, views in results:
+            party = parties.get(party_id)
             if party:
                 stats.append({
-                    "party_id": r["_id"],
+                    "party_id": party_id,
                     "title": party.get("title", "Unknown"),
                     "venue": party.get("venue", ""),
                     "event_date": party.get("event_date", ""),
-                    "views": r["views"]
+                    "views": views
                 })
         
         return stats
@@ -174,39 +272,115 @@ def create_analytics_routes(db):
     @router.get("/admin/analytics/ad-stats")
     async def get_ad_stats():
         """Get advertisement click statistics"""
-        pipeline = [
-            {"$match": {"event_type": "ad_click", "ad_id": {"$ne": None}}},
-            {"$group": {"_id": "$ad_id", "clicks": {"$sum": 1}}},
-            {"$sort": {"clicks": -1}},
-            {"$limit": 20}
-        ]
-        results = await db.analytics.aggregate(pipeline).to_list(20)
+        results = await top_values(db, "ad_id", "ad_click", 20)
+        ads = await names.resolve("ad", [ad_id for ad_id, _ in results])
         
-        # Get ad details
         stats = []
-        for r in results:
-            ad = await db.advertisements.find_one({"id": r["_id"]}, {"_id": 0, "title": 1, "link": 1})
+        for ad_id, clicks in results:
+            ad = ads.get(ad_id)
             if ad:
                 stats.append({
-                    "ad_id": r["_id"],
+                    "ad_id": ad_id,
                     "title": ad.get("title", "Unknown"),
                     "link": ad.get("link", ""),
-                    "clicks": r["clicks"]
+                    "clicks": clicks
                 })
         
         return stats
     
     
+    # ============== Get Ad Click-Through Rates ==============
+    @router.get("/admin/analytics/ad-ctr")
+    async def get_ad_ctr(days: int = 30):
+        """Impressions, clicks and CTR per ad, in total and per day, over the last `days` days"""
+        if not 1 <= days <= 366:
+            raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+        report = await ctr_by_day(db, start=days_ago(days - 1))
+        ads = await names.resolve("ad", list(report))
+        
+        def ctr(clicks, impressions):
+            return round(clicks / impressions, 4) if impressions else None
+        
+        results = []
+        for ad_id, per_day in report.items():
+            impressions = sum(d["impressions"] for d in per_day.values())
+            clicks = sum(d["clicks"] for d in per_day.values())
+            results.append({
+                "ad_id": ad_id,
+                "title": ads.get(ad_id, {}).get("title", "Unknown"),
+                "impressions": impressions,
+                "clicks": clicks,
+                "ctr": ctr(clicks, impressions),
+                "daily": [
+                    {"date": day.strftime("%Y-%m-%d"), **d, "ctr": ctr(d["clicks"], d["impressions"])}
+                    for day, d in sorted(per_day.items())
+                ]
+            })
+        results.sort(key=lambda r: r["impressions"], reverse=True)
+        return results
+    
+    
+    # ============== Get Traffic Sources ==============
+    def window_start(days: int):
+        if not 1 <= days <= 366:
+            raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+        return days_ago(days - 1)
+    
+    @router.get("/admin/analytics/referrers")
+    async def get_referrers(days: int = 30, event_type: str = "page_view", limit: int = 20):
+        """Top referring domains over the last `days` days; share is of all `event_type` events in the window"""
+        start = day_start(window_start(days))
+        results, total = await asyncio.gather(
+            top_values(db, "referrer_domain", event_type, min(limit, 100), start=start),
+            sum_counts(db, start=start, event_type=event_type)
+        )
+        return [
+            {"domain": domain, "count": count, "share": round(count / total, 4) if total else 0}
+            for domain, count in results
+        ]
+    
+    
+    @router.get("/admin/analytics/bots")
+    async def get_filtered_bots(days: int = 30):
+        """Bot events filtered at ingest per day, by reason (user_agent or rate)"""
+        rows = await filtered_by_day(db, window_start(days))
+        return {"total": sum(row["total"] for row in rows), "daily": rows}
+    
+    
+    @router.get("/admin/analytics/devices")
+    async def get_devices(days: int = 30, event_type: str = "page_view", limit: int = 20):
+        """Device, browser and OS breakdown over the last `days` days"""
+        start = window_start(days)
+        breakdowns = await asyncio.gather(*(
+            top_values(db, dim, event_type, min(limit, 100), start=start) for dim in ("device", "browser", "os")
+        ))
+        return {
+            dim: [{"name": name, "count": count} for name, count in results]
+            for dim, results in zip(("device", "browser", "os"), breakdowns)
+        }
+    
+    
     # ============== Get Recent Activity ==============
     @router.get("/admin/analytics/recent-activity")
     async def get_recent_activity():
         """Get recent site activity"""
-        activities = await db.analytics.find(
+        docs = await db.analytics.find(
             {}, 
-            {"_id": 0}
-        ).sort("created_at", -1).limit(50).to_list(50)
+            {"user_agent": 0, "referrer": 0}
+        ).sort("_id", -1).limit(50).to_list(50)
+        activities = [decode_basic(doc) for doc in docs]
+        
+        # Enrich with names, one $in query per entity type
+        resolved = await names.resolve_many({
+            "talent": [a.get("talent_id") for a in activities],
+            "party": [a.get("party_id") for a in activities],
+            "ad": [a.get("ad_id") for a in activities]
+        })
+        
+        def name_of(kind, entity_id, field):
+            doc = resolved.get(kind, {}).get(entity_id)
+            return doc.get(field) if doc else "Unknown"
         
-        # Enrich with names
         enriched = []
         for a in activities:
             item = {
@@ -216,16 +390,13 @@ def create_analytics_routes(db):
             }
             
             if a.get("talent_id"):
-                talent = await db.talents.find_one({"id": a["talent_id"]}, {"_id": 0, "name": 1})
-                item["talent_name"] = talent.get("name") if talent else "Unknown"
+                item["talent_name"] = name_of("talent", a["talent_id"], "name")
             
             if a.get("party_id"):
-                party = await db.party_events.find_one({"id": a["party_id"]}, {"_id": 0, "title": 1})
-                item["party_title"] = party.get("title") if party else "Unknown"
+                item["party_title"] = name_of("party", a["party_id"], "title")
             
             if a.get("ad_id"):
-                ad = await db.advertisements.find_one({"id": a["ad_id"]}, {"_id": 0, "title": 1})
-                item["ad_title"] = ad.get("title") if ad else "Unknown"
+                item["ad_title"] = name_of("ad", a["ad_id"], "title")
             
             enriched.append(item)
         
@@ -234,33 +405,19 @@ def create_analytics_routes(db):
     
     # ============== Get Daily Views (for chart) ==============
     @router.get("/admin/analytics/daily-views")
-    async def get_daily_views():
-        """Get page views per day for the last 30 days"""
-        now = datetime.now(timezone.utc)
-        thirty_days_ago = now - timedelta(days=30)
-        
-        # Get all analytics from last 30 days
-        docs = await db.analytics.find(
-            {"created_at": {"$gte": thirty_days_ago.isoformat()}},
-            {"_id": 0, "created_at": 1}
-        ).to_list(10000)
-        
-        # Group by date
-        daily_counts = {}
-        for doc in docs:
-            date_str = doc["created_at"][:10]  # Get YYYY-MM-DD
-            daily_counts[date_str] = daily_counts.get(date_str, 0) + 1
-        
-        # Fill in missing days with 0
-        result = []
-        for i in range(30):
-            date = (now - timedelta(days=29-i)).strftime("%Y-%m-%d")
-            result.append({
-                "date": date,
-                "views": daily_counts.get(date, 0)
-            })
-        
-        return result
+    async def get_daily_views(days: int = 30, granularity: str = "day", tz: str = "UTC", event_type: str = None):
+        """Get event counts per hour, day or week over the last `days` days, bucketed in timezone `tz`"""
+        if granularity not in GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+        if not 1 <= days <= 366:
+            raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+        try:
+            zone = ZoneInfo(tz)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Unknown timezone: {tz}")
+        
+        return await event_series(db, days=days, granularity=granularity, tz=zone, event_type=event_type,
+                                  archive=analytics_archive)
     
     
     # ============== Export Analytics to CSV ==============
@@ -268,43 +425,27 @@ def create_analytics_routes(db):
     async def export_analytics():
         """Export all analytics data to CSV"""
         # Get summary data
-        now = datetime.now(timezone.utc)
-        week_ago = now - timedelta(days=7)
-        month_ago = now - timedelta(days=30)
-        
-        total_views = await db.analytics.count_documents({})
-        week_views = await db.analytics.count_documents({"created_at": {"$gte": week_ago.isoformat()}})
-        month_views = await db.analytics.count_documents({"created_at": {"$gte": month_ago.isoformat()}})
-        
-        # Unique visitors
-        unique_pipeline = [{"$group": {"_id": "$session_id"}}, {"$count": "total"}]
-        unique_result = await db.analytics.aggregate(unique_pipeline).to_list(1)
-        unique_visitors = unique_result[0]["total"] if unique_result else 0
-        
-        # Popular talents
-        talent_pipeline = [
-            {"$match": {"event_type": "talent_view", "talent_id": {"$ne": None}}},
-            {"$group": {"_id": "$talent_id", "views": {"$sum": 1}}},
-            {"$sort": {"views": -1}},
-            {"$limit": 50}
-        ]
-        popular_talents = await db.analytics.aggregate(talent_pipeline).to_list(50)
-        
-        # Party stats
-        party_pipeline = [
-            {"$match": {"event_type": "party_view", "party_id": {"$ne": None}}},
-            {"$group": {"_id": "$party_id", "views": {"$sum": 1}}},
-            {"$sort": {"views": -1}}
-        ]
-        party_stats = await db.analytics.aggregate(party_pipeline).to_list(50)
-        
-        # Ad stats
-        ad_pipeline = [
-            {"$match": {"event_type": "ad_click", "ad_id": {"$ne": None}}},
-            {"$group": {"_id": "$ad_id", "clicks": {"$sum": 1}}},
-            {"$sort": {"clicks": -1}}
-        ]
-        ad_stats = await db.analytics.aggregate(ad_pipeline).to_list(50)
+        now = utc_now()
+        week_ago = days_ago(7, now)
+        month_ago = days_ago(30, now)
+        
+        total_views = await sum_counts(db)
+        week_views = await sum_counts(db, start=hour_start(week_ago), period="hour")
+        month_views = await sum_counts(db, start=hour_start(month_ago), period="hour")
+        
+        # Unique visitors (HyperLogLog estimate)
+        unique_count = await unique_visitors(db)
+        
+        # Popular talents, party stats and ad stats
+        popular_talents = await top_values(db, "talent_id", "talent_view", 50)
+        party_stats = await top_values(db, "party_id", "party_view", 50)
+        ad_stats = await top_values(db, "ad_id", "ad_click", 50)
+        resolved = await names.resolve_many({
+            "talent": [talent_id for talent_id, _ in popular_talents],
+            "party": [party_id for party_id, _ in party_stats],
+            "ad": [ad_id for ad_id, _ in ad_stats]
+        })
+        talents, parties, ads = (resolved.get(kind, {}) for kind in ("talent", "party", "ad"))
         
         # Create CSV
         output = io.StringIO()
@@ -316,34 +457,34 @@ def create_analytics_routes(db):
         writer.writerow(["Total Page Views", total_views])
         writer.writerow(["This Week Views", week_views])
         writer.writerow(["This Month Views", month_views])
-        writer.writerow(["Unique Visitors", unique_visitors])
+        writer.writerow(["Unique Visitors (approx.)", unique_count])
         writer.writerow([])
         
         # Popular talents section
         writer.writerow(["=== MOST VIEWED TALENTS ==="])
         writer.writerow(["Rank", "Talent Name", "Instagram", "Category", "Views"])
-        for i, t in enumerate(popular_talents, 1):
-            talent = await db.talents.find_one({"id": t["_id"]}, {"_id": 0, "name": 1, "instagram_id": 1, "category": 1})
+        for i, (talent_id, views) in enumerate(popular_talents, 1):
+            talent = talents.get(talent_id)
             if talent:
-                writer.writerow([i, talent.get("name", ""), talent.get("instagram_id", ""), talent.get("category", ""), t["views"]])
+                writer.writerow([i, talent.get("name", ""), talent.get("instagram_id", ""), talent.get("category", ""), views])
         writer.writerow([])
         
         # Party stats section
         writer.writerow(["=== PARTY EVENT VIEWS ==="])
         writer.writerow(["Party Title", "Venue", "Date", "Views"])
-        for p in party_stats:
-            party = await db.party_events.find_one({"id": p["_id"]}, {"_id": 0, "title": 1, "venue": 1, "event_date": 1})
+        for party_id, views in party_stats:
+            party = parties.get(party_id)
             if party:
-                writer.writerow([party.get("title", ""), party.get("venue", ""), party.get("event_date", ""), p["views"]])
+                writer.writerow([party.get("title", ""), party.get("venue", ""), party.get("event_date", ""), views])
         writer.writerow([])
         
         # Ad stats section
         writer.writerow(["=== ADVERTISEMENT CLICKS ==="])
         writer.writerow(["Ad Title", "Link", "Clicks"])
-        for a in ad_stats:
-            ad = await db.advertisements.find_one({"id": a["_id"]}, {"_id": 0, "title": 1, "link": 1})
+        for ad_id, clicks in ad_stats:
+            ad = ads.get(ad_id)
             if ad:
-                writer.writerow([ad.get("title", ""), ad.get("link", ""), a["clicks"]])
+                writer.writerow([ad.get("title", ""), ad.get("link", ""), clicks])
         
         output.seek(0)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -354,4 +495,74 @@ def create_analytics_routes(db):
         )
     
     
+    # ============== Ad-hoc Queries ==============
+    @router.post("/admin/analytics/query")
+    async def query_analytics(query: AnalyticsQuery):
+        """Run a metric / group-by / filter / time-bucket query against the in-memory column store"""
+        if query.metric not in ENGINE_METRICS:
+            raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(ENGINE_METRICS)}")
+        unknown = [d for d in list(query.group_by) + list(query.filters) if d not in ENGINE_DIMENSIONS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown dimensions: {', '.join(unknown)}")
+        if len(query.group_by) > 3:
+            raise HTTPException(status_code=400, detail="At most 3 group_by dimensions")
+        if query.bucket and query.bucket not in BUCKET_MS:
+            raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(BUCKET_MS)}")
+        try:
+            start = parse_time(query.start) if query.start else None
+            end = parse_time(query.end) if query.end else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="start and end must be ISO dates or datetimes")
+        
+        try:
+            return await analytics_engine.query(
+                metric=query.metric, group_by=query.group_by, filters=query.filters,
+                start=start, end=end, bucket=query.bucket, limit=min(max(query.limit, 1), 1000)
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    
+    # ============== Funnels and Paths ==============
+    @router.post("/admin/analytics/funnel")
+    async def get_funnel(query: FunnelQuery):
+        """Sessions reaching each step in order, e.g. home page -> talent profile -> vote"""
+        if not 1 <= len(query.steps) <= 10:
+            raise HTTPException(status_code=400, detail="A funnel needs 1 to 10 steps")
+        if not 1 <= query.days <= 90:
+            raise HTTPException(status_code=400, detail="days must be between 1 and 90")
+        return await funnels.funnel([step.model_dump() for step in query.steps], query.days)
+    
+    
+    @router.get("/admin/analytics/paths")
+    async def get_top_paths(days: int = 7, length: int = 3, limit: int = 20):
+        """Most common opening sequences of steps per session"""
+        if not 1 <= days <= 90 or not 1 <= length <= 10:
+            raise HTTPException(status_code=400, detail="days must be 1..90 and length 1..10")
+        return await funnels.top_paths(days, length, min(limit, 100))
+    
+    
+    # ============== Export Raw Events ==============
+    @router.get("/admin/analytics/export/raw")
+    async def export_raw_events(start: str = None, end: str = None, event_type: str = None,
+                                format: str = "csv", gzip: bool = False):
+        """Stream raw events in [start, end) as CSV or NDJSON, optionally gzip-compressed"""
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+        try:
+            start_at = parse_time(start) if start else None
+            end_at = parse_time(end) if end else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="start and end must be ISO dates or datetimes")
+        
+        filename = f"analytics_events_{utc_now().strftime('%Y%m%d_%H%M%S')}.{format}"
+        headers = {"Content-Disposition": f"attachment; filename={filename}{'.gz' if gzip else ''}"}
+        rows = raw_event_rows(db, analytics_codec, start=start_at, end=end_at, event_type=event_type, archive=analytics_archive)
+        return StreamingResponse(
+            stream_export(rows, fmt=format, compress=gzip),
+            media_type="application/gzip" if gzip else EXPORT_FORMATS[format],
+            headers=headers
+        )
+    
+    
     return router
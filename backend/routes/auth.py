@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from datetime import datetime, timezone
 import uuid
 
@@ -9,7 +9,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def create_auth_routes(db):
+def create_auth_routes(db, rate_limiter):
     router = APIRouter()
     
     @router.post("/auth/register", response_model=UserResponse)
@@ -38,7 +38,9 @@ def create_auth_routes(db):
 
 
     @router.post("/auth/login", response_model=LoginResponse)
-    async def login_user(login_data: UserLogin):
+    async def login_user(login_data: UserLogin, request: Request):
+        await rate_limiter.check_login(request, login_data.email)
+        
         # Allow login by email or username "admin"
         if login_data.email == "admin":
             user = await db.users.find_one({"is_admin": True}, {"_id": 0})
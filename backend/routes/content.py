@@ -1,5 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pymongo import ReturnDocument
 from datetime import datetime, timezone
+import asyncio
+import json
 import uuid
 
 from models import (
@@ -9,12 +13,14 @@ from models import (
     VoteCreate,
     PartyEventCreate, PartyEventUpdate
 )
+from services.contests import record_contest_vote
+from services.analytics_time import parse_time
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def create_content_routes(db):
+def create_content_routes(db, vote_store, vote_broadcaster, contest_windows, rate_limiter, ad_rotation):
     router = APIRouter()
     
     # ============== Hero Images ==============
@@ -112,8 +118,27 @@ def create_content_routes(db):
         return ads
 
 
+    @router.get("/advertisements/select")
+    async def select_advertisements(count: int = 1):
+        """Pick up to `count` ads by weight among those within their schedule and caps"""
+        return await ad_rotation.select(min(max(count, 1), 20))
+
+
+    def validate_ad_rotation(data):
+        if data.weight is not None and data.weight < 0:
+            raise HTTPException(status_code=400, detail="weight must not be negative")
+        try:
+            starts = parse_time(data.starts_at) if data.starts_at else None
+            ends = parse_time(data.ends_at) if data.ends_at else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="starts_at and ends_at must be ISO datetimes")
+        if starts and ends and starts >= ends:
+            raise HTTPException(status_code=400, detail="ends_at must be after starts_at")
+
+
     @router.post("/admin/advertisements")
     async def create_advertisement(data: AdvertisementCreate):
+        validate_ad_rotation(data)
         ad_id = str(uuid.uuid4())
         doc = {
             "id": ad_id,
@@ -122,17 +147,25 @@ def create_content_routes(db):
             "link": data.link,
             "order": data.order,
             "is_active": data.is_active,
+            "weight": data.weight,
+            "max_impressions": data.max_impressions,
+            "daily_cap": data.daily_cap,
+            "starts_at": data.starts_at,
+            "ends_at": data.ends_at,
             "created_at": datetime.now(timezone.utc).isoformat()
         }
         await db.advertisements.insert_one(doc)
+        await ad_rotation.refresh()
         return {"message": "Advertisement created", "id": ad_id}
 
 
     @router.put("/admin/advertisements/{ad_id}")
     async def update_advertisement(ad_id: str, data: AdvertisementUpdate):
+        validate_ad_rotation(data)
         update_data = {k: v for k, v in data.model_dump().items() if v is not None}
         if update_data:
             await db.advertisements.update_one({"id": ad_id}, {"$set": update_data})
+            await ad_rotation.refresh()
         return {"message": "Advertisement updated"}
 
 
@@ -141,12 +174,21 @@ def create_content_routes(db):
         result = await db.advertisements.delete_one({"id": ad_id})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Advertisement not found")
+        await ad_rotation.refresh()
         return {"message": "Advertisement deleted"}
 
 
     # ============== Voting ==============
     @router.post("/vote")
-    async def vote_for_talent(vote: VoteCreate):
+    async def vote_for_talent(vote: VoteCreate, request: Request):
+        await rate_limiter.check("vote", rate_limiter.client_ip(request))
+        
+        if vote.contest_id:
+            # The in-memory window table rejects most invalid votes before any database work
+            reason = await contest_windows.check(vote.contest_id)
+            if reason:
+                raise HTTPException(status_code=400, detail=reason)
+        
         talent = await db.talents.find_one({"id": vote.talent_id})
         if not talent:
             raise HTTPException(status_code=404, detail="Talent not found")
@@ -154,17 +196,49 @@ def create_content_routes(db):
         if not talent.get("is_approved"):
             raise HTTPException(status_code=400, detail="Cannot vote for unapproved talent")
         
-        await db.votes.insert_one({
-            "id": str(uuid.uuid4()),
-            "talent_id": vote.talent_id,
-            "voter_email": vote.voter_email,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        await vote_store.record(vote.talent_id, vote.voter_email, contest_id=vote.contest_id)
+        if vote.contest_id:
+            await record_contest_vote(db, vote.contest_id, vote.talent_id)
+        
+        updated = await db.talents.find_one_and_update(
+            {"id": vote.talent_id},
+            {"$inc": {"votes": 1}},
+            projection={"_id": 0, "votes": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        votes = updated.get("votes", 0) if updated else 0
+        vote_broadcaster.publish(vote.talent_id, votes)
+        return {"message": "Vote recorded", "votes": votes}
+
+
+    @router.get("/votes/stream")
+    async def stream_talent_votes(request: Request, talent_ids: str):
+        """Server-Sent Events stream of live vote counts for the given talents"""
+        ids = list(dict.fromkeys(t for t in talent_ids.split(",") if t))[:50]
+        if not ids:
+            raise HTTPException(status_code=400, detail="talent_ids is required")
+        
+        queue, initial = await vote_broadcaster.subscribe(ids)
         
-        await db.talents.update_one({"id": vote.talent_id}, {"$inc": {"votes": 1}})
+        async def event_stream():
+            try:
+                for talent_id, votes in initial.items():
+                    yield f"event: votes\ndata: {json.dumps({'talent_id': talent_id, 'votes': votes})}\n\n"
+                while not await request.is_disconnected():
+                    try:
+                        update = await asyncio.wait_for(queue.get(), timeout=15)
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield f"event: votes\ndata: {json.dumps(update)}\n\n"
+            finally:
+                vote_broadcaster.unsubscribe(queue, ids)
         
-        updated = await db.talents.find_one({"id": vote.talent_id}, {"_id": 0})
-        return {"message": "Vote recorded", "votes": updated.get("votes", 0)}
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
 
 
     @router.get("/votes/{talent_id}")
@@ -0,0 +1,119 @@
+from fastapi import APIRouter, HTTPException
+from datetime import datetime, timezone
+import uuid
+
+from models import ContestCreate, ContestUpdate
+from services.contests import parse_contest_time, live_standings, close_contest
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def create_contest_routes(db, contest_windows):
+    router = APIRouter()
+
+    async def get_contest_or_404(contest_id: str):
+        contest = await db.contests.find_one({"id": contest_id}, {"_id": 0})
+        if not contest:
+            raise HTTPException(status_code=404, detail="Contest not found")
+        return contest
+
+    def validate_window(starts_at: str, ends_at: str):
+        try:
+            if parse_contest_time(starts_at) >= parse_contest_time(ends_at):
+                raise HTTPException(status_code=400, detail="ends_at must be after starts_at")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="starts_at and ends_at must be ISO datetimes")
+
+
+    @router.get("/contests")
+    async def get_contests(status: str = None):
+        query = {"status": status} if status else {}
+        contests = await db.contests.find(query, {"_id": 0}).sort("starts_at", -1).to_list(100)
+        return contests
+
+
+    @router.get("/contests/{contest_id}")
+    async def get_contest(contest_id: str):
+        return await get_contest_or_404(contest_id)
+
+
+    @router.get("/contests/{contest_id}/results")
+    async def get_contest_results(contest_id: str, limit: int = 50):
+        contest = await get_contest_or_404(contest_id)
+
+        if contest.get("status") == "open" and datetime.now(timezone.utc) >= parse_contest_time(contest["ends_at"]):
+            await close_contest(db, contest)
+            contest_windows.invalidate()
+            contest["status"] = "closed"
+
+        if contest.get("status") == "closed":
+            snapshot = await db.contest_results.find_one({"contest_id": contest_id}, {"_id": 0})
+            if snapshot:
+                snapshot["results"] = snapshot.get("results", [])[:limit]
+                return {"status": "closed", **snapshot}
+
+        return {
+            "status": contest.get("status", "open"),
+            "contest_id": contest_id,
+            "title": contest.get("title", ""),
+            "starts_at": contest.get("starts_at", ""),
+            "ends_at": contest.get("ends_at", ""),
+            "results": await live_standings(db, contest_id, limit=min(limit, 200))
+        }
+
+
+    @router.post("/admin/contests")
+    async def create_contest(data: ContestCreate):
+        validate_window(data.starts_at, data.ends_at)
+        contest_id = str(uuid.uuid4())
+        doc = {
+            "id": contest_id,
+            "title": data.title,
+            "description": data.description,
+            "category": data.category,
+            "award_id": data.award_id,
+            "starts_at": data.starts_at,
+            "ends_at": data.ends_at,
+            "status": "open",
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        await db.contests.insert_one(doc)
+        contest_windows.invalidate()
+        logger.info(f"Contest created: {data.title}")
+        return {"message": "Contest created", "id": contest_id}
+
+
+    @router.put("/admin/contests/{contest_id}")
+    async def update_contest(contest_id: str, data: ContestUpdate):
+        contest = await get_contest_or_404(contest_id)
+        if contest.get("status") == "closed":
+            raise HTTPException(status_code=400, detail="Closed contests cannot be edited")
+
+        update_data = {k: v for k, v in data.model_dump().items() if v is not None}
+        validate_window(update_data.get("starts_at", contest["starts_at"]), update_data.get("ends_at", contest["ends_at"]))
+        if update_data:
+            await db.contests.update_one({"id": contest_id}, {"$set": update_data})
+            contest_windows.invalidate()
+        return {"message": "Contest updated"}
+
+
+    @router.post("/admin/contests/{contest_id}/close")
+    async def close_contest_now(contest_id: str):
+        contest = await get_contest_or_404(contest_id)
+        snapshot = await close_contest(db, contest)
+        contest_windows.invalidate()
+        return {"message": "Contest closed", "total_votes": snapshot.get("total_votes", 0)}
+
+
+    @router.delete("/admin/contests/{contest_id}")
+    async def delete_contest(contest_id: str):
+        result = await db.contests.delete_one({"id": contest_id})
+        if result.deleted_count == 0:
+            raise HTTPException(status_code=404, detail="Contest not found")
+        await db.contest_votes.delete_many({"contest_id": contest_id})
+        await db.contest_results.delete_one({"contest_id": contest_id})
+        contest_windows.invalidate()
+        return {"message": "Contest deleted"}
+
+    return router
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional
 import uuid
@@ -14,7 +14,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def create_talent_routes(db):
+def create_talent_routes(db, rate_limiter):
     router = APIRouter()
     
     @router.post("/talent/register", response_model=TalentResponse)
@@ -78,7 +78,9 @@ def create_talent_routes(db):
 
 
     @router.post("/talent/login", response_model=TalentLoginResponse)
-    async def login_talent(login_data: UserLogin):
+    async def login_talent(login_data: UserLogin, request: Request):
+        await rate_limiter.check_login(request, login_data.email)
+        
         talent = await db.talents.find_one({"email": {"$regex": f"^{login_data.email}$", "$options": "i"}}, {"_id": 0})
         if not talent:
             raise HTTPException(status_code=401, detail="Invalid email or password")
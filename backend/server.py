@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import socket
 import logging
 from pathlib import Path
 
@@ -22,7 +23,7 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app
@@ -36,10 +37,29 @@ from routes import (
     create_auth_routes,
     create_talent_routes,
     create_admin_routes,
-    create_content_routes
+    create_content_routes,
+    create_contest_routes
 )
 from routes.analytics import create_analytics_routes
 from services import TALENT_CATEGORIES
+from services.vote_store import VoteStore, ensure_vote_store_indexes
+from services.vote_stream import VoteBroadcaster
+from services.vote_reconciliation import VoteReconciler, ensure_reconciliation_indexes
+from services.contests import ContestWindows, ContestCloser, ensure_contest_indexes
+from services.rate_limit import create_rate_limiter
+from services.analytics_ingest import AnalyticsIngestor
+from services.analytics_time import AnalyticsRetention
+from services.analytics_codec import EventCodec, ensure_codec_indexes
+from services.analytics_sampling import AdaptiveSampler, parse_floors
+from services.analytics_spool import EventSpool
+from services.analytics_rollups import RollupHook, ensure_rollup_indexes
+from services.hll import UniqueVisitorHook, ensure_hll_indexes
+from services.funnels import PathHook, ensure_path_indexes
+from services.analytics_archive import AnalyticsArchive
+from services.analytics_engine import AnalyticsEngine, ensure_engine_indexes
+from services.ad_impressions import ImpressionCounter
+from services.ad_rotation import AdRotation
+from services.bot_filter import BotFilter
 
 
 # ============== Health Check Endpoint ==============
@@ -59,18 +79,89 @@ async def get_categories():
     return {"categories": TALENT_CATEGORIES}
 
 
+# Token buckets for vote, login and tracking endpoints ("memory" per worker or shared "mongo"),
+# keyed by the X-Forwarded-For entry added by the TRUSTED_PROXY_HOPS-th proxy from the right
+rate_limiter = create_rate_limiter(
+    db,
+    store=os.environ.get('RATE_LIMIT_STORE', 'memory'),
+    max_keys=int(os.environ.get('RATE_LIMIT_MAX_KEYS', '50000')),
+    trusted_proxy_hops=int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))
+)
+
+# Vote storage layout: "document" (one document per vote) or "bucket"
+vote_store = VoteStore(db, layout=os.environ.get('VOTE_STORAGE', 'document'))
+
+# Live vote counts shared by the voting routes
+vote_broadcaster = VoteBroadcaster(db)
+
+# Open contest voting windows, checked before recording contest votes
+contest_windows = ContestWindows(db)
+# Closes contests (results snapshot, award winner) once their ends_at has passed
+contest_closer = ContestCloser(db, contest_windows, interval=float(os.environ.get('CONTEST_CLOSE_INTERVAL', '30')))
+
+# Periodic repair of the denormalized talents.votes counter
+vote_reconciler = VoteReconciler(db, vote_store, interval=float(os.environ.get('VOTE_RECONCILE_INTERVAL', '900')))
+
+# Buffered, batched writes for analytics events
+analytics_ingestor = AnalyticsIngestor(
+    db,
+    queue_size=int(os.environ.get('ANALYTICS_QUEUE_SIZE', '20000')),
+    batch_size=int(os.environ.get('ANALYTICS_BATCH_SIZE', '500')),
+    flush_interval=float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', '1.0')),
+    write_concern=int(os.environ.get('ANALYTICS_WRITE_CONCERN', '0')),
+    write_timeout=float(os.environ.get('ANALYTICS_WRITE_TIMEOUT', '2.0'))
+)
+# Events are kept on local disk while the database is slow or down, then replayed
+analytics_ingestor.spool = EventSpool(os.environ.get('ANALYTICS_SPOOL_DIR', str(ROOT_DIR / 'analytics_spool')))
+analytics_codec = EventCodec(db)
+analytics_ingestor.encoder = analytics_codec.encode
+# Sample events (weighted) once arrivals exceed the target rate in events/second; 0 disables
+ANALYTICS_SAMPLE_TARGET_RATE = float(os.environ.get('ANALYTICS_SAMPLE_TARGET_RATE', '500'))
+if ANALYTICS_SAMPLE_TARGET_RATE > 0:
+    analytics_ingestor.sampler = AdaptiveSampler(
+        target_rate=ANALYTICS_SAMPLE_TARGET_RATE,
+        floors=parse_floors(os.environ.get('ANALYTICS_SAMPLE_FLOORS', ''))
+    )
+analytics_ingestor.batch_hooks.append(RollupHook(db))
+# The spool slot is unique among live workers on this host and survives restarts
+analytics_ingestor.batch_hooks.append(
+    UniqueVisitorHook(db, worker=f"{socket.gethostname()}-{analytics_ingestor.spool.slot}")
+)
+analytics_ingestor.batch_hooks.append(PathHook(db, analytics_codec))
+analytics_archive = AnalyticsArchive(db, os.environ.get('ANALYTICS_ARCHIVE_DIR', str(ROOT_DIR / 'analytics_archive')), analytics_codec)
+analytics_retention = AnalyticsRetention(db, retention_days=int(os.environ.get('ANALYTICS_RETENTION_DAYS', '0')))
+analytics_engine = AnalyticsEngine(db, analytics_codec, window_days=int(os.environ.get('ANALYTICS_ENGINE_DAYS', '30')))
+analytics_ingestor.backfill = analytics_engine.announce
+
+# Crawler / probe events are counted, not stored
+bot_filter = BotFilter(db, max_per_minute=int(os.environ.get('BOT_FILTER_MAX_PER_MINUTE', '120')))
+
+# In-memory ad impression counters, flushed into the rollups
+ad_impressions = ImpressionCounter(
+    db,
+    sample_rate=float(os.environ.get('AD_IMPRESSION_SAMPLE_RATE', '1.0')),
+    flush_interval=float(os.environ.get('AD_IMPRESSION_FLUSH_INTERVAL', '10'))
+)
+
+# Weighted ad selection over the active ads, kept in memory
+ad_rotation = AdRotation(db, ad_impressions)
+
 # Register all route modules
-auth_routes = create_auth_routes(db)
-talent_routes = create_talent_routes(db)
-admin_routes = create_admin_routes(db)
-content_routes = create_content_routes(db)
-analytics_routes = create_analytics_routes(db)
+auth_routes = create_auth_routes(db, rate_limiter)
+talent_routes = create_talent_routes(db, rate_limiter)
+admin_routes = create_admin_routes(db, vote_store)
+content_routes = create_content_routes(db, vote_store, vote_broadcaster, contest_windows, rate_limiter, ad_rotation)
+contest_routes = create_contest_routes(db, contest_windows)
+analytics_routes = create_analytics_routes(
+    db, vote_store, rate_limiter, analytics_ingestor, analytics_archive, analytics_engine, analytics_codec, bot_filter
+)
 
 # Include all routes in the API router
 api_router.include_router(auth_routes)
 api_router.include_router(talent_routes)
 api_router.include_router(admin_routes)
 api_router.include_router(content_routes)
+api_router.include_router(contest_routes)
 api_router.include_router(analytics_routes)
 
 # Include the API router in the main app
@@ -86,6 +177,39 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def start_background_jobs():
+    try:
+        await ensure_reconciliation_indexes(db)
+        await ensure_vote_store_indexes(db)
+        await ensure_contest_indexes(db)
+        await rate_limiter.ensure_indexes()
+        await ensure_codec_indexes(db)
+        await ensure_rollup_indexes(db)
+        await ensure_hll_indexes(db)
+        await ensure_path_indexes(db)
+        await ensure_engine_indexes(db)
+    except Exception as e:
+        logger.error(f"Index creation failed: {e}")
+    vote_reconciler.start()
+    contest_closer.start()
+    analytics_ingestor.spool.start()
+    await analytics_ingestor.start()
+    analytics_retention.start()
+    ad_impressions.start()
+    bot_filter.start()
+    analytics_engine.start()
+
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await analytics_engine.stop()
+    await analytics_retention.stop()
+    await ad_impressions.stop()
+    await bot_filter.stop()
+    await analytics_ingestor.stop()
+    await analytics_ingestor.spool.stop()
+    await vote_reconciler.stop()
+    await contest_closer.stop()
+    await vote_broadcaster.close()
     client.close()
@@ -0,0 +1,101 @@
+"""
+Batched, sampling-aware ad impression counters.
+
+Impressions outnumber clicks by two orders of magnitude, so they never
+become analytics events. record() only adds to an in-memory Counter
+keyed by (day, ad_id); with sample_rate < 1 each impression is kept with
+that probability and counted with weight 1 / sample_rate, which keeps
+the totals unbiased while making record() cheaper still. A background
+task folds the counters into `analytics_rollups` (event_type
+"ad_impression", dim "ad_id", period "day") every `flush_interval`
+seconds; fractional weight left over from sampling is carried into the
+next flush rather than rounded away.
+
+Impressions are deliberately not added to the "all" counters, so the
+traffic totals keep counting page activity only.
+"""
+from collections import Counter
+import asyncio
+import random
+
+from services.analytics_rollups import apply_rollups
+from services.analytics_time import day_start, utc_now
+
+import logging
+logger = logging.getLogger(__name__)
+
+IMPRESSION_EVENT = "ad_impression"
+
+
+class ImpressionCounter:
+    def __init__(self, db, sample_rate: float = 1.0, flush_interval: float = 10.0):
+        self.db = db
+        self.sample_rate = min(max(sample_rate, 0.001), 1.0)
+        self.flush_interval = flush_interval
+        self.pending = Counter()  # (day, ad_id) -> weighted impressions
+        self.stats = {"recorded": 0, "flushed": 0, "failed_flushes": 0}
+        self._task = None
+
+    def record(self, ad_ids, weight: float = 1.0):
+        """Count one impression of each ad in `ad_ids`."""
+        if self.sample_rate < 1.0:
+            if random.random() >= self.sample_rate:
+                return
+            weight /= self.sample_rate
+        day = day_start(utc_now())
+        for ad_id in ad_ids:
+            self.pending[(day, ad_id)] += weight
+        self.stats["recorded"] += len(ad_ids)
+
+    async def flush(self):
+        counts = Counter()
+        carry = Counter()
+        for (day, ad_id), weight in self.pending.items():
+            whole = int(weight)
+            if whole:
+                counts[("day", day, IMPRESSION_EVENT, "ad_id", ad_id)] = whole
+            if weight - whole:
+                carry[(day, ad_id)] = weight - whole
+        if not counts:
+            return
+        self.pending = carry
+        try:
+            await apply_rollups(self.db, counts)
+            self.stats["flushed"] += sum(counts.values())
+        except Exception as e:
+            # Put the counts back so the next flush retries them
+            self.stats["failed_flushes"] += 1
+            for (_, day, _, _, ad_id), n in counts.items():
+                self.pending[(day, ad_id)] += n
+            logger.error(f"Ad impression flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+async def ctr_by_day(db, start=None) -> dict:
+    """{ad_id: {day: {"impressions", "clicks"}}} from the daily ad_id rollups."""
+    match = {"period": "day", "dim": "ad_id", "event_type": {"$in": [IMPRESSION_EVENT, "ad_click"]}}
+    if start:
+        match["start"] = {"$gte": day_start(start)}
+    report = {}
+    async for doc in db.analytics_rollups.find(match, {"_id": 0, "start": 1, "event_type": 1, "value": 1, "count": 1}):
+        day = report.setdefault(doc["value"], {}).setdefault(doc["start"], {"impressions": 0, "clicks": 0})
+        day["impressions" if doc["event_type"] == IMPRESSION_EVENT else "clicks"] += doc["count"]
+    return report
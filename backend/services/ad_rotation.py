@@ -0,0 +1,157 @@
+"""
+Weighted ad selection served from memory.
+
+AdRotation keeps the active ads, their impression totals and an alias
+table (Vose's method) over the currently eligible ones, so picking an ad
+is one randrange and one random() whatever the number of ads. An ad is
+eligible while it is inside its optional starts_at / ends_at window and
+under its optional max_impressions (lifetime) and daily_cap limits.
+
+Impression totals are loaded from the rollups on refresh and advanced
+locally for every ad served, so caps hold per worker and are
+reconciled across workers on the next refresh (every `refresh_interval`
+seconds, and immediately after an admin write on this worker). The
+table is rebuilt only when an ad reaches a cap or a schedule boundary
+passes. Requests that find the table stale while another one reloads it
+wait for that reload instead of starting their own.
+"""
+from datetime import datetime, timedelta
+import asyncio
+import random
+import time
+
+from services.ad_impressions import IMPRESSION_EVENT
+from services.analytics_time import day_start, parse_time, utc_now
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class AliasTable:
+    """O(1) sampling from a discrete distribution (Vose's alias method)."""
+
+    def __init__(self, weights: list):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self) -> int:
+        i = random.randrange(len(self.prob))
+        return i if random.random() < self.prob[i] else self.alias[i]
+
+
+class AdRotation:
+    def __init__(self, db, impressions, refresh_interval: float = 60.0):
+        self.db = db
+        self.impressions = impressions
+        self.refresh_interval = refresh_interval
+        self.ads = []
+        self.totals = {}   # ad_id -> impressions to date
+        self.today = {}    # ad_id -> impressions today
+        self.eligible = []
+        self.table = None
+        self._day = None
+        self._next_boundary = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _stale(self) -> bool:
+        return time.monotonic() - self._loaded_at >= self.refresh_interval
+
+    async def refresh(self):
+        async with self._lock:
+            await self._load()
+
+    async def _load(self):
+        ads = await self.db.advertisements.find({"is_active": True}, {"_id": 0}).sort("order", 1).to_list(100)
+        today = day_start(utc_now())
+        totals, daily = {}, {}
+        async for doc in self.db.analytics_rollups.find(
+            {"period": "day", "dim": "ad_id", "event_type": IMPRESSION_EVENT, "value": {"$in": [a["id"] for a in ads]}},
+            {"_id": 0, "start": 1, "value": 1, "count": 1}
+        ):
+            totals[doc["value"]] = totals.get(doc["value"], 0) + doc["count"]
+            if doc["start"] >= today:
+                daily[doc["value"]] = daily.get(doc["value"], 0) + doc["count"]
+        # Impressions counted on this worker but not flushed yet
+        for (day, ad_id), weight in self.impressions.pending.items():
+            totals[ad_id] = totals.get(ad_id, 0) + weight
+            if day >= today:
+                daily[ad_id] = daily.get(ad_id, 0) + weight
+
+        for ad in ads:
+            ad["_window"] = (
+                parse_time(ad["starts_at"]) if ad.get("starts_at") else None,
+                parse_time(ad["ends_at"]) if ad.get("ends_at") else None
+            )
+        self.ads, self.totals, self.today, self._day = ads, totals, daily, today
+        self._rebuild(utc_now())
+        self._loaded_at = time.monotonic()
+
+    def _capped(self, ad: dict) -> bool:
+        if ad.get("max_impressions") and self.totals.get(ad["id"], 0) >= ad["max_impressions"]:
+            return True
+        return bool(ad.get("daily_cap")) and self.today.get(ad["id"], 0) >= ad["daily_cap"]
+
+    def _rebuild(self, now: datetime):
+        eligible = []
+        boundaries = [self._day + timedelta(days=1)]
+        for ad in self.ads:
+            starts, ends = ad["_window"]
+            boundaries.extend(t for t in (starts, ends) if t and t > now)
+            if (starts and now < starts) or (ends and now >= ends) or self._capped(ad):
+                continue
+            if ad.get("weight", 1.0) > 0:
+                eligible.append(ad)
+        self.eligible = eligible
+        self.table = AliasTable([ad.get("weight", 1.0) for ad in eligible]) if eligible else None
+        self._next_boundary = min(boundaries)
+
+    async def select(self, count: int = 1) -> list:
+        """Pick up to `count` distinct eligible ads by weight and count their impressions."""
+        if self._stale():
+            async with self._lock:
+                # Requests queued behind a reload reuse it instead of reloading again
+                if self._stale():
+                    await self._load()
+        now = utc_now()
+        if now >= self._next_boundary:
+            if day_start(now) != self._day:
+                self._day, self.today = day_start(now), {}
+            self._rebuild(now)
+        if not self.table:
+            return []
+
+        count = min(count, len(self.eligible))
+        picked = []
+        seen = set()
+        # Rejection sampling for distinct ads; bounded so heavy skew cannot loop for long
+        for _ in range(count * 20):
+            i = self.table.sample()
+            if i not in seen:
+                seen.add(i)
+                picked.append(self.eligible[i])
+                if len(picked) == count:
+                    break
+
+        capped = False
+        for ad in picked:
+            self.totals[ad["id"]] = self.totals.get(ad["id"], 0) + 1
+            self.today[ad["id"]] = self.today.get(ad["id"], 0) + 1
+            capped = capped or self._capped(ad)
+        if capped:
+            self._rebuild(now)
+        self.impressions.record([ad["id"] for ad in picked])
+        return [{k: v for k, v in ad.items() if k != "_window"} for ad in picked]
@@ -0,0 +1,213 @@
+"""
+Cold storage for old raw analytics events.
+
+archive() moves events from whole UTC days before a cutoff into
+compressed NumPy files partitioned by date:
+
+    <root>/date=2025-01-31/part-<first _id>.npz
+
+Each part holds up to `batch_size` events as columns: `_id` (12-byte
+ObjectIds), `created_at` (int64 epoch milliseconds), `w` (int32 sample
+weight; parts written before sampling have none and count 1) and one
+dictionary-encoded pair per string field (`<field>.codes` int32, -1 for
+missing, and `<field>.values`). Parts are written to a temporary name and
+renamed into place, then recorded as `pending` in job_state before their
+events are deleted from Mongo in batches. A crash between the two steps
+is repaired on the next run by deleting the pending part's ids again, so
+events are never lost or archived twice. `archived_before` in job_state
+is the day up to which everything has been moved.
+
+Rollups and unique-visitor sketches are left untouched, so dashboards
+built on them keep covering archived days. Raw reads (the export and the
+fractional-timezone chart path) combine rows() / bucket_counts() with
+live data.
+"""
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from bson import ObjectId
+import asyncio
+import numpy as np
+import os
+
+from services.analytics_time import created_between, day_start, event_time, utc_now
+
+import logging
+logger = logging.getLogger(__name__)
+
+JOB_ID = "analytics_archive"
+ARCHIVE_FIELDS = (
+    "id", "event_type", "page", "talent_id", "party_id", "ad_id",
+    "session_id", "user_agent", "referrer"
+)
+
+
+def to_millis(dt: datetime) -> int:
+    return int(dt.timestamp() * 1000)
+
+
+def from_millis(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def encode_column(values: list):
+    """Dictionary-encode a list of optional strings into (codes, values)."""
+    lookup = {}
+    codes = np.full(len(values), -1, dtype=np.int32)
+    for i, value in enumerate(values):
+        if value is not None:
+            codes[i] = lookup.setdefault(str(value), len(lookup))
+    return codes, np.array(list(lookup) or [""], dtype=np.str_)
+
+
+def write_part(path: Path, events: list):
+    columns = {
+        "_id": np.array([e["_id"].binary for e in events], dtype="S12"),
+        "created_at": np.array([to_millis(e["created_at"]) for e in events], dtype=np.int64),
+        "w": np.array([e.get("w", 1) for e in events], dtype=np.int32),
+    }
+    for field in ARCHIVE_FIELDS:
+        codes, values = encode_column([e.get(field) for e in events])
+        columns[f"{field}.codes"] = codes
+        columns[f"{field}.values"] = values
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **columns)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_part(path: Path) -> dict:
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def part_mask(part: dict, start_ms: int = None, end_ms: int = None, event_type: str = None) -> np.ndarray:
+    created = part["created_at"]
+    mask = np.ones(len(created), dtype=bool)
+    if start_ms is not None:
+        mask &= created >= start_ms
+    if end_ms is not None:
+        mask &= created < end_ms
+    if event_type:
+        matches = np.flatnonzero(part["event_type.values"] == event_type)
+        mask &= np.isin(part["event_type.codes"], matches)
+    return mask
+
+
+class AnalyticsArchive:
+    def __init__(self, db, root, codec):
+        self.db = db
+        self.root = Path(root)
+        self.codec = codec
+
+    # ============== Writing ==============
+    async def _state(self) -> dict:
+        return await self.db.job_state.find_one({"id": JOB_ID}, {"_id": 0}) or {}
+
+    async def _delete_archived(self, ids: list, batch_size: int):
+        for i in range(0, len(ids), batch_size):
+            await self.db.analytics.delete_many({"_id": {"$in": ids[i:i + batch_size]}})
+
+    async def _finish_pending(self, pending: str, delete_batch: int):
+        part = await asyncio.to_thread(read_part, self.root / pending)
+        ids = [ObjectId(bytes(oid)) for oid in part["_id"]]
+        await self._delete_archived(ids, delete_batch)
+        await self.db.job_state.update_one({"id": JOB_ID}, {"$unset": {"pending": ""}})
+
+    async def archive(self, before: datetime, batch_size: int = 50000, delete_batch: int = 5000,
+                      max_parts: int = 20) -> dict:
+        """Move events from whole days before `before` into the archive, up to `max_parts` parts."""
+        cutoff = day_start(before)
+        state = await self._state()
+        if state.get("pending"):
+            await self._finish_pending(state["pending"], delete_batch)
+
+        parts = 0
+        archived = 0
+        while parts < max_parts:
+            oldest = await self.db.analytics.find(
+                created_between(end=cutoff), {"_id": 1, "created_at": 1}
+            ).sort("_id", 1).limit(1).to_list(1)
+            if not oldest:
+                break
+            day = day_start(event_time(oldest[0]))
+            docs = await self.db.analytics.find(
+                created_between(day, day + timedelta(days=1))
+            ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            events = await self.codec.decode(docs)
+
+            relative = f"date={day.strftime('%Y-%m-%d')}/part-{events[0]['_id']}.npz"
+            await asyncio.to_thread(write_part, self.root / relative, events)
+            await self.db.job_state.update_one(
+                {"id": JOB_ID}, {"$set": {"pending": relative}}, upsert=True
+            )
+            await self._delete_archived([e["_id"] for e in events], delete_batch)
+            await self.db.job_state.update_one(
+                {"id": JOB_ID},
+                {"$unset": {"pending": ""}, "$max": {"archived_before": day}, "$set": {"updated_at": utc_now()}}
+            )
+            parts += 1
+            archived += len(events)
+
+        remaining = await self.db.analytics.count_documents(created_between(end=cutoff))
+        if not remaining:
+            await self.db.job_state.update_one(
+                {"id": JOB_ID}, {"$max": {"archived_before": cutoff}}, upsert=True
+            )
+        logger.info(f"Archived {archived} analytics events in {parts} parts, {remaining} remaining before {cutoff.date()}")
+        return {"archived": archived, "parts": parts, "remaining": remaining}
+
+    # ============== Reading ==============
+    def partitions(self, start: datetime = None, end: datetime = None) -> list:
+        """Part files whose date partition overlaps [start, end), oldest first."""
+        if not self.root.exists():
+            return []
+        first = day_start(start.astimezone(timezone.utc)).strftime("%Y-%m-%d") if start else ""
+        last = None
+        if end:
+            end = end.astimezone(timezone.utc)
+            last_day = day_start(end) if day_start(end) == end else day_start(end) + timedelta(days=1)
+            last = last_day.strftime("%Y-%m-%d")
+        parts = []
+        for directory in sorted(self.root.glob("date=*")):
+            day = directory.name[5:]
+            if day < first or (last and day >= last):
+                continue
+            parts.extend(sorted(directory.glob("part-*.npz")))
+        return parts
+
+    async def rows(self, start: datetime = None, end: datetime = None, event_type: str = None):
+        """Archived events in [start, end) as dicts, oldest partition first."""
+        start_ms = to_millis(start) if start else None
+        end_ms = to_millis(end) if end else None
+        for path in self.partitions(start, end):
+            part = await asyncio.to_thread(read_part, path)
+            for i in np.flatnonzero(part_mask(part, start_ms, end_ms, event_type)):
+                event = {"created_at": from_millis(int(part["created_at"][i])), "w": int(part["w"][i]) if "w" in part else 1}
+                for field in ARCHIVE_FIELDS:
+                    code = part[f"{field}.codes"][i]
+                    event[field] = str(part[f"{field}.values"][code]) if code >= 0 else None
+                yield event
+
+    async def bucket_counts(self, start: datetime, bucket, event_type: str = None, end: datetime = None) -> dict:
+        """{bucket key: count} for archived events in [start, end), bucketing with bucket(datetime).
+
+        Every UTC offset is a multiple of 15 minutes, so events are grouped
+        by quarter-hour slot and only the distinct slots are mapped to buckets.
+        """
+        counts = {}
+        start_ms = to_millis(start)
+        end_ms = to_millis(end) if end else None
+        for path in self.partitions(start, end):
+            part = await asyncio.to_thread(read_part, path)
+            mask = part_mask(part, start_ms, end_ms, event_type)
+            slots, inverse = np.unique(part["created_at"][mask] // 900000, return_inverse=True)
+            weights = part["w"][mask] if "w" in part else None
+            slot_counts = np.bincount(inverse, weights=weights, minlength=len(slots)).astype(np.int64)
+            for slot, n in zip(slots.tolist(), slot_counts.tolist()):
+                key = bucket(from_millis(slot * 900000))
+                counts[key] = counts.get(key, 0) + n
+        return counts
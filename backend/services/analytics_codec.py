@@ -0,0 +1,249 @@
+"""
+Compact storage encoding for analytics events.
+
+Stored events carry no `id` and no `created_at`: the ObjectId `_id`,
+generated when the event is queued, is both the identity and the
+timestamp (second precision). Fields that are empty or None are left
+out, event_type is a small integer (EVENT_TYPE_CODES; types without a
+code are stored as strings) and user_agent / referrer are replaced by
+integer codes interned in `analytics_dimensions`:
+
+    {"_id": ObjectId, "event_type": 1, "page": "/", "session_id": "...",
+     "user_agent": 17, "referrer": 4}
+
+Events kept by adaptive sampling also carry their integer sample weight
+`w` (see analytics_sampling); decoded events always have one, 1 if absent.
+
+Referrers are interned without their query string and fragment
+(normalize_referrer): tracking parameters such as fbclid or utm_* make
+nearly every full URL unique, which would grow `analytics_dimensions`
+and its indexes without bound, while the reports only use the domain.
+
+Codes are allocated in blocks from a counter document and cached in
+memory both ways in an LRU of `max_cached` values per kind, so a batch
+costs at most one lookup query per kind and usually none. codes_for()
+and values_for() answer from a dict built during the call, so evictions
+made while serving a batch never drop codes from that batch. decode()
+turns stored documents, compact or legacy, back into the logical event
+shape the routes expect, including `id` (the legacy uuid or the
+ObjectId string) and `created_at`.
+
+This encoding supersedes storing `created_at` as a BSON datetime under a
+TTL index. migrate_compact() converts documents with either an ISO
+string or a datetime `created_at` (the old migrate-dates endpoint now
+runs it too), and AnalyticsRetention (analytics_time) takes over from
+the TTL index.
+"""
+from collections import OrderedDict
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument, ReplaceOne, InsertOne, DeleteOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from services.analytics_time import event_time
+
+import logging
+logger = logging.getLogger(__name__)
+
+EVENT_TYPE_CODES = {"page_view": 1, "talent_view": 2, "party_view": 3, "ad_click": 4, "vote": 5}
+EVENT_TYPE_NAMES = {code: name for name, code in EVENT_TYPE_CODES.items()}
+INTERNED_FIELDS = ("user_agent", "referrer")
+EVENT_FIELDS = ("event_type", "page", "talent_id", "party_id", "ad_id", "session_id", "user_agent", "referrer")
+# Longest user agent / referrer kept; anything longer is junk or an attack
+MAX_INTERNED_LENGTH = 512
+
+
+def normalize_referrer(referrer: str) -> str:
+    """Referrer URL without query string or fragment."""
+    return referrer.split("#", 1)[0].split("?", 1)[0]
+
+
+def interned_value(kind: str, value: str) -> str:
+    """The form of `value` that is interned for `kind`."""
+    if kind == "referrer":
+        value = normalize_referrer(value)
+    return value[:MAX_INTERNED_LENGTH]
+
+
+def event_type_match(event_type: str) -> dict:
+    """Filter matching `event_type` in both compact and legacy documents."""
+    code = EVENT_TYPE_CODES.get(event_type)
+    return {"event_type": {"$in": [code, event_type]}} if code else {"event_type": event_type}
+
+
+def decode_basic(doc: dict) -> dict:
+    """Logical event from a stored document, leaving interned fields as codes."""
+    event = {"_id": doc["_id"], **{field: doc.get(field) for field in EVENT_FIELDS}}
+    event["event_type"] = EVENT_TYPE_NAMES.get(event["event_type"], event["event_type"])
+    event["id"] = doc.get("id") or str(doc["_id"])
+    event["created_at"] = event_time(doc)
+    event["w"] = doc.get("w", 1)
+    return event
+
+
+async def ensure_codec_indexes(db):
+    await db.analytics_dimensions.create_index([("kind", ASCENDING), ("value", ASCENDING)], unique=True)
+    await db.analytics_dimensions.create_index([("kind", ASCENDING), ("code", ASCENDING)], unique=True)
+
+
+class EventCodec:
+    def __init__(self, db, max_cached: int = 100000):
+        self.db = db
+        self.max_cached = max_cached
+        # Other kinds (e.g. funnels' path steps) get their tables on first use
+        self._codes = {}   # kind -> value -> code, least recently used first
+        self._values = {}  # kind -> code -> value
+
+    def _tables(self, kind: str) -> tuple:
+        if kind not in self._codes:
+            self._codes[kind] = OrderedDict()
+            self._values[kind] = {}
+        return self._codes[kind], self._values[kind]
+
+    def _remember(self, kind: str, value: str, code: int):
+        codes, values = self._tables(kind)
+        codes[value] = code
+        codes.move_to_end(value)
+        values[code] = value
+        while len(codes) > self.max_cached:
+            _, evicted = codes.popitem(last=False)
+            values.pop(evicted, None)
+
+    async def _allocate(self, kind: str, values: list) -> dict:
+        counter = await self.db.analytics_counters.find_one_and_update(
+            {"_id": kind}, {"$inc": {"seq": len(values)}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        first = counter["seq"] - len(values) + 1
+        docs = [{"kind": kind, "value": value, "code": first + i} for i, value in enumerate(values)]
+        try:
+            await self.db.analytics_dimensions.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+            # Another worker interned some of these first; their codes win
+        found = {}
+        async for doc in self.db.analytics_dimensions.find({"kind": kind, "value": {"$in": values}}):
+            found[doc["value"]] = doc["code"]
+            self._remember(kind, doc["value"], doc["code"])
+        return found
+
+    async def codes_for(self, kind: str, values) -> dict:
+        """{value: code} for every value, interning the ones never seen before."""
+        known, _ = self._tables(kind)
+        found = {}
+        for value in set(values):
+            code = known.get(value)
+            if code is not None:
+                known.move_to_end(value)
+                found[value] = code
+        missing = [v for v in set(values) if v not in found]
+        if missing:
+            async for doc in self.db.analytics_dimensions.find({"kind": kind, "value": {"$in": missing}}):
+                found[doc["value"]] = doc["code"]
+                self._remember(kind, doc["value"], doc["code"])
+            unseen = [v for v in missing if v not in found]
+            if unseen:
+                found.update(await self._allocate(kind, unseen))
+        return found
+
+    async def values_for(self, kind: str, codes) -> dict:
+        """{code: value} for the codes that exist."""
+        known_codes, known = self._tables(kind)
+        found = {}
+        for code in set(codes):
+            value = known.get(code)
+            if value is not None:
+                known_codes.move_to_end(value)
+                found[code] = value
+        missing = [c for c in set(codes) if c not in found]
+        if missing:
+            async for doc in self.db.analytics_dimensions.find({"kind": kind, "code": {"$in": missing}}):
+                found[doc["code"]] = doc["value"]
+                self._remember(kind, doc["value"], doc["code"])
+        return found
+
+    async def encode(self, events: list) -> list:
+        """Stored documents for a batch of logical events (each already carrying its _id)."""
+        interned = {}
+        for kind in INTERNED_FIELDS:
+            values = {interned_value(kind, e[kind]) for e in events if e.get(kind)}
+            interned[kind] = await self.codes_for(kind, values) if values else {}
+
+        docs = []
+        for event in events:
+            doc = {"_id": event["_id"]}
+            for field in EVENT_FIELDS:
+                value = event.get(field)
+                if not value:
+                    continue
+                if field == "event_type":
+                    value = EVENT_TYPE_CODES.get(value, value)
+                elif field in interned:
+                    value = interned[field][interned_value(field, value)]
+                doc[field] = value
+            if event.get("w", 1) != 1:
+                doc["w"] = event["w"]
+            docs.append(doc)
+        return docs
+
+    async def decode(self, docs: list) -> list:
+        """Logical events for stored documents, resolving interned codes in one query per kind."""
+        events = [decode_basic(doc) for doc in docs]
+        for kind in INTERNED_FIELDS:
+            codes = {e[kind] for e in events if isinstance(e[kind], int)}
+            if not codes:
+                continue
+            values = await self.values_for(kind, codes)
+            for event in events:
+                if isinstance(event[kind], int):
+                    event[kind] = values.get(event[kind])
+        return events
+
+
+LEGACY_FILTER = {"$or": [{"created_at": {"$exists": True}}, {"id": {"$exists": True}}]}
+
+
+async def migrate_compact(db, codec: EventCodec, batch_size: int = 5000, max_batches: int = 20) -> dict:
+    """Rewrite legacy documents in the compact encoding, one batch at a time.
+
+    A document keeps its _id when that already dates it to within a minute
+    of its created_at; otherwise it is re-inserted under an _id carrying
+    the created_at timestamp.
+    """
+    converted = 0
+    for _ in range(max_batches):
+        docs = await db.analytics.find(LEGACY_FILTER).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+
+        events = []
+        for doc in docs:
+            event = decode_basic(doc)
+            created = event["created_at"]
+            if abs((created - doc["_id"].generation_time).total_seconds()) <= 60:
+                event["_id"] = doc["_id"]
+            else:
+                event["_id"] = ObjectId(ObjectId.from_datetime(created).binary[:4] + doc["_id"].binary[4:])
+            events.append(event)
+
+        ops = []
+        for doc, encoded in zip(docs, await codec.encode(events)):
+            if encoded["_id"] == doc["_id"]:
+                ops.append(ReplaceOne({"_id": doc["_id"]}, encoded))
+            else:
+                ops.extend([InsertOne(encoded), DeleteOne({"_id": doc["_id"]})])
+        try:
+            await db.analytics.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # Re-inserts left over from an interrupted run
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        converted += len(docs)
+
+    remaining = await db.analytics.count_documents(LEGACY_FILTER)
+    if not remaining:
+        try:
+            await db.analytics.drop_index("created_at_1")
+        except OperationFailure:
+            pass
+    logger.info(f"Converted {converted} analytics events to the compact encoding, {remaining} remaining")
+    return {"converted": converted, "remaining": remaining}
@@ -0,0 +1,333 @@
+"""
+In-memory columnar engine for ad-hoc analytics queries.
+
+The last `window_days` of events are held as NumPy arrays: a timestamp
+column (int64 epoch milliseconds) and one int32 column per dimension,
+dictionary-encoded so each distinct page, id or referrer is stored once.
+Before a query runs, events inserted since the previous refresh are
+appended by reading `_id > last_id`; the read stops `settle_seconds`
+behind now so batches still being flushed by other workers are not
+skipped. start() runs the first, full load in the background, and rows
+are appended in a thread, so neither blocks the event loop. Rows that
+fall out of the window are compacted away once they make up a quarter
+of the store, and the dictionaries are rebuilt from the codes still in
+use. A weight column holds each event's sample weight, and counts sum
+it; uniques are distinct sessions.
+
+Events inserted with an _id more than `settle_seconds` old (spool
+replays, batches that waited in a backed-up queue) can land behind
+`last_id`. The ingestor passes such inserts to announce(), which lists
+their ids in `analytics_backfills`; every engine reads new notices on
+refresh and loads the ids it has passed without loading. Whether it
+loaded an id is decided from a history of (query start, last_id) per
+read: the read that moved `last_id` past the id saw it if it started
+after the insert did.
+
+A query is a filter mask, a composite int64 group key built from the
+group-by codes (and the time bucket), and a bincount (or a sort when
+the key space is too large for a dense array) over it, so slicing
+millions of rows never touches Mongo.
+"""
+from datetime import datetime, timedelta, timezone
+from bisect import bisect_left
+from bson import ObjectId
+import asyncio
+import numpy as np
+import time
+
+from services.analytics_time import utc_now
+
+import logging
+logger = logging.getLogger(__name__)
+
+ENGINE_DIMENSIONS = ("event_type", "page", "talent_id", "party_id", "ad_id", "referrer", "session_id")
+ENGINE_METRICS = ("count", "uniques")
+BUCKET_MS = {"hour": 3600 * 1000, "day": 86400 * 1000}
+# Largest group-key space counted with dense arrays instead of sorting
+DENSE_LIMIT = 1 << 24
+# Upper bound on time buckets in one group key (a 30-day window has 720 hours)
+MAX_BUCKETS = 100000
+# Backfill notices, and the read history they are checked against, are kept this long
+BACKFILL_RETENTION = timedelta(days=1)
+# Notices are re-read this far back, since workers' clocks (and so their _ids) are not in step
+NOTICE_SLACK = timedelta(minutes=5)
+
+
+async def ensure_engine_indexes(db):
+    await db.analytics_backfills.create_index("began", expireAfterSeconds=int(BACKFILL_RETENTION.total_seconds()))
+
+
+def sorted_counts(values: np.ndarray):
+    """(distinct values, run lengths) of an already sorted array."""
+    if not len(values):
+        return values, np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    return values[starts], np.diff(np.append(starts, len(values)))
+
+
+class Dictionary:
+    """Value <-> int32 code mapping for one dimension; code 0 is "missing"."""
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: 0}
+
+    def encode(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, values) -> list:
+        return [self.codes[v] for v in values if v in self.codes]
+
+    def rebuilt(self, used: np.ndarray):
+        """(Dictionary of only the `used` codes, old code -> new code array)."""
+        used = used[used > 0]
+        fresh = Dictionary()
+        remap = np.zeros(len(self.values), dtype=np.int32)
+        for code in used.tolist():
+            remap[code] = fresh.encode(self.values[code])
+        return fresh, remap
+
+
+class AnalyticsEngine:
+    def __init__(self, db, codec, window_days: int = 30, refresh_interval: float = 2.0, settle_seconds: float = 5.0,
+                 refresh_batch: int = 20000):
+        self.db = db
+        self.codec = codec
+        self.window = timedelta(days=window_days)
+        self.refresh_interval = refresh_interval
+        self.settle = timedelta(seconds=settle_seconds)
+        self.refresh_batch = refresh_batch
+        self.dictionaries = {dim: Dictionary() for dim in ENGINE_DIMENSIONS}
+        self.size = 0
+        self.ts = np.empty(0, dtype=np.int64)
+        self.columns = {dim: np.empty(0, dtype=np.int32) for dim in ENGINE_DIMENSIONS}
+        self.weights = np.empty(0, dtype=np.int32)
+        self.last_id = None
+        self._refreshed_at = 0.0
+        self._lock = asyncio.Lock()
+        self._reads = []         # (query start, last_id after the read) for backfill checks
+        self._notices_from = None
+        self._seen_notices = set()
+        self._task = None
+
+    def start(self):
+        """Load the window in the background so the first query does not have to."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._warm_up())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _warm_up(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Analytics engine warm-up failed: {e}")
+
+    # ============== Loading ==============
+    def _reserve(self, extra: int):
+        needed = self.size + extra
+        if needed <= len(self.ts):
+            return
+        capacity = max(needed, 2 * len(self.ts), 1024)
+        self.ts = np.resize(self.ts, capacity)
+        self.weights = np.resize(self.weights, capacity)
+        for dim in ENGINE_DIMENSIONS:
+            self.columns[dim] = np.resize(self.columns[dim], capacity)
+
+    def _append(self, events: list):
+        self._reserve(len(events))
+        n = len(events)
+        rows = slice(self.size, self.size + n)
+        self.ts[rows] = [int(e["created_at"].timestamp() * 1000) for e in events]
+        self.weights[rows] = [e.get("w", 1) for e in events]
+        for dim in ENGINE_DIMENSIONS:
+            encode = self.dictionaries[dim].encode
+            self.columns[dim][rows] = [encode(e.get(dim) or None) for e in events]
+        self.size += n
+
+    def _compacted(self, cutoff_ms: int):
+        """The store without rows before `cutoff_ms`, or None while too few have expired."""
+        expired = int(np.count_nonzero(self.ts[:self.size] < cutoff_ms))
+        if expired * 4 < self.size:
+            return None
+        keep = np.flatnonzero(self.ts[:self.size] >= cutoff_ms)
+        columns, dictionaries = {}, {}
+        for dim in ENGINE_DIMENSIONS:
+            column = self.columns[dim][keep]
+            dictionaries[dim], remap = self.dictionaries[dim].rebuilt(np.unique(column))
+            columns[dim] = remap[column]
+        return self.ts[keep], self.weights[keep], columns, dictionaries
+
+    def _compact(self, compacted):
+        # Swapped in on the event loop, so a query never sees half of it
+        self.ts, self.weights, self.columns, self.dictionaries = compacted
+        self.size = len(self.ts)
+
+    async def announce(self, ids: list, began: datetime):
+        """Record inserted ids old enough that engines may already have read past them."""
+        late = [i for i in ids if i.generation_time < began - self.settle]
+        if late:
+            await self.db.analytics_backfills.insert_one({"began": began, "ids": late})
+
+    def _loaded(self, event_id: ObjectId, began: datetime) -> bool:
+        """Whether a read that started after `began` loaded `event_id` (which is <= last_id)."""
+        i = bisect_left(self._reads, event_id, key=lambda read: read[1])
+        return i < len(self._reads) and self._reads[i][0] > began
+
+    async def _missed_backfills(self, now: datetime) -> list:
+        since = self._notices_from
+        self._notices_from = now
+        if since is None:
+            # Everything inserted before the first read is loaded by it
+            return []
+        missed = []
+        window_start = ObjectId.from_datetime(now - self.window)
+        async for notice in self.db.analytics_backfills.find({"_id": {"$gte": ObjectId.from_datetime(since - NOTICE_SLACK)}}):
+            if notice["_id"] in self._seen_notices:
+                continue
+            self._seen_notices.add(notice["_id"])
+            missed.extend(
+                i for i in notice["ids"]
+                if window_start <= i <= self.last_id and not self._loaded(i, notice["began"])
+            )
+        self._seen_notices = {i for i in self._seen_notices if i.generation_time >= now - NOTICE_SLACK}
+        del self._reads[:bisect_left(self._reads, now - BACKFILL_RETENTION, key=lambda read: read[0])]
+        return missed
+
+    async def refresh(self):
+        """Append events inserted since the last refresh, and backfilled events read past earlier."""
+        async with self._lock:
+            now = utc_now()
+            loaded = 0
+            missed = await self._missed_backfills(now) if self.last_id else []
+            for i in range(0, len(missed), self.refresh_batch):
+                docs = await self.db.analytics.find({"_id": {"$in": missed[i:i + self.refresh_batch]}}).to_list(None)
+                await asyncio.to_thread(self._append, await self.codec.decode(docs))
+                loaded += len(docs)
+
+            upper = ObjectId.from_datetime(now - self.settle)
+            lower = self.last_id or ObjectId.from_datetime(now - self.window)
+            id_range = {"$gt": lower, "$lt": upper} if self.last_id else {"$gte": lower, "$lt": upper}
+            while True:
+                started = utc_now()
+                docs = await self.db.analytics.find(
+                    {"_id": id_range}
+                ).sort("_id", 1).limit(self.refresh_batch).to_list(self.refresh_batch)
+                if not docs:
+                    break
+                await asyncio.to_thread(self._append, await self.codec.decode(docs))
+                loaded += len(docs)
+                self.last_id = docs[-1]["_id"]
+                self._reads.append((started, self.last_id))
+                id_range = {"$gt": self.last_id, "$lt": upper}
+            if self._notices_from is None:
+                self._notices_from = now
+
+            compacted = await asyncio.to_thread(self._compacted, int((now - self.window).timestamp() * 1000))
+            if compacted:
+                self._compact(compacted)
+            self._refreshed_at = time.monotonic()
+            if loaded:
+                logger.info(f"Analytics engine loaded {loaded} events ({self.size} in memory)")
+
+    # ============== Querying ==============
+    async def query(self, metric: str = "count", group_by=(), filters: dict = None,
+                    start: datetime = None, end: datetime = None, bucket: str = None, limit: int = 100) -> dict:
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            await self.refresh()
+
+        began = time.perf_counter()
+        n = self.size
+        ts = self.ts[:n]
+        mask = np.ones(n, dtype=bool)
+        if start:
+            mask &= ts >= int(start.timestamp() * 1000)
+        if end:
+            mask &= ts < int(end.timestamp() * 1000)
+        for dim, wanted in (filters or {}).items():
+            values = wanted if isinstance(wanted, list) else [wanted]
+            mask &= np.isin(self.columns[dim][:n], self.dictionaries[dim].lookup(values))
+        rows = np.flatnonzero(mask)
+
+        # Composite group key: mixed-radix combination of the bucket and the group-by codes
+        space = float(np.prod([len(self.dictionaries[dim].values) for dim in group_by], dtype=np.float64))
+        if space * (len(self.dictionaries["session_id"].values) if metric == "uniques" else 1) * MAX_BUCKETS > 2 ** 62:
+            raise ValueError("Too many distinct groups; group by fewer or smaller dimensions")
+        key = np.zeros(len(rows), dtype=np.int64)
+        origin = 0
+        radices = []
+        if bucket:
+            buckets = ts[rows] // BUCKET_MS[bucket]
+            origin = int(buckets.min()) if len(rows) else 0
+            radix = int(buckets.max()) - origin + 1 if len(rows) else 1
+            key = buckets - origin
+            radices.append(("bucket", radix))
+        for dim in group_by:
+            radix = len(self.dictionaries[dim].values)
+            key = key * radix + self.columns[dim][rows]
+            radices.append((dim, radix))
+
+        key_space = int(np.prod([radix for _, radix in radices], dtype=np.float64)) if radices else 1
+        if metric == "uniques":
+            sessions = self.columns["session_id"][rows]
+            present = sessions > 0
+            k, s = key[present], sessions[present].astype(np.int64)
+            session_space = len(self.dictionaries["session_id"].values)
+            if key_space * session_space <= DENSE_LIMIT:
+                # Dense (key, session) bitmap: one scatter, no sort
+                seen = np.zeros(key_space * session_space, dtype=bool)
+                seen[k * session_space + s] = True
+                per_key = seen.reshape(key_space, session_space).sum(axis=1)
+                keys = np.flatnonzero(per_key)
+                counts = per_key[keys]
+            else:
+                pairs = np.sort(k * session_space + s)
+                distinct = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+                keys, counts = sorted_counts(distinct // session_space)
+        else:
+            weights = self.weights[:n][rows]
+            weighted = bool((weights != 1).any())
+            if key_space <= DENSE_LIMIT:
+                per_key = np.bincount(key, weights=weights if weighted else None, minlength=key_space).astype(np.int64)
+                keys = np.flatnonzero(per_key)
+                counts = per_key[keys]
+            elif weighted:
+                order = np.argsort(key, kind="stable")
+                sorted_key = key[order]
+                starts = np.flatnonzero(np.concatenate(([True], sorted_key[1:] != sorted_key[:-1])))
+                keys = sorted_key[starts]
+                counts = np.add.reduceat(weights[order].astype(np.int64), starts) if len(starts) else starts
+            else:
+                keys, counts = sorted_counts(np.sort(key))
+
+        order = np.argsort(counts, kind="stable")[::-1] if not bucket else np.arange(len(keys))
+        order = order[:limit]
+        results = []
+        for k, c in zip(keys[order].tolist(), counts[order].tolist()):
+            row = {}
+            for name, radix in reversed(radices):
+                k, code = divmod(k, radix)
+                if name == "bucket":
+                    row["bucket"] = datetime.fromtimestamp((code + origin) * BUCKET_MS[bucket] / 1000, tz=timezone.utc)
+                else:
+                    row[name] = self.dictionaries[name].values[code]
+            row[metric] = c
+            results.append(row)
+
+        return {
+            "rows": results,
+            "matched": len(rows),
+            "in_memory": n,
+            "elapsed_ms": round((time.perf_counter() - began) * 1000, 2)
+        }
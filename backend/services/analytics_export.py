@@ -0,0 +1,92 @@
+"""
+Streaming export of raw analytics events.
+
+Events are read through an async cursor with a bounded batch size and
+serialised into CSV or NDJSON chunks of roughly CHUNK_BYTES, each
+yielded as soon as it is full (optionally through a streaming gzip
+compressor), so a worker never holds more than one cursor batch and one
+chunk regardless of how many events the range contains. Events already
+moved to the archive are read from its partitions ahead of live ones.
+"""
+from datetime import datetime
+import csv
+import io
+import json
+import zlib
+
+from services.analytics_codec import event_type_match
+from services.analytics_time import created_between
+
+import logging
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = (
+    "id", "event_type", "page", "talent_id", "party_id", "ad_id",
+    "session_id", "user_agent", "referrer", "created_at", "w"
+)
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+CHUNK_BYTES = 64 * 1024
+
+
+def export_row(event: dict) -> dict:
+    row = {field: event.get(field) for field in EXPORT_FIELDS}
+    if isinstance(row["created_at"], datetime):
+        row["created_at"] = row["created_at"].isoformat()
+    return row
+
+
+async def raw_event_rows(db, codec, start: datetime = None, end: datetime = None, event_type: str = None,
+                         batch_size: int = 1000, archive=None):
+    """Events in [start, end): archived partitions first, then the live collection."""
+    if archive:
+        async for event in archive.rows(start, end, event_type):
+            yield export_row(event)
+    match = created_between(start, end)
+    if event_type:
+        match.update(event_type_match(event_type))
+    cursor = db.analytics.find(match).sort("_id", 1).batch_size(batch_size)
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            for event in await codec.decode(batch):
+                yield export_row(event)
+            batch = []
+    for event in await codec.decode(batch):
+        yield export_row(event)
+
+
+async def stream_export(rows, fmt: str = "csv", compress: bool = False):
+    """Serialise an async iterator of rows into byte chunks."""
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return gzip.compress(data) if gzip else data
+
+    exported = 0
+    async for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row))
+            buffer.write("\n")
+        exported += 1
+        if buffer.tell() >= CHUNK_BYTES:
+            chunk = take()
+            if chunk:
+                yield chunk
+
+    tail = take()
+    if gzip:
+        tail += gzip.flush()
+    if tail:
+        yield tail
+    logger.info(f"Exported {exported} raw analytics events as {fmt}{'.gz' if compress else ''}")
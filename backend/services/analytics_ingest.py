@@ -0,0 +1,290 @@
+"""
+Buffered ingestion for analytics events.
+
+track_page_view only puts the event on a bounded asyncio queue. A
+background flusher drains it into unordered insert_many batches whenever
+`batch_size` events are waiting or `flush_interval` seconds have passed,
+using a relaxed write concern for the analytics collection. When the
+queue is full new events are dropped and counted rather than making the
+request wait. stop() lets the flusher finish the batch it is writing,
+then flushes whatever is still queued.
+
+With the default write_concern=0 inserts are not acknowledged, so
+`written` counts events sent to the server and `failed` only counts
+failures seen by the client (connection errors, timeouts, encoding).
+Events the server rejects, for example on a validation or duplicate key
+error, are lost without being counted. Set write_concern=1
+(ANALYTICS_WRITE_CONCERN) to have them counted, at the cost of waiting
+for each insert to be acknowledged.
+
+When a `sampler` is set (see analytics_sampling) submit() asks it for
+each event's sample weight given the current queue fill; sampled-out
+events are counted and accepted without being queued, and kept ones
+carry their weight as `w`.
+
+When an `encoder` is set (an async callable mapping a batch of logical
+events to stored documents, see analytics_codec) it runs in the flusher
+just before the insert. Batch hooks (async callables taking the list of
+written events, in their logical form) run after each insert, so derived
+data such as rollups is maintained off the request path. A `backfill`
+callable (AnalyticsEngine.announce) is told the ids of every insert and
+when it began, so readers that follow `_id` can pick up events stored
+behind their position.
+
+With a `spool` (see analytics_spool) the database being slow or down
+never loses events or stalls the flusher. An insert that fails or takes
+longer than `write_timeout` marks the database degraded for
+`retry_after` seconds and its batch is appended to the spool; while
+degraded, and while the spool still holds events, batches go straight
+to the spool, and a full queue spills into it instead of dropping. Once
+the database is back the flusher replays the spool oldest segment first
+with acknowledged unordered inserts: events already stored (same `_id`)
+are skipped by their duplicate key errors and only new ones reach the
+batch hooks, so replaying a segment twice counts nothing twice. An
+insert that timed out but still landed is stored without its hooks
+having run.
+
+Only failures that say the database is unreachable or overloaded
+(DATABASE_ERRORS) mark it degraded. Any other failure means the batch
+itself is bad (an encoder bug, an unencodable event); retrying it would
+fail again and, at the head of the spool, hold back everything behind
+it, so such a batch goes to the spool's quarantine file instead. A
+BulkWriteError (only raised with write_concern >= 1) is about data too:
+the rest of the unordered batch was stored, duplicate key errors mean
+the event already was, and only the events rejected for another reason
+(validation, for example) are quarantined. A replayed batch that keeps
+failing with database errors is quarantined after
+`max_replay_attempts` tries.
+"""
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, WTimeoutError
+from pymongo.write_concern import WriteConcern
+import asyncio
+import time
+
+from services.analytics_time import utc_now
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Failures that say the database is unavailable or overloaded rather than that the batch is bad
+DATABASE_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError, asyncio.TimeoutError)
+
+
+def bulk_outcome(batch: list, error: BulkWriteError) -> tuple:
+    """(events stored by this insert, events rejected) for an unordered insert that raised `error`.
+
+    Events rejected as duplicate keys were stored before and are in neither list.
+    """
+    errors = error.details.get("writeErrors", [])
+    failed = {err["index"] for err in errors}
+    rejected = [batch[err["index"]] for err in errors if err.get("code") != 11000]
+    return [event for i, event in enumerate(batch) if i not in failed], rejected
+
+
+class AnalyticsIngestor:
+    def __init__(self, db, queue_size: int = 20000, batch_size: int = 500,
+                 flush_interval: float = 1.0, write_concern: int = 0, write_timeout: float = 2.0,
+                 retry_after: float = 5.0, max_replay_attempts: int = 5):
+        self.collection = db.analytics.with_options(write_concern=WriteConcern(w=write_concern))
+        # Replays need acknowledged writes to see which events were already stored
+        self.replay_collection = db.analytics.with_options(write_concern=WriteConcern(w=1))
+        self.write_timeout = write_timeout
+        self.retry_after = retry_after
+        self.max_replay_attempts = max_replay_attempts
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0, "sampled_out": 0,
+                      "spooled": 0, "replayed": 0, "quarantined": 0}
+        self.batch_hooks = []
+        self.encoder = None
+        self.sampler = None
+        self.spool = None
+        self.backfill = None
+        self._degraded_until = 0.0
+        self._replay_failures = {}  # (segment name, offset) -> consecutive failed attempts
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def submit(self, event: dict) -> bool:
+        """Queue an event for the next batch. Never blocks; returns False if it was dropped."""
+        if self.sampler:
+            w = self.sampler.sample(event, self.queue.qsize() / self.queue.maxsize)
+            if not w:
+                self.stats["sampled_out"] += 1
+                return True
+            if w > 1:
+                event["w"] = w
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if self.spool and self.spool.append([event]):
+                self.stats["spooled"] += 1
+                return True
+            self.stats["dropped"] += 1
+            return False
+        self.stats["queued"] += 1
+        if self.queue.qsize() >= self.batch_size:
+            self._wake.set()
+        return True
+
+    @property
+    def degraded(self) -> bool:
+        return time.monotonic() < self._degraded_until
+
+    def _mark_degraded(self, error: Exception):
+        if not self.degraded:
+            logger.warning(f"Analytics database degraded, spooling events for {self.retry_after}s: {error!r}")
+        self._degraded_until = time.monotonic() + self.retry_after
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Cancelling the flusher mid-write would lose the batch it holds; ask it to finish instead
+        self._stopping = True
+        self._wake.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self._write(batch)
+
+    def _spool_batch(self, batch: list):
+        if self.spool.append(batch):
+            self.stats["spooled"] += len(batch)
+        else:
+            self.stats["dropped"] += len(batch)
+
+    async def _write(self, batch: list):
+        if self.spool and (self.degraded or self.spool.pending):
+            # Keep arrival order: nothing goes to the database ahead of spooled events
+            self._spool_batch(batch)
+            return
+        try:
+            docs = await self.encoder(batch) if self.encoder else batch
+            began = utc_now()
+            await asyncio.wait_for(self.collection.insert_many(docs, ordered=False), self.write_timeout)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except BulkWriteError as e:
+            stored, rejected = bulk_outcome(batch, e)
+            self.stats["written"] += len(batch) - len(rejected)
+            self.stats["batches"] += 1
+            if rejected:
+                await self._reject(rejected, e)
+            batch = stored
+        except Exception as e:
+            if not self.spool:
+                self.stats["failed"] += len(batch)
+                logger.error(f"Analytics batch of {len(batch)} events failed: {e}")
+            elif isinstance(e, DATABASE_ERRORS):
+                self._mark_degraded(e)
+                self._spool_batch(batch)
+            else:
+                await self._quarantine(batch, e)
+            return
+        await self._announce(batch, began)
+        await self._run_hooks(batch)
+
+    async def _reject(self, events: list, error: Exception):
+        if self.spool:
+            await self._quarantine(events, error)
+        else:
+            self.stats["failed"] += len(events)
+            logger.error(f"Analytics insert rejected {len(events)} events: {error}")
+
+    async def _quarantine(self, batch: list, error: Exception):
+        logger.error(f"Quarantining analytics batch of {len(batch)} events: {error!r}")
+        try:
+            await self.spool.quarantine(batch, repr(error))
+            self.stats["quarantined"] += len(batch)
+        except OSError as e:
+            self.stats["failed"] += len(batch)
+            logger.error(f"Analytics quarantine write failed: {e}")
+
+    async def _announce(self, batch: list, began):
+        if not self.backfill:
+            return
+        try:
+            await self.backfill([event["_id"] for event in batch], began)
+        except Exception as e:
+            logger.error(f"Analytics backfill notice failed: {e}")
+
+    async def _run_hooks(self, batch: list):
+        for hook in self.batch_hooks:
+            try:
+                await hook(batch)
+            except Exception as e:
+                logger.error(f"Analytics batch hook {type(hook).__name__} failed: {e}")
+
+    async def _insert_new(self, batch: list) -> list:
+        """Insert a replayed batch; the events that were not stored before. Rejected events are quarantined."""
+        docs = await self.encoder(batch) if self.encoder else batch
+        try:
+            await asyncio.wait_for(self.replay_collection.insert_many(docs, ordered=False), self.write_timeout)
+        except BulkWriteError as e:
+            stored, rejected = bulk_outcome(batch, e)
+            if rejected:
+                await self._quarantine(rejected, e)
+            return stored
+        return batch
+
+    async def replay(self, max_segments: int = 10) -> int:
+        """Drain spooled events into the database, oldest segment first. Stops at the first database failure."""
+        replayed = 0
+        for segment in (await self.spool.segments())[:max_segments]:
+            events = await self.spool.read(segment)
+            for i in range(0, len(events), self.batch_size):
+                if self._stopping:
+                    # Already stored events are skipped by _id when the segment is replayed again
+                    return replayed
+                batch = events[i:i + self.batch_size]
+                attempt = (segment.name, i)
+                began = utc_now()
+                try:
+                    inserted = await self._insert_new(batch)
+                except DATABASE_ERRORS as e:
+                    failures = self._replay_failures.pop(attempt, 0) + 1
+                    if failures < self.max_replay_attempts:
+                        self._replay_failures[attempt] = failures
+                        self._mark_degraded(e)
+                        return replayed
+                    await self._quarantine(batch, e)
+                    continue
+                except Exception as e:
+                    await self._quarantine(batch, e)
+                    continue
+                self._replay_failures.pop(attempt, None)
+                self.stats["written"] += len(inserted)
+                self.stats["replayed"] += len(inserted)
+                replayed += len(inserted)
+                await self._announce(inserted, began)
+                await self._run_hooks(inserted)
+            await self.spool.remove(segment)
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled analytics events")
+        return replayed
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                if self.spool and self.spool.pending and not self.degraded and not self._stopping:
+                    await self.replay()
+            except Exception as e:
+                logger.error(f"Analytics flush failed: {e}")
@@ -0,0 +1,199 @@
+"""
+Pre-aggregated analytics counters.
+
+Every ingested event increments counters in `analytics_rollups`, one
+document per (period, start, event_type, dim, value):
+
+    period "hour": dim "all" only, for rolling windows and charts
+    period "half_hour": dim "all" only, for charts in zones with a
+                   half-hour UTC offset such as Asia/Kolkata
+    period "day":  dim "all" plus one counter per page, talent_id,
+                   party_id and ad_id, and per referrer domain, device,
+                   browser and os (see traffic_sources)
+
+The flusher folds each batch into a Counter and applies it with one
+unordered bulk write, so the dashboards read a few hundred small
+documents instead of scanning raw events. backfill_rollups rebuilds
+closed days from raw events with the same key function. Sampled events
+add their sample weight `w` rather than 1.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError
+
+from services.analytics_time import created_between, day_start, event_time
+from services.traffic_sources import traffic_dimensions
+
+import logging
+logger = logging.getLogger(__name__)
+
+ROLLUP_DIMENSIONS = ("page", "talent_id", "party_id", "ad_id")
+
+
+def hour_start(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def half_hour_start(dt: datetime) -> datetime:
+    return dt.replace(minute=dt.minute - dt.minute % 30, second=0, microsecond=0)
+
+
+def rollup_keys(event: dict):
+    """Counter keys (period, start, event_type, dim, value) for one event."""
+    created = event_time(event)
+    event_type = event.get("event_type", "page_view")
+    day = day_start(created)
+    yield ("hour", hour_start(created), event_type, "all", "")
+    yield ("half_hour", half_hour_start(created), event_type, "all", "")
+    yield ("day", day, event_type, "all", "")
+    for dim in ROLLUP_DIMENSIONS:
+        value = event.get(dim)
+        if value:
+            yield ("day", day, event_type, dim, value)
+    for dim, value in traffic_dimensions(event):
+        yield ("day", day, event_type, dim, value)
+
+
+def count_rollups(events) -> Counter:
+    counts = Counter()
+    for event in events:
+        w = event.get("w", 1)
+        for key in rollup_keys(event):
+            counts[key] += w
+    return counts
+
+
+async def ensure_rollup_indexes(db):
+    await db.analytics_rollups.create_index(
+        [("dim", ASCENDING), ("event_type", ASCENDING), ("period", ASCENDING), ("start", ASCENDING), ("value", ASCENDING)],
+        unique=True
+    )
+
+
+def _rollup_filter(key) -> dict:
+    period, start, event_type, dim, value = key
+    return {"period": period, "start": start, "event_type": event_type, "dim": dim, "value": value}
+
+
+async def apply_rollups(db, counts: Counter, replace: bool = False):
+    """$inc (or $set when replace=True) the given counters, creating them as needed."""
+    if not counts:
+        return
+    op = "$set" if replace else "$inc"
+    ops = [UpdateOne(_rollup_filter(key), {op: {"count": n}}, upsert=True) for key, n in counts.items()]
+    try:
+        await db.analytics_rollups.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # Two workers upserting the same new counter: the loser retries as a plain update
+        retry = [ops[err["index"]] for err in e.details.get("writeErrors", []) if err.get("code") == 11000]
+        if len(retry) < len(e.details.get("writeErrors", [])):
+            raise
+        await db.analytics_rollups.bulk_write(retry, ordered=False)
+
+
+class RollupHook:
+    """Ingest batch hook that keeps the rollups current."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def __call__(self, batch: list):
+        await apply_rollups(self.db, count_rollups(batch))
+
+
+async def backfill_rollups(db, codec, start: datetime, end: datetime, batch_size: int = 5000) -> dict:
+    """Rebuild rollups for whole days in [start, end) from raw events.
+
+    Only closed days should be backfilled; today's counters are still
+    being incremented by the ingest path.
+    """
+    day = day_start(start)
+    end = day_start(end)
+    days = 0
+    events = 0
+    while day < end:
+        next_day = day + timedelta(days=1)
+        counts = Counter()
+        cursor = db.analytics.find(created_between(day, next_day)).batch_size(batch_size)
+        docs = []
+        async for doc in cursor:
+            docs.append(doc)
+            if len(docs) >= batch_size:
+                counts.update(count_rollups(await codec.decode(docs)))
+                events += len(docs)
+                docs = []
+        counts.update(count_rollups(await codec.decode(docs)))
+        events += len(docs)
+
+        await db.analytics_rollups.delete_many({
+            "$or": [
+                {"period": "day", "start": day},
+                {"period": {"$in": ["hour", "half_hour"]}, "start": {"$gte": day, "$lt": next_day}}
+            ]
+        })
+        await apply_rollups(db, counts, replace=True)
+        day = next_day
+        days += 1
+
+    logger.info(f"Backfilled rollups for {days} days from {events} events")
+    return {"days": days, "events": events}
+
+
+async def sum_counts(db, start: datetime = None, end: datetime = None, event_type: str = None,
+                     period: str = "day") -> int:
+    """Total events in [start, end) from the `period` counters of dim "all"."""
+    match = {"dim": "all", "period": period}
+    if event_type:
+        match["event_type"] = event_type
+    if start or end:
+        match["start"] = {}
+        if start:
+            match["start"]["$gte"] = start
+        if end:
+            match["start"]["$lt"] = end
+    result = await db.analytics_rollups.aggregate([
+        {"$match": match},
+        {"$group": {"_id": None, "total": {"$sum": "$count"}}}
+    ]).to_list(1)
+    return result[0]["total"] if result else 0
+
+
+async def top_values(db, dim: str, event_type: str, limit: int = 20,
+                     start: datetime = None, end: datetime = None) -> list:
+    """[(value, count)] for the most frequent values of `dim` among `event_type` events."""
+    match = {"dim": dim, "event_type": event_type, "period": "day"}
+    if start or end:
+        match["start"] = {}
+        if start:
+            match["start"]["$gte"] = day_start(start)
+        if end:
+            match["start"]["$lt"] = end
+    results = await db.analytics_rollups.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$value", "count": {"$sum": "$count"}}},
+        {"$sort": {"count": -1}},
+        {"$limit": limit}
+    ]).to_list(limit)
+    return [(r["_id"], r["count"]) for r in results]
+
+
+async def traffic_totals(db, now: datetime) -> dict:
+    """Total, today, rolling 7-day and rolling 30-day event counts in one $facet pass."""
+    week_start = hour_start(now - timedelta(days=7))
+    month_start = hour_start(now - timedelta(days=30))
+    total = [{"$group": {"_id": None, "n": {"$sum": "$count"}}}]
+    result = await db.analytics_rollups.aggregate([
+        {"$match": {"dim": "all", "$or": [
+            {"period": "day"},
+            {"period": "hour", "start": {"$gte": month_start}}
+        ]}},
+        {"$facet": {
+            "total": [{"$match": {"period": "day"}}] + total,
+            "today": [{"$match": {"period": "day", "start": {"$gte": day_start(now)}}}] + total,
+            "week": [{"$match": {"period": "hour", "start": {"$gte": week_start}}}] + total,
+            "month": [{"$match": {"period": "hour"}}] + total
+        }}
+    ]).to_list(1)
+    facets = result[0] if result else {}
+    return {name: (facets.get(name) or [{"n": 0}])[0]["n"] for name in ("total", "today", "week", "month")}
@@ -0,0 +1,110 @@
+"""
+Adaptive sampling for analytics ingestion.
+
+Under normal traffic every event is kept. When the arrival rate (an
+exponentially weighted moving average over one-second slots) exceeds
+`target_rate`, or the ingest queue is more than half full, the keep
+probability drops to target_rate / rate, scaled down further as the
+queue fills. The probability is rounded to 1 / w for a whole number w,
+and a kept event carries `w` as its sample weight, so the rollups, the
+views chart, the query engine and the archive count sum(w) and stay
+unbiased. Unsampled events carry no `w` and count once.
+
+Per-event-type floors bound the probability from below; types with a
+floor of 1.0 (ad clicks and votes by default) are never sampled.
+
+The keep decision hashes the session id to u in [0, 1), so one session
+is decided the same way for all its events at a given rate. A session
+is in the session sample when u * w_s < 1, where w_s comes from the
+most restrictive probability any event type can have right now (the
+current probability against the lowest floor); all its events are kept,
+each weighted by its own type's w. A floored type keeps more than that:
+its events are kept when u * w < 1 for the type's larger probability,
+so some come from sessions outside the session sample. Those are kept
+for the counts but lose their session_id, so the path hook, the unique
+visitor sketches and the query engine's uniques never see a partial
+session.
+
+Event counts stay unbiased. Session-level reports describe the session
+sample: funnel and path proportions are unbiased, but unique visitor
+counts fall by the session sampling rate while sampling is on, and
+sessions can move in and out of the sample as the rate changes (a lower
+rate keeps a subset of the sessions a higher one kept).
+"""
+import random
+import time
+import zlib
+
+DEFAULT_FLOORS = {"ad_click": 1.0, "vote": 1.0}
+
+
+def parse_floors(spec: str) -> dict:
+    """Floors from "event_type=floor,..." (e.g. "party_view=0.5,ad_click=1")."""
+    floors = dict(DEFAULT_FLOORS)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event_type, _, floor = item.partition("=")
+        floors[event_type.strip()] = min(max(float(floor), 0.0), 1.0)
+    return floors
+
+
+class AdaptiveSampler:
+    def __init__(self, target_rate: float = 500.0, floors: dict = None, default_floor: float = 0.01,
+                 half_life: float = 5.0, clock=time.monotonic):
+        self.target_rate = target_rate
+        self.floors = DEFAULT_FLOORS if floors is None else floors
+        self.default_floor = default_floor
+        self.alpha = 1 - 0.5 ** (1 / half_life)
+        self.clock = clock
+        self.rate = 0.0
+        self.probability = 1.0
+        self.stats = {"offered": 0, "sampled_out": 0, "detached": 0}
+        self._lowest_floor = min([default_floor, *self.floors.values()])
+        self._second = int(clock())
+        self._arrivals = 0
+
+    def _tick(self, queue_fill: float):
+        second = int(self.clock())
+        if second != self._second:
+            # Fold the finished slot, then decay through any idle seconds
+            self.rate += self.alpha * (self._arrivals - self.rate)
+            self.rate *= (1 - self.alpha) ** min(second - self._second - 1, 60)
+            self._second, self._arrivals = second, 0
+        self._arrivals += 1
+
+        # The current slot counts as soon as it alone exceeds the average, so spikes react within a second
+        rate = max(self.rate, self._arrivals)
+        p = 1.0 if rate <= self.target_rate else self.target_rate / rate
+        if queue_fill > 0.5:
+            p *= max(2 * (1 - queue_fill), 0.05)
+        self.probability = p
+
+    def sample(self, event: dict, queue_fill: float = 0.0) -> int:
+        """Sample weight for a kept event, or 0 if it is sampled out.
+
+        A kept event from a session outside the session sample has its
+        session_id removed.
+        """
+        self.stats["offered"] += 1
+        self._tick(queue_fill)
+        p = max(self.probability, self.floors.get(event.get("event_type"), self.default_floor))
+        w = int(1 / p) if p < 1.0 else 1
+        session_id = event.get("session_id")
+        if not session_id:
+            if w == 1 or random.random() * w < 1:
+                return w
+            self.stats["sampled_out"] += 1
+            return 0
+
+        p_session = max(self.probability, self._lowest_floor)
+        w_session = int(1 / p_session) if p_session < 1.0 else 1
+        if w_session == 1:
+            return w
+        u = zlib.crc32(session_id.encode()) / 2 ** 32
+        if u * w_session < 1:
+            return w
+        if u * w < 1:
+            del event["session_id"]
+            self.stats["detached"] += 1
+            return w
+        self.stats["sampled_out"] += 1
+        return 0
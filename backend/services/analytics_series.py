@@ -0,0 +1,131 @@
+"""
+Time series of event counts for the dashboard charts.
+
+Buckets are hours, days or ISO weeks (starting Monday) in the requested
+IANA timezone. When the zone's UTC offset is a whole number of hours over
+the range, the series is folded from the hourly rollup counters, at most
+24 documents per day whatever the traffic; a whole number of half hours
+(Asia/Kolkata is +05:30) uses the half-hour counters instead, 48 per day.
+Half-hour counters only exist from the release that added them (or as
+far back as rollups were backfilled), so the part of the range before
+the first one is counted from raw events. Other offsets (Asia/Kathmandu
+is +05:45) cannot be built from either, so the database groups the raw
+events itself with $dateTrunc in that timezone. Raw event counts include
+any archived partitions in the range.
+"""
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from services.analytics_codec import event_type_match
+from services.analytics_time import created_between, utc_now
+
+# Rollup period that local buckets can be folded from, by the UTC offset step it supports
+ROLLUP_PERIODS = (("hour", timedelta(hours=1)), ("half_hour", timedelta(minutes=30)))
+
+GRANULARITIES = {
+    "hour": (timedelta(hours=1), "%Y-%m-%dT%H:00"),
+    "day": (timedelta(days=1), "%Y-%m-%d"),
+    "week": (timedelta(weeks=1), "%Y-%m-%d"),
+}
+
+
+def local_bucket(dt: datetime, tz: ZoneInfo, granularity: str) -> datetime:
+    """Naive local wall-clock start of the bucket containing `dt`."""
+    local = dt.astimezone(tz).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return local
+    local = local.replace(hour=0)
+    if granularity == "week":
+        local -= timedelta(days=local.weekday())
+    return local
+
+
+def _rollup_period(tz: ZoneInfo, *instants: datetime):
+    """The rollup period whose slots fit the zone's offsets at `instants`, or None."""
+    for period, slot in ROLLUP_PERIODS:
+        if all(dt.astimezone(tz).utcoffset() % slot == timedelta(0) for dt in instants):
+            return period
+    return None
+
+
+async def _rollups_since(db, period: str, event_type: str = None):
+    """Start of the first fully counted `period` slot, or None if there are no counters."""
+    match = {"dim": "all", "period": period}
+    if event_type:
+        match["event_type"] = event_type
+    first = await db.analytics_rollups.find(match, {"_id": 0, "start": 1}).sort("start", 1).limit(1).to_list(1)
+    if not first:
+        return None
+    # Counting may have started part way through the first slot
+    return first[0]["start"] + dict(ROLLUP_PERIODS)[period]
+
+
+async def _counts_from_rollups(db, start: datetime, tz: ZoneInfo, granularity: str, event_type: str = None,
+                               period: str = "hour") -> dict:
+    match = {"dim": "all", "period": period, "start": {"$gte": start}}
+    if event_type:
+        match["event_type"] = event_type
+    slots = await db.analytics_rollups.aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$start", "count": {"$sum": "$count"}}}
+    ]).to_list(None)
+
+    counts = {}
+    for slot in slots:
+        key = local_bucket(slot["_id"], tz, granularity)
+        counts[key] = counts.get(key, 0) + slot["count"]
+    return counts
+
+
+async def _counts_from_events(db, start: datetime, tz: ZoneInfo, granularity: str, event_type: str = None,
+                              end: datetime = None) -> dict:
+    match = created_between(start, end)
+    if event_type:
+        match.update(event_type_match(event_type))
+    buckets = await db.analytics.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"$dateTrunc": {
+                "date": {"$toDate": "$_id"}, "unit": granularity, "timezone": tz.key, "startOfWeek": "monday"
+            }},
+            "count": {"$sum": {"$ifNull": ["$w", 1]}}
+        }}
+    ], allowDiskUse=True).to_list(None)
+    return {local_bucket(b["_id"], tz, granularity): b["count"] for b in buckets}
+
+
+async def event_series(db, days: int = 30, granularity: str = "day", tz: ZoneInfo = ZoneInfo("UTC"),
+                       event_type: str = None, archive=None) -> list:
+    """[{"date", "views"}] for every bucket covering the last `days` days, oldest first."""
+    step, label = GRANULARITIES[granularity]
+    now = utc_now()
+    last = local_bucket(now, tz, granularity)
+    buckets = max(1, -(-days * timedelta(days=1) // step))
+    first = last - step * (buckets - 1)
+    start = first.replace(tzinfo=tz).astimezone(now.tzinfo)
+
+    period = _rollup_period(tz, start, now)
+    if period == "hour":
+        counts = await _counts_from_rollups(db, start, tz, granularity, event_type)
+    else:
+        counts = {}
+        raw_end = None
+        if period:
+            since = await _rollups_since(db, period, event_type)
+            if since is not None and since < now:
+                rollup_start = max(start, since)
+                counts = await _counts_from_rollups(db, rollup_start, tz, granularity, event_type, period)
+                raw_end = rollup_start
+        if raw_end is None or raw_end > start:
+            raw = await _counts_from_events(db, start, tz, granularity, event_type, raw_end)
+            if archive:
+                archived = await archive.bucket_counts(start, lambda dt: local_bucket(dt, tz, granularity), event_type, raw_end)
+                for key, n in archived.items():
+                    raw[key] = raw.get(key, 0) + n
+            for key, n in raw.items():
+                counts[key] = counts.get(key, 0) + n
+
+    return [
+        {"date": (first + step * i).strftime(label), "views": counts.get(first + step * i, 0)}
+        for i in range(buckets)
+    ]
@@ -0,0 +1,248 @@
+"""
+Disk-backed spool for analytics events while MongoDB is degraded.
+
+Each worker process spools into its own subdirectory of `directory`,
+`worker-<n>/`, holding an exclusive flock on `worker-<n>/.lock` for as
+long as it runs, so no two processes ever touch the same segment. Events
+are NDJSON (bson.json_util, so ObjectIds survive) in numbered segment
+files:
+
+    worker-0/segment-000000000042.ndjson.open   being appended to
+    worker-0/segment-000000000041.ndjson        closed, waiting to be replayed
+
+append() only encodes the events into an in-memory buffer; it never
+touches the disk, so it is safe on the tracking request path. A writer
+task hands the buffer to a thread every `fsync_interval` seconds (sooner
+once a segment's worth is waiting), which appends it to the open
+segment, fsyncs, and closes the segment once it passes
+`segment_bytes`. At most `fsync_interval` seconds of events can be lost
+in a crash. Appends beyond `max_bytes` (buffered plus on disk) are
+refused and counted.
+
+On startup segments left open by a crash are closed, and the
+directories of worker slots nobody holds (a previous run with more
+workers) are adopted: their segments are moved into this worker's
+directory behind its own.
+
+Events are spooled in their logical form, before encoding, since
+interning user agents needs the database. The ingestor replays
+segments oldest first and removes each one once all its events are
+stored. Batches that cannot be stored for reasons other than an outage
+are moved to `worker-<n>/quarantine.ndjson`, one line per event with
+the error beside it, for someone to inspect and re-import by hand.
+"""
+from pathlib import Path
+from bson import json_util
+import asyncio
+import fcntl
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+OPEN_SUFFIX = ".open"
+QUARANTINE_FILE = "quarantine.ndjson"
+
+
+def _segment_seq(path: Path) -> int:
+    return int(path.name.split("-")[1].split(".")[0])
+
+
+def _closed_segments(directory: Path) -> list:
+    return sorted(directory.glob("segment-*.ndjson"), key=_segment_seq)
+
+
+def _close_open_segments(directory: Path):
+    for path in directory.glob(f"segment-*.ndjson{OPEN_SUFFIX}"):
+        os.replace(path, path.with_name(path.name[:-len(OPEN_SUFFIX)]))
+
+
+def _try_lock(directory: Path):
+    """The open lock file if this process now holds `directory`, else None."""
+    directory.mkdir(parents=True, exist_ok=True)
+    lock = open(directory / ".lock", "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def _read_segment(path: Path) -> tuple:
+    events, corrupt = [], 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                events.append(json_util.loads(line))
+            except ValueError:
+                # A line cut short by a crash
+                corrupt += 1
+    return events, corrupt
+
+
+def _append_fsync(path: Path, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class EventSpool:
+    def __init__(self, directory, segment_bytes: int = 4 << 20, max_bytes: int = 1 << 30,
+                 fsync_interval: float = 1.0, max_workers: int = 64):
+        self.root = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.stats = {"appended": 0, "refused": 0, "corrupt_lines": 0, "segments": 0, "bytes": 0}
+        self._buffer = []   # encoded batches waiting for the writer
+        self._buffered = 0
+        self._file = None   # open segment, only touched by the writer thread
+        self._size = 0
+        self._io = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+        for slot in range(max_workers):
+            self._lock = _try_lock(self.root / f"worker-{slot}")
+            if self._lock:
+                self.slot = slot
+                break
+        else:
+            raise RuntimeError(f"All {max_workers} analytics spool slots in {self.root} are in use")
+        self.directory = self.root / f"worker-{self.slot}"
+
+        _close_open_segments(self.directory)
+        closed = _closed_segments(self.directory)
+        self._seq = _segment_seq(closed[-1]) if closed else 0
+        self._adopt_orphans()
+        closed = _closed_segments(self.directory)
+        self.stats["segments"] = len(closed)
+        self.stats["bytes"] = sum(path.stat().st_size for path in closed)
+
+    def _adopt_orphans(self):
+        for directory in sorted(self.root.glob("worker-*")):
+            if directory == self.directory:
+                continue
+            lock = _try_lock(directory)
+            if lock is None:
+                continue
+            try:
+                _close_open_segments(directory)
+                for path in _closed_segments(directory):
+                    self._seq += 1
+                    os.replace(path, self.directory / f"segment-{self._seq:012d}.ndjson")
+                    logger.info(f"Adopted spooled analytics segment {path}")
+            finally:
+                lock.close()
+
+    @property
+    def pending(self) -> bool:
+        return self.stats["bytes"] > 0
+
+    def append(self, events: list) -> bool:
+        """Buffer events for the writer; False if the spool is full. Never does I/O."""
+        data = "".join(json_util.dumps(event) + "\n" for event in events).encode()
+        if self.stats["bytes"] + len(data) > self.max_bytes:
+            self.stats["refused"] += len(events)
+            return False
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self.stats["bytes"] += len(data)
+        self.stats["appended"] += len(events)
+        if self._buffered >= self.segment_bytes:
+            self._wake.set()
+        return True
+
+    def _write(self, data: bytes, close: bool) -> int:
+        """Runs in a thread: append, fsync, and roll the segment. Returns the number of segments opened."""
+        opened = 0
+        if data:
+            if self._file is None:
+                self._seq += 1
+                self._file = open(self.directory / f"segment-{self._seq:012d}.ndjson{OPEN_SUFFIX}", "ab")
+                self._size = 0
+                opened = 1
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._size += len(data)
+        if self._file is not None and (close or self._size >= self.segment_bytes):
+            self._file.close()
+            path = Path(self._file.name)
+            os.replace(path, path.with_name(path.name[:-len(OPEN_SUFFIX)]))
+            self._file = None
+        return opened
+
+    async def sync(self, close: bool = False):
+        """Write and fsync buffered events in a thread; close=True also closes the open segment."""
+        async with self._io:
+            data = b"".join(self._buffer)
+            self._buffer, self._buffered = [], 0
+            if not (data or close):
+                return
+            write = asyncio.ensure_future(asyncio.to_thread(self._write, data, close))
+            try:
+                try:
+                    self.stats["segments"] += await asyncio.shield(write)
+                except asyncio.CancelledError:
+                    # The thread cannot be stopped; hold _io until it is done so no other write overlaps it
+                    self.stats["segments"] += await write
+                    raise
+            except OSError:
+                # Keep the events for the next attempt; anything half-written is skipped by _id on replay
+                self._buffer.insert(0, data)
+                self._buffered += len(data)
+                raise
+
+    async def segments(self) -> list:
+        """Closed segments oldest first, after writing and closing everything pending."""
+        await self.sync(close=True)
+        return await asyncio.to_thread(_closed_segments, self.directory)
+
+    async def read(self, path: Path) -> list:
+        events, corrupt = await asyncio.to_thread(_read_segment, path)
+        if corrupt:
+            self.stats["corrupt_lines"] += corrupt
+            logger.warning(f"Skipped {corrupt} unreadable lines in {path.name}")
+        return events
+
+    async def remove(self, path: Path):
+        size = (await asyncio.to_thread(path.stat)).st_size
+        await asyncio.to_thread(path.unlink)
+        self.stats["segments"] -= 1
+        self.stats["bytes"] = max(self.stats["bytes"] - size, 0)
+
+    async def quarantine(self, events: list, error: str):
+        """Set events that cannot be stored aside, with the error, outside the replay queue."""
+        data = "".join(json_util.dumps({"error": error, "event": event}) + "\n" for event in events).encode()
+        await asyncio.to_thread(_append_fsync, self.directory / QUARANTINE_FILE, data)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Cancelling the writer would leave its thread writing to the segment; let it finish instead
+        self._stopping = True
+        self._wake.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.sync(close=True)
+        self._lock.close()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.fsync_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.sync()
+            except OSError as e:
+                logger.error(f"Analytics spool write failed: {e}")
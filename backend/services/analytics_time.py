@@ -0,0 +1,105 @@
+"""
+Time handling for the analytics collection.
+
+An event's time is the timestamp of its ObjectId `_id` (see
+analytics_codec), so every analytics route builds its date filters
+through created_between(), which turns a datetime range into _id bounds
+served by the default _id index. Older documents whose `_id` was
+assigned at insert time fall within a second of their stored
+`created_at`, so the same bounds cover them too.
+
+With ANALYTICS_RETENTION_DAYS set, AnalyticsRetention deletes expired
+events in batches by _id, which replaces the former TTL index on
+created_at.
+"""
+from datetime import datetime, timezone, timedelta
+from bson import ObjectId
+import asyncio
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def day_start(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def days_ago(days: int, now: datetime = None) -> datetime:
+    return (now or utc_now()) - timedelta(days=days)
+
+
+def event_time(event: dict) -> datetime:
+    """When an event happened: its created_at if it has one, else its ObjectId timestamp."""
+    created = event.get("created_at")
+    if isinstance(created, str):
+        created = datetime.fromisoformat(created.replace("Z", "+00:00"))
+    if created is None:
+        created = event["_id"].generation_time
+    return created if created.tzinfo else created.replace(tzinfo=timezone.utc)
+
+
+def parse_time(value: str) -> datetime:
+    """Parse an ISO date or datetime from a query string; naive values are UTC."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def created_between(start: datetime = None, end: datetime = None) -> dict:
+    """Filter for events created in [start, end) (either bound optional), as _id bounds."""
+    created = {}
+    if start:
+        created["$gte"] = ObjectId.from_datetime(start)
+    if end:
+        created["$lt"] = ObjectId.from_datetime(end)
+    return {"_id": created} if created else {}
+
+
+class AnalyticsRetention:
+    """Deletes raw events older than `retention_days` in _id-ordered batches every `interval` seconds."""
+
+    def __init__(self, db, retention_days: int, interval: float = 3600, batch_size: int = 5000,
+                 max_batches: int = 100):
+        self.db = db
+        self.retention_days = retention_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self._task = None
+
+    async def purge(self) -> int:
+        cutoff = created_between(end=days_ago(self.retention_days))
+        purged = 0
+        for _ in range(self.max_batches):
+            docs = await self.db.analytics.find(cutoff, {"_id": 1}).sort("_id", 1).limit(self.batch_size).to_list(self.batch_size)
+            if not docs:
+                break
+            result = await self.db.analytics.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+            purged += result.deleted_count
+        if purged:
+            logger.info(f"Purged {purged} analytics events older than {self.retention_days} days")
+        return purged
+
+    def start(self):
+        if self.retention_days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.purge()
+            except Exception as e:
+                logger.error(f"Analytics retention purge failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,135 @@
+"""
+Ingest-time bot filtering.
+
+The tracking routes ask BotFilter.check() about every event before it is
+queued. An event is a bot's when
+  - its user agent is empty or matches BOT_PATTERN (crawlers, link
+    previews, uptime probes, HTTP libraries, headless browsers); the
+    verdict is lru_cached per user-agent string, or
+  - its session has sent more than `max_per_minute` events in the
+    current minute; the session is then treated as a bot for
+    `flag_minutes` more minutes.
+
+Bot events are never stored as raw events. They only add to an
+in-memory Counter keyed by (day, reason) that a background task folds
+into `analytics_rollups` (event_type "bot", dim "filter_reason", period
+"day") every `flush_interval` seconds; like ad impressions, they stay out
+of the "all" counters.
+"""
+from collections import Counter
+from functools import lru_cache
+import asyncio
+import re
+import time
+
+from services.analytics_rollups import apply_rollups
+from services.analytics_time import day_start, utc_now
+
+import logging
+logger = logging.getLogger(__name__)
+
+BOT_EVENT = "bot"
+BOT_PATTERN = re.compile(
+    r"bot|crawl|spider|slurp|facebookexternalhit|whatsapp|preview|headless|phantomjs|selenium|puppeteer|"
+    r"playwright|lighthouse|pingdom|uptime|monitor|statuscake|curl|wget|python-|aiohttp|httpx|go-http-client|"
+    r"java/|okhttp|axios/|node-fetch|libwww|scrapy",
+    re.I
+)
+
+
+@lru_cache(maxsize=20000)
+def is_bot_agent(user_agent: str) -> bool:
+    return not user_agent or bool(BOT_PATTERN.search(user_agent))
+
+
+class BotFilter:
+    def __init__(self, db, max_per_minute: int = 120, flag_minutes: int = 10, flush_interval: float = 30.0,
+                 max_sessions: int = 100000, clock=time.time):
+        self.db = db
+        self.max_per_minute = max_per_minute
+        self.flag_minutes = flag_minutes
+        self.flush_interval = flush_interval
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.pending = Counter()  # (day, reason) -> filtered events
+        self.stats = {"checked": 0, "user_agent": 0, "rate": 0}
+        self._minute = None
+        self._rates = Counter()   # session_id -> events this minute
+        self._flagged = {}        # session_id -> minute the flag expires
+        self._task = None
+
+    def _reason(self, event: dict):
+        if is_bot_agent(event.get("user_agent") or ""):
+            return "user_agent"
+        session_id = event.get("session_id")
+        if not session_id:
+            return None
+
+        minute = int(self.clock() // 60)
+        if minute != self._minute:
+            self._minute = minute
+            self._rates.clear()
+            self._flagged = {s: until for s, until in self._flagged.items() if until > minute}
+        if session_id in self._flagged:
+            return "rate"
+        self._rates[session_id] += 1
+        if self._rates[session_id] > self.max_per_minute:
+            if len(self._flagged) < self.max_sessions:
+                self._flagged[session_id] = minute + self.flag_minutes
+            return "rate"
+        return None
+
+    def check(self, event: dict) -> bool:
+        """True if `event` should be stored; bot events are counted instead."""
+        self.stats["checked"] += 1
+        reason = self._reason(event)
+        if reason is None:
+            return True
+        self.stats[reason] += 1
+        self.pending[(day_start(utc_now()), reason)] += 1
+        return False
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, Counter()
+        counts = Counter({("day", day, BOT_EVENT, "filter_reason", reason): n for (day, reason), n in pending.items()})
+        try:
+            await apply_rollups(self.db, counts)
+        except Exception as e:
+            self.pending.update(pending)
+            logger.error(f"Bot counter flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+async def filtered_by_day(db, start=None) -> list:
+    """[{date, user_agent, rate, total}] of bot events filtered per day."""
+    match = {"period": "day", "dim": "filter_reason", "event_type": BOT_EVENT}
+    if start:
+        match["start"] = {"$gte": day_start(start)}
+    days = {}
+    async for doc in db.analytics_rollups.find(match, {"_id": 0, "start": 1, "value": 1, "count": 1}):
+        day = days.setdefault(doc["start"], {"user_agent": 0, "rate": 0})
+        day[doc["value"]] = day.get(doc["value"], 0) + doc["count"]
+    return [
+        {"date": day.strftime("%Y-%m-%d"), **counts, "total": sum(counts.values())}
+        for day, counts in sorted(days.items())
+    ]
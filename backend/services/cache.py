@@ -0,0 +1,65 @@
+"""
+Stale-while-revalidate cache for expensive async computations.
+
+A value younger than `fresh_for` seconds is returned as is. Between
+`fresh_for` and `stale_for` the cached value is still returned
+immediately while a single background task recomputes it. Older (or
+missing) values are computed inline, with concurrent callers for the
+same key sharing one computation.
+"""
+import asyncio
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SWRCache:
+    def __init__(self, fresh_for: float = 30, stale_for: float = 300, max_entries: int = 256):
+        self.fresh_for = fresh_for
+        self.stale_for = stale_for
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (value, computed_at)
+        self._inflight = {}  # key -> task
+
+    async def get(self, key, compute):
+        """Return the cached value for `key`, calling `compute()` (a coroutine function) as needed."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[1]
+            if age < self.fresh_for:
+                return entry[0]
+            if age < self.stale_for:
+                self._start(key, compute)
+                return entry[0]
+        # Shield so a cancelled request does not cancel the shared computation
+        return await asyncio.shield(self._start(key, compute))
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _start(self, key, compute):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(key, compute))
+            # Background refreshes may fail unobserved; the error is already logged
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return task
+
+    async def _refresh(self, key, compute):
+        try:
+            value = await compute()
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest]
+            self._entries[key] = (value, time.monotonic())
+            return value
+        except Exception as e:
+            logger.error(f"Cache refresh for {key!r} failed: {e}")
+            raise
+        finally:
+            self._inflight.pop(key, None)
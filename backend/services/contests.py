@@ -0,0 +1,218 @@
+"""
+Contest voting windows, per-contest counters and result snapshots.
+
+Open contests are kept in an in-memory window table so a vote for a
+closed or unknown contest is rejected without touching the database. A
+vote the table accepts is confirmed against the stored contest, since
+another worker may have closed or rescheduled it since the last reload.
+ContestCloser closes contests whose ends_at has passed in the
+background, so results are frozen even if nobody reads them.
+Contest votes increment a counter document keyed (contest_id, talent_id)
+in `contest_votes`; closing a contest freezes the ranking into
+`contest_results`, which is what past results are read from.
+"""
+from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+WINDOW_TTL_SECONDS = 60
+# A vote for an unknown contest may trigger a reload at most this often
+MISS_RELOAD_SECONDS = 5
+
+
+def parse_contest_time(value: str) -> datetime:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+async def ensure_contest_indexes(db):
+    await db.contests.create_index([("id", ASCENDING)], unique=True)
+    await db.contest_votes.create_index([("contest_id", ASCENDING), ("talent_id", ASCENDING)], unique=True)
+    await db.contest_votes.create_index([("contest_id", ASCENDING), ("votes", DESCENDING)])
+    await db.contest_results.create_index([("contest_id", ASCENDING)], unique=True)
+
+
+class ContestWindows:
+    """In-memory table of open contest windows: contest_id -> (starts_at, ends_at)."""
+
+    def __init__(self, db, ttl: float = WINDOW_TTL_SECONDS):
+        self.db = db
+        self.ttl = ttl
+        self._windows = {}
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+    def _stale(self, contest_id: str) -> bool:
+        age = time.monotonic() - self._loaded_at
+        return age > self.ttl or (contest_id not in self._windows and age > MISS_RELOAD_SECONDS)
+
+    async def refresh(self):
+        async with self._lock:
+            await self._load()
+
+    async def _load(self):
+        windows = {}
+        async for c in self.db.contests.find({"status": "open"}, {"_id": 0, "id": 1, "starts_at": 1, "ends_at": 1}):
+            try:
+                windows[c["id"]] = (parse_contest_time(c["starts_at"]), parse_contest_time(c["ends_at"]))
+            except (KeyError, ValueError):
+                logger.warning(f"Contest {c.get('id')} has an invalid voting window")
+        self._windows = windows
+        self._loaded_at = time.monotonic()
+
+    async def check(self, contest_id: str):
+        """Return None if votes are accepted for the contest right now, else the rejection reason."""
+        if self._stale(contest_id):
+            async with self._lock:
+                # Votes queued behind a reload reuse it instead of reloading again
+                if self._stale(contest_id):
+                    await self._load()
+
+        reason = self._reject(self._windows.get(contest_id))
+        if reason:
+            return reason
+
+        stored = await self.db.contests.find_one({"id": contest_id}, {"_id": 0, "status": 1, "starts_at": 1, "ends_at": 1})
+        if not stored or stored.get("status") != "open":
+            return "Contest is not open for voting"
+        try:
+            return self._reject((parse_contest_time(stored["starts_at"]), parse_contest_time(stored["ends_at"])))
+        except (KeyError, ValueError):
+            return "Contest is not open for voting"
+
+    @staticmethod
+    def _reject(window):
+        if window is None:
+            return "Contest is not open for voting"
+        now = datetime.now(timezone.utc)
+        if now < window[0]:
+            return "Voting for this contest has not started"
+        if now >= window[1]:
+            return "Voting for this contest has ended"
+        return None
+
+
+async def record_contest_vote(db, contest_id: str, talent_id: str):
+    await db.contest_votes.update_one(
+        {"contest_id": contest_id, "talent_id": talent_id},
+        {"$inc": {"votes": 1}},
+        upsert=True
+    )
+
+
+async def live_standings(db, contest_id: str, limit: int = 50):
+    counters = await db.contest_votes.find(
+        {"contest_id": contest_id}, {"_id": 0, "talent_id": 1, "votes": 1}
+    ).sort("votes", DESCENDING).limit(limit).to_list(limit)
+
+    names = {}
+    if counters:
+        async for t in db.talents.find(
+            {"id": {"$in": [c["talent_id"] for c in counters]}},
+            {"_id": 0, "id": 1, "name": 1, "category": 1}
+        ):
+            names[t["id"]] = t
+
+    return [
+        {
+            "rank": i,
+            "talent_id": c["talent_id"],
+            "name": names.get(c["talent_id"], {}).get("name", "Unknown"),
+            "category": names.get(c["talent_id"], {}).get("category", ""),
+            "votes": c["votes"]
+        }
+        for i, c in enumerate(counters, 1)
+    ]
+
+
+async def close_contest(db, contest: dict):
+    """Freeze the contest's counters into a results snapshot and mark it closed.
+
+    Safe to call more than once: the first snapshot written wins.
+    """
+    results = await live_standings(db, contest["id"], limit=1000)
+    totals = await db.contest_votes.aggregate([
+        {"$match": {"contest_id": contest["id"]}},
+        {"$group": {"_id": None, "total": {"$sum": "$votes"}}}
+    ]).to_list(1)
+    snapshot = {
+        "contest_id": contest["id"],
+        "title": contest.get("title", ""),
+        "starts_at": contest.get("starts_at", ""),
+        "ends_at": contest.get("ends_at", ""),
+        "closed_at": datetime.now(timezone.utc).isoformat(),
+        "total_votes": totals[0]["total"] if totals else 0,
+        "results": results
+    }
+    try:
+        await db.contest_results.insert_one(dict(snapshot))
+    except DuplicateKeyError:
+        snapshot = await db.contest_results.find_one({"contest_id": contest["id"]}, {"_id": 0})
+
+    await db.contests.update_one(
+        {"id": contest["id"]},
+        {"$set": {"status": "closed", "closed_at": snapshot["closed_at"]}}
+    )
+
+    winners = snapshot.get("results") or []
+    if contest.get("award_id") and winners:
+        await db.awards.update_one(
+            {"id": contest["award_id"]},
+            {"$set": {"talent_id": winners[0]["talent_id"], "winner_name": winners[0]["name"]}}
+        )
+    logger.info(f"Contest closed: {contest.get('title')} ({snapshot['total_votes']} votes)")
+    return snapshot
+
+
+class ContestCloser:
+    """Closes open contests whose ends_at has passed, every `interval` seconds."""
+
+    def __init__(self, db, contest_windows: ContestWindows, interval: float = 30):
+        self.db = db
+        self.contest_windows = contest_windows
+        self.interval = interval
+        self._task = None
+
+    async def close_ended(self) -> int:
+        now = datetime.now(timezone.utc)
+        ended = []
+        async for contest in self.db.contests.find({"status": "open"}, {"_id": 0}):
+            try:
+                if now >= parse_contest_time(contest["ends_at"]):
+                    ended.append(contest)
+            except (KeyError, ValueError):
+                continue
+        for contest in ended:
+            await close_contest(self.db, contest)
+        if ended:
+            self.contest_windows.invalidate()
+        return len(ended)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.close_ended()
+            except Exception as e:
+                logger.error(f"Contest closer failed: {e}")
+            await asyncio.sleep(self.interval)
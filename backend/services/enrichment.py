@@ -0,0 +1,79 @@
+"""
+Batched name lookups for the analytics panels.
+
+Dashboard rows carry talent, party and ad ids. Instead of a find_one per
+row, NameResolver collects the ids per entity type and resolves them
+with one $in query each, keeping the small display fields in a TTL/LRU
+cache so repeated panel loads mostly skip the database. Large fields
+(profile_image may be a data URL) are never cached; asking for them
+makes the query cover every requested id.
+"""
+from collections import OrderedDict
+import asyncio
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+# entity kind -> (collection, cached display fields)
+ENTITIES = {
+    "talent": ("talents", ("name", "category", "instagram_id")),
+    "party": ("party_events", ("title", "venue", "event_date")),
+    "ad": ("advertisements", ("title", "link")),
+}
+
+
+class NameResolver:
+    def __init__(self, db, ttl: float = 120, max_entries: int = 5000):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # (kind, id) -> (doc or None, expires_at)
+
+    def _cached(self, kind: str, entity_id: str, now: float):
+        entry = self._cache.get((kind, entity_id))
+        if entry is None or entry[1] <= now:
+            return False, None
+        self._cache.move_to_end((kind, entity_id))
+        return True, entry[0]
+
+    def _store(self, kind: str, entity_id: str, doc, now: float):
+        self._cache[(kind, entity_id)] = (doc, now + self.ttl)
+        self._cache.move_to_end((kind, entity_id))
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def resolve(self, kind: str, ids, extra_fields=()) -> dict:
+        """{id: doc} for the ids that exist; docs hold the display fields plus `extra_fields`."""
+        collection, fields = ENTITIES[kind]
+        ids = {i for i in ids if i}
+        now = time.monotonic()
+        found = {}
+        missing = set()
+        for entity_id in ids:
+            hit, doc = (False, None) if extra_fields else self._cached(kind, entity_id, now)
+            if not hit:
+                missing.add(entity_id)
+            elif doc is not None:
+                found[entity_id] = doc
+
+        if missing:
+            projection = {"_id": 0, "id": 1, **{f: 1 for f in fields + tuple(extra_fields)}}
+            docs = await self.db[collection].find({"id": {"$in": list(missing)}}, projection).to_list(len(missing))
+            for doc in docs:
+                entity_id = doc.pop("id")
+                found[entity_id] = doc
+                self._store(kind, entity_id, {f: doc[f] for f in fields if f in doc}, now)
+            # Remember misses too, so deleted entities don't cost a query per load
+            for entity_id in missing - set(found):
+                self._store(kind, entity_id, None, now)
+        return found
+
+    async def resolve_many(self, requested: dict) -> dict:
+        """{kind: {id: doc}} for {kind: ids}, resolving every kind concurrently."""
+        kinds = [kind for kind, ids in requested.items() if ids]
+        results = await asyncio.gather(*(self.resolve(kind, requested[kind]) for kind in kinds))
+        return {kind: result for kind, result in zip(kinds, results)}
+
+    def invalidate(self, kind: str, entity_id: str):
+        self._cache.pop((kind, entity_id), None)
@@ -0,0 +1,212 @@
+"""
+Session paths and funnel analysis.
+
+PathHook, an ingest batch hook, turns each event into a step token: the
+string "<event_type> <page>" interned as a small integer through the
+codec (kind "path_step"). Tokens are $pushed onto one document per
+session per UTC day in `analytics_paths`:
+
+    {"day": datetime, "session": "...", "path": [3, 17, 17, 42]}
+
+with consecutive repeats within a batch collapsed and the path capped at
+MAX_PATH_STEPS, so a funnel never has to group raw events by session.
+Path documents expire PATH_RETENTION_DAYS after their last update.
+Sessions that cross midnight count as one session per day, and with
+several workers a session's tokens are ordered per batch only.
+
+FunnelAnalysis matches each path against the ordered steps (a
+subsequence match: other steps may occur in between). Only the step
+tokens a definition can match are read from `analytics_dimensions`,
+through an anchored prefix regex on the value when the step names an
+event type. The per-day result of a closed day is memoized per funnel
+definition in an LRU of `max_memo` entries. A closed day still changes
+when late events reach it (spool replays, sessions crossing midnight),
+so a memo is only reused while no path of its day has an `updated_at`
+after the memo was taken, which one indexed lookup per day checks.
+Today's paths are always re-read, and whole results are served from an
+SWR cache keyed by the definition.
+"""
+from collections import Counter, OrderedDict
+from datetime import timedelta
+from pymongo import UpdateOne, ASCENDING
+import json
+import re
+
+from services.analytics_time import day_start, event_time, utc_now
+from services.cache import SWRCache
+
+import logging
+logger = logging.getLogger(__name__)
+
+STEP_KIND = "path_step"
+MAX_PATH_STEPS = 50
+PATH_RETENTION_DAYS = 400
+
+
+def step_value(event: dict) -> str:
+    return f"{event.get('event_type', 'page_view')} {event.get('page') or ''}"
+
+
+def step_matches(step: dict, value: str) -> bool:
+    """Whether a step definition {event_type?, page?} matches a step token's value."""
+    event_type, _, page = value.partition(" ")
+    if step.get("event_type") and step["event_type"] != event_type:
+        return False
+    pattern = step.get("page")
+    if pattern:
+        if pattern.endswith("*"):
+            return page.startswith(pattern[:-1])
+        return page == pattern
+    return True
+
+
+def step_filter(step: dict) -> dict:
+    """analytics_dimensions filter for the step tokens a step definition can match."""
+    event_type = re.escape(step["event_type"]) + " " if step.get("event_type") else r"\S* "
+    pattern = step.get("page")
+    if not pattern:
+        page = ""
+    elif pattern.endswith("*"):
+        page = re.escape(pattern[:-1])
+    else:
+        page = re.escape(pattern) + "$"
+    return {"value": {"$regex": f"^{event_type}{page}"}}
+
+
+def collapse(path: list) -> list:
+    """Drop consecutive repeats (reloads, re-renders) from a path."""
+    return [t for i, t in enumerate(path) if i == 0 or t != path[i - 1]]
+
+
+def funnel_depth(path: list, step_tokens: list) -> int:
+    """How many steps, in order, the path reaches."""
+    depth = 0
+    for token in path:
+        if token in step_tokens[depth]:
+            depth += 1
+            if depth == len(step_tokens):
+                break
+    return depth
+
+
+async def ensure_path_indexes(db):
+    await db.analytics_paths.create_index([("day", ASCENDING), ("session", ASCENDING)], unique=True)
+    await db.analytics_paths.create_index([("day", ASCENDING), ("updated_at", ASCENDING)])
+    await db.analytics_paths.create_index("updated_at", expireAfterSeconds=PATH_RETENTION_DAYS * 86400)
+
+
+class PathHook:
+    """Ingest batch hook that appends step tokens to per-session daily paths."""
+
+    def __init__(self, db, codec):
+        self.db = db
+        self.codec = codec
+
+    async def __call__(self, batch: list):
+        paths = {}
+        for event in batch:
+            if event.get("session_id"):
+                key = (day_start(event_time(event)), event["session_id"])
+                paths.setdefault(key, []).append(step_value(event))
+        if not paths:
+            return
+
+        codes = await self.codec.codes_for(STEP_KIND, {v for values in paths.values() for v in values})
+        now = utc_now()
+        await self.db.analytics_paths.bulk_write([
+            UpdateOne(
+                {"day": day, "session": session},
+                {
+                    "$push": {"path": {"$each": collapse([codes[v] for v in values]), "$slice": MAX_PATH_STEPS}},
+                    "$set": {"updated_at": now}
+                },
+                upsert=True
+            )
+            for (day, session), values in paths.items()
+        ], ordered=False)
+
+
+class FunnelAnalysis:
+    def __init__(self, db, codec, max_memo: int = 5000):
+        self.db = db
+        self.codec = codec
+        self.max_memo = max_memo
+        self.cache = SWRCache(fresh_for=60, stale_for=600)
+        self._memo = OrderedDict()  # (definition, day) -> (taken at, Counter of depth -> sessions)
+
+    async def _step_tokens(self, steps: list) -> list:
+        tokens = [set() for _ in steps]
+        query = {"kind": STEP_KIND, "$or": [step_filter(step) for step in steps]}
+        async for doc in self.db.analytics_dimensions.find(query, {"_id": 0, "value": 1, "code": 1}):
+            for i, step in enumerate(steps):
+                if step_matches(step, doc["value"]):
+                    tokens[i].add(doc["code"])
+        return tokens
+
+    async def _day_depths(self, day, step_tokens: list) -> Counter:
+        depths = Counter()
+        async for doc in self.db.analytics_paths.find({"day": day}, {"_id": 0, "path": 1}):
+            depths[funnel_depth(doc["path"], step_tokens)] += 1
+        return depths
+
+    async def _funnel(self, definition: str, steps: list, days: int) -> dict:
+        step_tokens = await self._step_tokens(steps)
+        today = day_start(utc_now())
+        depths = Counter()
+        for offset in range(days - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            if day == today:
+                depths.update(await self._day_depths(day, step_tokens))
+                continue
+            depths.update(await self._memoized_depths(definition, day, step_tokens))
+
+        sessions = sum(depths.values())
+        report = []
+        previous = sessions
+        for i, step in enumerate(steps):
+            reached = sum(n for depth, n in depths.items() if depth > i)
+            report.append({
+                "step": i + 1,
+                **step,
+                "sessions": reached,
+                "conversion": round(reached / previous, 4) if previous else 0.0,
+                "overall": round(reached / sessions, 4) if sessions else 0.0
+            })
+            previous = reached
+        return {"days": days, "sessions": sessions, "steps": report}
+
+    async def _memoized_depths(self, definition: str, day, step_tokens: list) -> Counter:
+        key = (definition, day)
+        memo = self._memo.get(key)
+        if memo is not None:
+            taken_at, depths = memo
+            changed = await self.db.analytics_paths.find_one({"day": day, "updated_at": {"$gt": taken_at}}, {"_id": 1})
+            if changed is None:
+                self._memo.move_to_end(key)
+                return depths
+        taken_at = utc_now()
+        depths = await self._day_depths(day, step_tokens)
+        self._memo[key] = (taken_at, depths)
+        self._memo.move_to_end(key)
+        if len(self._memo) > self.max_memo:
+            self._memo.popitem(last=False)
+        return depths
+
+    async def funnel(self, steps: list, days: int = 7) -> dict:
+        """Sessions reaching each of `steps` in order over the last `days` UTC days (today included)."""
+        steps = [{k: v for k, v in step.items() if v} for step in steps]
+        definition = json.dumps(steps, sort_keys=True)
+        return await self.cache.get(("funnel", definition, days), lambda: self._funnel(definition, steps, days))
+
+    async def _top_paths(self, days: int, length: int, limit: int) -> list:
+        start = day_start(utc_now()) - timedelta(days=days - 1)
+        counts = Counter()
+        async for doc in self.db.analytics_paths.find({"day": {"$gte": start}}, {"_id": 0, "path": 1}):
+            counts[tuple(collapse(doc["path"])[:length])] += 1
+        top = counts.most_common(limit)
+        values = await self.codec.values_for(STEP_KIND, {t for path, _ in top for t in path})
+        return [{"path": [values.get(t, "?") for t in path], "sessions": n} for path, n in top]
+
+    async def top_paths(self, days: int = 7, length: int = 3, limit: int = 20) -> list:
+        """Most common opening sequences of `length` steps over the last `days` UTC days."""
+        return await self.cache.get(("paths", days, length, limit), lambda: self._top_paths(days, length, limit))
@@ -0,0 +1,168 @@
+"""
+HyperLogLog sketches for unique-visitor counts.
+
+Counting distinct session_ids with $group scans every event in the
+range. Instead each worker keeps one HyperLogLog per UTC day in memory,
+fed by an ingest batch hook, and $sets its registers into
+`analytics_hll` under its own worker id, so no two processes ever write
+the same document. A range is answered by merging (element-wise max) the
+sketches of the days it covers, which costs the same whatever the
+traffic was.
+
+The worker id is stable across restarts (the server uses the host name
+and the worker's spool slot), so a day has at most one document per
+worker slot however often workers restart. A worker that starts a day
+it has no sketch for in memory first loads its stored registers for
+that day, so a restart keeps what the previous process counted.
+
+With p=12 (4096 one-byte registers, stored zlib-compressed) the standard
+error is 1.04 / sqrt(4096) ~= 1.6%, so about 95% of estimates fall within
+3.3% of the true count. Ranges are whole UTC days.
+"""
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from bson import Binary
+from pymongo import UpdateOne, ASCENDING
+import numpy as np
+import os
+import socket
+import zlib
+
+from services.analytics_time import created_between, day_start, event_time, utc_now
+
+import logging
+logger = logging.getLogger(__name__)
+
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_ERROR = 1.04 / HLL_REGISTERS ** 0.5
+
+_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+_VALUE_BITS = 64 - HLL_PRECISION
+
+
+class HyperLogLog:
+    def __init__(self, registers: np.ndarray = None):
+        self.registers = registers if registers is not None else np.zeros(HLL_REGISTERS, dtype=np.uint8)
+
+    def add(self, value: str):
+        h = int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = h >> _VALUE_BITS
+        rest = h & ((1 << _VALUE_BITS) - 1)
+        rank = _VALUE_BITS - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        estimate = _ALPHA * HLL_REGISTERS ** 2 / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * HLL_REGISTERS and zeros:
+            # Small-range correction (linear counting)
+            estimate = HLL_REGISTERS * np.log(HLL_REGISTERS / zeros)
+        return int(round(estimate))
+
+    def to_binary(self) -> Binary:
+        return Binary(zlib.compress(self.registers.tobytes()))
+
+    @classmethod
+    def from_binary(cls, data: bytes) -> "HyperLogLog":
+        return cls(np.frombuffer(zlib.decompress(data), dtype=np.uint8).copy())
+
+
+async def ensure_hll_indexes(db):
+    await db.analytics_hll.create_index([("day", ASCENDING), ("worker", ASCENDING)], unique=True)
+
+
+class UniqueVisitorHook:
+    """Ingest batch hook that folds session_ids into this worker's daily sketches."""
+
+    def __init__(self, db, worker: str = None, keep_days: int = 2):
+        self.db = db
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        self.keep_days = keep_days
+        self.sketches = {}  # day -> HyperLogLog
+
+    async def _load(self, days: set):
+        for day in days:
+            self.sketches[day] = HyperLogLog()
+        async for doc in self.db.analytics_hll.find(
+            {"day": {"$in": list(days)}, "worker": self.worker}, {"_id": 0, "day": 1, "registers": 1}
+        ):
+            self.sketches[doc["day"]].merge(HyperLogLog.from_binary(doc["registers"]))
+
+    async def __call__(self, batch: list):
+        sessions = {}
+        for event in batch:
+            session_id = event.get("session_id")
+            if session_id:
+                sessions.setdefault(day_start(event_time(event)), []).append(session_id)
+        if not sessions:
+            return
+
+        touched = set(sessions)
+        missing = touched - set(self.sketches)
+        if missing:
+            await self._load(missing)
+        for day, session_ids in sessions.items():
+            sketch = self.sketches[day]
+            for session_id in session_ids:
+                sketch.add(session_id)
+
+        now = utc_now()
+        await self.db.analytics_hll.bulk_write([
+            UpdateOne(
+                {"day": day, "worker": self.worker},
+                {"$set": {"registers": self.sketches[day].to_binary(), "updated_at": now}},
+                upsert=True
+            )
+            for day in touched
+        ], ordered=False)
+
+        cutoff = day_start(now) - timedelta(days=self.keep_days)
+        for day in [d for d in self.sketches if d < cutoff]:
+            del self.sketches[day]
+
+
+async def unique_visitors(db, start: datetime = None, end: datetime = None) -> int:
+    """Estimated distinct session_ids over the UTC days in [start, end)."""
+    day = {}
+    if start:
+        day["$gte"] = day_start(start)
+    if end:
+        day["$lt"] = end
+    merged = HyperLogLog()
+    async for doc in db.analytics_hll.find({"day": day} if day else {}, {"_id": 0, "registers": 1}):
+        merged.merge(HyperLogLog.from_binary(doc["registers"]))
+    return merged.count()
+
+
+async def backfill_sketches(db, start: datetime, end: datetime) -> dict:
+    """Rebuild the sketches of whole closed days in [start, end) from raw events.
+
+    Each day's per-worker documents are replaced by a single merged one.
+    """
+    day = day_start(start)
+    end = day_start(end)
+    days = 0
+    while day < end:
+        next_day = day + timedelta(days=1)
+        sketch = HyperLogLog()
+        cursor = db.analytics.find(
+            {**created_between(day, next_day), "session_id": {"$nin": [None, ""]}},
+            {"_id": 0, "session_id": 1}
+        ).batch_size(5000)
+        async for event in cursor:
+            sketch.add(event["session_id"])
+
+        await db.analytics_hll.delete_many({"day": day})
+        await db.analytics_hll.insert_one({
+            "day": day, "worker": "backfill", "registers": sketch.to_binary(), "updated_at": utc_now()
+        })
+        day = next_day
+        days += 1
+
+    logger.info(f"Backfilled unique-visitor sketches for {days} days")
+    return {"days": days}
@@ -0,0 +1,75 @@
+"""
+In-memory "right now" activity from a sliding window of minute buckets.
+
+The tracking routes call record() for every accepted event. Each bucket
+covers one wall-clock minute and holds the set of session ids seen in it
+plus Counters of pages and talents viewed; buckets older than the window
+are dropped as new minutes start, so memory is bounded by the traffic of
+the last `window_minutes`. snapshot() merges the newest 1 / 5 / 15
+buckets, so the live endpoint never touches MongoDB.
+
+The window is per worker: with several workers each reports the
+traffic it served.
+"""
+from collections import Counter, deque
+import time
+
+DEFAULT_SPANS = (1, 5, 15)
+
+
+class _Bucket:
+    __slots__ = ("minute", "sessions", "pages", "talents", "events")
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.sessions = set()
+        self.pages = Counter()
+        self.talents = Counter()
+        self.events = 0
+
+
+class LiveActivity:
+    def __init__(self, window_minutes: int = 15, clock=time.time):
+        self.window_minutes = window_minutes
+        self.clock = clock
+        self.buckets = deque()
+
+    def _current(self, minute: int) -> _Bucket:
+        if not self.buckets or self.buckets[-1].minute != minute:
+            self.buckets.append(_Bucket(minute))
+        self._expire(minute)
+        return self.buckets[-1]
+
+    def _expire(self, minute: int):
+        while self.buckets and self.buckets[0].minute <= minute - self.window_minutes:
+            self.buckets.popleft()
+
+    def record(self, event: dict):
+        bucket = self._current(int(self.clock() // 60))
+        bucket.events += 1
+        if event.get("session_id"):
+            bucket.sessions.add(event["session_id"])
+        if event.get("page"):
+            bucket.pages[event["page"]] += 1
+        if event.get("talent_id"):
+            bucket.talents[event["talent_id"]] += 1
+
+    def snapshot(self, spans=DEFAULT_SPANS, limit: int = 10) -> dict:
+        """{"<n>m": {active_sessions, events, top_pages, top_talents}} for each span in minutes."""
+        minute = int(self.clock() // 60)
+        self._expire(minute)
+        report = {}
+        for span in spans:
+            recent = [b for b in self.buckets if b.minute > minute - span]
+            sessions = set().union(*(b.sessions for b in recent))
+            pages, talents = Counter(), Counter()
+            for b in recent:
+                pages.update(b.pages)
+                talents.update(b.talents)
+            report[f"{span}m"] = {
+                "active_sessions": len(sessions),
+                "events": sum(b.events for b in recent),
+                "top_pages": [{"page": p, "count": n} for p, n in pages.most_common(limit)],
+                "top_talents": [{"talent_id": t, "count": n} for t, n in talents.most_common(limit)]
+            }
+        return report
@@ -0,0 +1,162 @@
+"""
+Token-bucket rate limiting for the hot public endpoints.
+
+Each limit is (capacity, refill rate in tokens per second). A bucket
+starts full, every request takes one token, and a refused request gets
+a 429 with Retry-After set to the time until the next token.
+
+MemoryBucketStore keeps buckets per worker in a bounded LRU of
+(tokens, updated_at, full_at) tuples. A bucket that has refilled
+completely is indistinguishable from a missing one, so each request also
+drops the oldest entries once they are full again, and the LRU cap keeps
+memory bounded even when every request comes from a new address.
+MongoBucketStore shares buckets between workers with one atomic pipeline
+update per request and a TTL index for expiry.
+
+Buckets are keyed by the address the trusted ingress saw. Each proxy
+appends the address it received the request from to X-Forwarded-For, so
+only the last `trusted_proxy_hops` entries are written by our own
+infrastructure; anything to their left is whatever the client sent and
+must not pick the bucket, or a random leading entry per request would
+get a fresh bucket every time.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+import math
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+# route -> (capacity, tokens per second)
+RATE_LIMITS = {
+    "vote": (10, 10 / 60),
+    # Login guesses per (email, client address), so a stranger cannot lock an account out
+    "login_email": (5, 1 / 60),
+    # Looser per-email backstop against guessing one account from many addresses
+    "login_email_any": (30, 10 / 60),
+    "login_ip": (20, 10 / 60),
+    "analytics_track": (120, 5.0),
+}
+
+
+def client_ip(request: Request, trusted_hops: int = 1) -> str:
+    """Client address as recorded by the `trusted_hops`-th proxy from the right of X-Forwarded-For."""
+    if trusted_hops > 0:
+        forwarded = ",".join(request.headers.getlist("x-forwarded-for"))
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if len(hops) >= trusted_hops:
+            return hops[-trusted_hops]
+    return request.client.host if request.client else "unknown"
+
+
+class MemoryBucketStore:
+    def __init__(self, max_keys: int = 50000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at, full_at)
+
+    async def ensure_indexes(self):
+        pass
+
+    async def take(self, key: str, capacity: float, rate: float) -> float:
+        """Take a token; returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        entry = self._buckets.pop(key, None)
+        tokens = capacity if entry is None else min(capacity, entry[0] + (now - entry[1]) * rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / rate
+
+        self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        self._expire(now)
+        return retry_after
+
+    def _expire(self, now: float):
+        # Lazy expiry: the least recently used entries are the likeliest to be full again
+        for _ in range(2):
+            oldest = next(iter(self._buckets.items()), None)
+            if oldest is None or oldest[1][2] > now:
+                break
+            del self._buckets[oldest[0]]
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class MongoBucketStore:
+    def __init__(self, db):
+        self.collection = db.rate_limits
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, capacity: float, rate: float) -> float:
+        now = time.time()
+        refill_seconds = capacity / rate
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": {"$min": [capacity, {"$add": [
+                    {"$ifNull": ["$tokens", capacity]},
+                    {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, rate]}
+                ]}]}}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "ts": now,
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=refill_seconds)
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc["allowed"]:
+            return 0.0
+        return (1 - doc["tokens"]) / rate
+
+
+class RateLimiter:
+    def __init__(self, store, limits: dict = None, trusted_proxy_hops: int = 1):
+        self.store = store
+        self.limits = limits or RATE_LIMITS
+        self.trusted_proxy_hops = trusted_proxy_hops
+
+    def client_ip(self, request: Request) -> str:
+        return client_ip(request, self.trusted_proxy_hops)
+
+    async def check_login(self, request: Request, email: str):
+        """Apply the per-address, per-(email, address) and per-email login limits."""
+        ip = self.client_ip(request)
+        email = email.lower()
+        await self.check("login_ip", ip)
+        await self.check("login_email", f"{email}|{ip}")
+        await self.check("login_email_any", email)
+
+    async def ensure_indexes(self):
+        await self.store.ensure_indexes()
+
+    async def check(self, route: str, key: str):
+        """Raise a 429 HTTPException if `key` has exhausted its bucket for `route`."""
+        capacity, rate = self.limits[route]
+        try:
+            retry_after = await self.store.take(f"{route}:{key}", capacity, rate)
+        except Exception as e:
+            # Fail open: a limiter outage must not take the site down with it
+            logger.warning(f"Rate limiter unavailable: {e}")
+            return
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, please try again later",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+
+def create_rate_limiter(db, store: str = "memory", max_keys: int = 50000, trusted_proxy_hops: int = 1) -> RateLimiter:
+    if store == "mongo":
+        return RateLimiter(MongoBucketStore(db), trusted_proxy_hops=trusted_proxy_hops)
+    return RateLimiter(MemoryBucketStore(max_keys=max_keys), trusted_proxy_hops=trusted_proxy_hops)
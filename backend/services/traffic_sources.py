@@ -0,0 +1,98 @@
+"""
+Referrer and user-agent classification for the traffic dashboards.
+
+referrer_domain() reduces a referrer URL to the site it came from and
+classify_user_agent() maps a user-agent string to (device, browser, os)
+with a compiled, ordered rule set (first match wins). Both are
+lru_cached on the raw string, and the strings are already interned at
+ingest (analytics_codec), so each distinct value is parsed once per
+worker however many events carry it. The rollup hook turns the results
+into per-day counters under the "referrer_domain", "device", "browser"
+and "os" dimensions.
+"""
+from functools import lru_cache
+from urllib.parse import urlsplit
+import re
+
+DIRECT = "(direct)"
+UNKNOWN = "unknown"
+
+# Mobile and link-shim hosts that stand for the main site
+_HOST_PREFIXES = ("www.", "m.", "mobile.", "l.", "lm.")
+_HOST_ALIASES = {"t.co": "twitter.com", "x.com": "twitter.com", "youtu.be": "youtube.com"}
+_SEARCH_ENGINE = re.compile(r"^(google|bing|yahoo|duckduckgo|yandex)\.[a-z.]+$")
+
+_DEVICE_RULES = [
+    ("bot", re.compile(r"bot|crawl|spider|slurp|facebookexternalhit|whatsapp|preview|headless", re.I)),
+    ("tablet", re.compile(r"iPad|Tablet|PlayBook|Silk|Android(?!.*Mobile)", re.I)),
+    ("mobile", re.compile(r"Mobi|iPhone|iPod|Android|Windows Phone", re.I)),
+]
+_BROWSER_RULES = [
+    ("Instagram", re.compile(r"Instagram")),
+    ("Facebook", re.compile(r"FBAN|FBAV")),
+    ("Edge", re.compile(r"Edg(e|A|iOS)?/")),
+    ("Opera", re.compile(r"OPR/|Opera")),
+    ("Samsung Internet", re.compile(r"SamsungBrowser")),
+    ("Chrome", re.compile(r"Chrome/|CriOS/")),
+    ("Firefox", re.compile(r"Firefox/|FxiOS/")),
+    ("Safari", re.compile(r"Safari/")),
+]
+_OS_RULES = [
+    ("iOS", re.compile(r"iPhone|iPad|iPod")),
+    ("Android", re.compile(r"Android")),
+    ("Windows", re.compile(r"Windows")),
+    ("ChromeOS", re.compile(r"CrOS")),
+    ("macOS", re.compile(r"Mac OS X|Macintosh")),
+    ("Linux", re.compile(r"Linux")),
+]
+
+
+def _first_match(rules, value: str, default: str) -> str:
+    for name, pattern in rules:
+        if pattern.search(value):
+            return name
+    return default
+
+
+@lru_cache(maxsize=20000)
+def referrer_domain(referrer: str) -> str:
+    if not referrer:
+        return DIRECT
+    try:
+        parts = urlsplit(referrer if "//" in referrer else f"//{referrer}")
+        host = (parts.hostname or "").rstrip(".")
+    except ValueError:
+        # The referrer is whatever the client sent, e.g. "http://[abc" (an unterminated IPv6 host)
+        return UNKNOWN
+    if parts.scheme == "android-app":
+        return f"app:{parts.netloc}"
+    if not host:
+        return DIRECT
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix) and host.count(".") > 1:
+            host = host[len(prefix):]
+            break
+    host = _HOST_ALIASES.get(host, host)
+    engine = _SEARCH_ENGINE.match(host)
+    return engine.group(1) if engine else host
+
+
+@lru_cache(maxsize=20000)
+def classify_user_agent(user_agent: str) -> tuple:
+    """(device, browser, os) for a user-agent string."""
+    if not user_agent:
+        return (UNKNOWN, UNKNOWN, UNKNOWN)
+    return (
+        _first_match(_DEVICE_RULES, user_agent, "desktop"),
+        _first_match(_BROWSER_RULES, user_agent, "Other"),
+        _first_match(_OS_RULES, user_agent, "Other"),
+    )
+
+
+def traffic_dimensions(event: dict):
+    """(dim, value) pairs derived from an event's referrer and user agent."""
+    yield "referrer_domain", referrer_domain(event.get("referrer") or "")
+    device, browser, os_name = classify_user_agent(event.get("user_agent") or "")
+    yield "device", device
+    yield "browser", browser
+    yield "os", os_name
@@ -0,0 +1,191 @@
+"""
+Incremental reconciliation of the denormalized talents.votes counter.
+
+Each run aggregates only the votes cast since the stored watermark
+(from either vote storage layout, see services.vote_store) and
+folds them into per-talent tallies (vote_tallies). Talents touched by
+the window are then compared with their tallies and any drift is
+corrected with a single bulk write and recorded in
+vote_reconciliation_runs.
+
+The window is written to job_state before it is applied, and every
+tally remembers the last window it absorbed, so a run that crashes half
+way can simply be repeated without double counting.
+
+A tally only covers votes up to the window's upper bound, so a counter
+is compared with the tally plus the talent's votes after the bound.
+Those are counted just before and just after the counters are read
+(votes are stored before their counter is incremented); a talent whose
+count moved in between was voted for while its counter was read, so it
+is left alone and carried over to the next run in job_state.deferred.
+A talent deferred MAX_DEFERRALS runs in a row is checked anyway against
+the count read before the counters, so a steady stream of votes cannot
+hide its drift for ever; a vote that lands during the reads can make
+that correction off by one, which the talent's next check undoes.
+"""
+from datetime import datetime, timezone, timedelta
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError
+import asyncio
+import uuid
+
+import logging
+logger = logging.getLogger(__name__)
+
+JOB_ID = "vote_reconciliation"
+# Votes younger than this may still be waiting for their talents.votes $inc
+SETTLE_SECONDS = 30
+LOCK_SECONDS = 600
+MAX_DEFERRALS = 3
+
+
+async def ensure_reconciliation_indexes(db):
+    await db.job_state.create_index([("id", ASCENDING)], unique=True)
+    await db.votes.create_index([("created_at", ASCENDING)])
+    await db.vote_tallies.create_index([("talent_id", ASCENDING)], unique=True)
+    await db.vote_reconciliation_runs.create_index([("started_at", ASCENDING)])
+
+
+async def _acquire_lock(db, now):
+    try:
+        result = await db.job_state.update_one(
+            {"id": JOB_ID, "$or": [{"locked_until": {"$exists": False}}, {"locked_until": {"$lt": now.isoformat()}}]},
+            {"$set": {"locked_until": (now + timedelta(seconds=LOCK_SECONDS)).isoformat()}},
+            upsert=True
+        )
+    except Exception:
+        # Upsert raced with a live lock held by another worker
+        return False
+    return result.matched_count > 0 or result.upserted_id is not None
+
+
+async def _apply_tallies(db, counts, upper):
+    if not counts:
+        return
+    ops = [
+        UpdateOne(
+            {"talent_id": talent_id, "watermark": {"$lt": upper}},
+            {"$inc": {"count": count}, "$set": {"watermark": upper}},
+            upsert=True
+        )
+        for talent_id, count in counts.items()
+    ]
+    try:
+        await db.vote_tallies.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # Duplicate keys mean the tally already absorbed this window
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+async def reconcile_votes(db, vote_store, settle_seconds: int = SETTLE_SECONDS):
+    """Run one reconciliation pass. Returns the run record, or None if another run holds the lock."""
+    started = datetime.now(timezone.utc)
+    if not await _acquire_lock(db, started):
+        return None
+
+    try:
+        state = await db.job_state.find_one({"id": JOB_ID}, {"_id": 0}) or {}
+        lower = state.get("watermark")
+        upper = state.get("pending_upper")
+        if not upper:
+            upper = (started - timedelta(seconds=settle_seconds)).isoformat()
+            await db.job_state.update_one({"id": JOB_ID}, {"$set": {"pending_upper": upper}})
+
+        counts = await vote_store.window_counts(lower, upper)
+        await _apply_tallies(db, counts, upper)
+
+        previous = state.get("deferred") or {}
+        if isinstance(previous, list):
+            previous = dict.fromkeys(previous, 1)
+        touched = set(counts) | set(previous)
+        if not lower:
+            # First run: also catch counters that have no votes behind them at all
+            async for t in db.talents.find({"votes": {"$gt": 0}}, {"_id": 0, "id": 1}):
+                touched.add(t["id"])
+
+        tallies = {}
+        async for t in db.vote_tallies.find({"talent_id": {"$in": list(touched)}}, {"_id": 0, "talent_id": 1, "count": 1}):
+            tallies[t["talent_id"]] = t["count"]
+
+        newer = await vote_store.window_counts(upper, None)
+        counters = {}
+        async for t in db.talents.find({"id": {"$in": list(touched)}}, {"_id": 0, "id": 1, "votes": 1}):
+            counters[t["id"]] = t.get("votes", 0)
+        newer_after = await vote_store.window_counts(upper, None)
+
+        drift = []
+        deferred = {}
+        for talent_id, counter in counters.items():
+            if newer_after.get(talent_id, 0) != newer.get(talent_id, 0):
+                # Voted for while its counter was read; check it next run unless it keeps happening
+                deferrals = previous.get(talent_id, 0) + 1
+                if deferrals < MAX_DEFERRALS:
+                    deferred[talent_id] = deferrals
+                    continue
+            actual = tallies.get(talent_id, 0) + newer.get(talent_id, 0)
+            if counter != actual:
+                drift.append({"talent_id": talent_id, "counter": counter, "actual": actual})
+
+        if drift:
+            await db.talents.bulk_write(
+                # $inc by the difference so concurrent votes are not overwritten
+                [UpdateOne({"id": d["talent_id"]}, {"$inc": {"votes": d["actual"] - d["counter"]}}) for d in drift],
+                ordered=False
+            )
+
+        run = {
+            "id": str(uuid.uuid4()),
+            "started_at": started.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "watermark_from": lower,
+            "watermark_to": upper,
+            "votes_scanned": sum(counts.values()),
+            "talents_checked": len(counters) - len(deferred),
+            "talents_deferred": len(deferred),
+            "drift": drift[:500],
+            "talents_corrected": len(drift),
+            "total_drift": sum(d["actual"] - d["counter"] for d in drift)
+        }
+        await db.vote_reconciliation_runs.insert_one(dict(run))
+        await db.job_state.update_one(
+            {"id": JOB_ID},
+            {"$set": {"watermark": upper, "deferred": deferred}, "$unset": {"pending_upper": "", "locked_until": ""}}
+        )
+        if drift:
+            logger.warning(f"Vote reconciliation corrected {len(drift)} talents (net drift {run['total_drift']})")
+        return run
+    except Exception:
+        await db.job_state.update_one({"id": JOB_ID}, {"$unset": {"locked_until": ""}})
+        raise
+
+
+class VoteReconciler:
+    """Runs reconcile_votes in the background every `interval` seconds."""
+
+    def __init__(self, db, vote_store, interval: float):
+        self.db = db
+        self.vote_store = vote_store
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await reconcile_votes(self.db, self.vote_store)
+            except Exception as e:
+                logger.error(f"Vote reconciliation failed: {e}")
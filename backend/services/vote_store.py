@@ -0,0 +1,213 @@
+"""
+Vote storage with two layouts.
+
+"document" keeps one document per vote in `votes` (the original layout).
+"bucket" packs votes into `vote_buckets`, one document per talent per
+UTC hour and contest (null outside contests) holding a count plus
+parallel arrays of millisecond offsets into the hour and voter emails.
+Buckets are capped at BUCKET_CAPACITY votes; a full bucket simply gets
+a sibling.
+
+Reads always combine both layouts, so the store stays correct while
+migrate_votes_to_buckets moves old vote documents across.
+"""
+from datetime import datetime, timezone
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+import hashlib
+import uuid
+
+import logging
+logger = logging.getLogger(__name__)
+
+VOTE_LAYOUTS = ("document", "bucket")
+BUCKET_CAPACITY = 1000
+
+
+def _hour_start(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _parse_iso(value) -> datetime:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _offset_ms(dt: datetime, hour: datetime) -> int:
+    return int((dt - hour).total_seconds() * 1000)
+
+
+async def ensure_vote_store_indexes(db):
+    await db.vote_buckets.create_index([("talent_id", ASCENDING), ("hour", ASCENDING), ("contest_id", ASCENDING)])
+    await db.vote_buckets.create_index([("contest_id", ASCENDING), ("hour", ASCENDING)])
+    await db.vote_buckets.create_index([("hour", ASCENDING)])
+    await db.vote_buckets.create_index([("migrated_ids", ASCENDING)], sparse=True)
+
+
+class VoteStore:
+    def __init__(self, db, layout: str = "document"):
+        if layout not in VOTE_LAYOUTS:
+            raise ValueError(f"Unknown vote storage layout: {layout}")
+        self.db = db
+        self.layout = layout
+
+    async def record(self, talent_id: str, voter_email: str = "", when: datetime = None, contest_id: str = None):
+        when = when or datetime.now(timezone.utc)
+        if self.layout == "document":
+            doc = {
+                "id": str(uuid.uuid4()),
+                "talent_id": talent_id,
+                "voter_email": voter_email,
+                "created_at": when.isoformat()
+            }
+            if contest_id:
+                doc["contest_id"] = contest_id
+            await self.db.votes.insert_one(doc)
+            return
+
+        hour = _hour_start(when)
+        await self.db.vote_buckets.update_one(
+            {"talent_id": talent_id, "hour": hour, "contest_id": contest_id, "count": {"$lt": BUCKET_CAPACITY}},
+            {
+                "$inc": {"count": 1},
+                "$push": {"offsets": _offset_ms(when, hour), "voters": voter_email or ""}
+            },
+            upsert=True
+        )
+
+    async def count_total(self) -> int:
+        documents = await self.db.votes.estimated_document_count()
+        result = await self.db.vote_buckets.aggregate([
+            {"$group": {"_id": None, "total": {"$sum": "$count"}}}
+        ]).to_list(1)
+        return documents + (result[0]["total"] if result else 0)
+
+    async def count_for(self, talent_id: str) -> int:
+        documents = await self.db.votes.count_documents({"talent_id": talent_id})
+        result = await self.db.vote_buckets.aggregate([
+            {"$match": {"talent_id": talent_id}},
+            {"$group": {"_id": None, "total": {"$sum": "$count"}}}
+        ]).to_list(1)
+        return documents + (result[0]["total"] if result else 0)
+
+    async def window_counts(self, lower: str = None, upper: str = None) -> dict:
+        """Per-talent vote counts with lower < created_at <= upper (ISO strings, either bound optional)."""
+        counts = {}
+
+        created = {}
+        if lower:
+            created["$gt"] = lower
+        if upper:
+            created["$lte"] = upper
+        async for r in self.db.votes.aggregate([
+            {"$match": {"created_at": created} if created else {}},
+            {"$group": {"_id": "$talent_id", "count": {"$sum": 1}}}
+        ], allowDiskUse=True):
+            counts[r["_id"]] = counts.get(r["_id"], 0) + r["count"]
+
+        lower_dt = _parse_iso(lower) if lower else None
+        upper_dt = _parse_iso(upper) if upper else None
+        hours = {}
+        conditions = []
+        vote_time = {"$add": ["$hour", "$$this"]}
+        if lower_dt:
+            hours["$gte"] = _hour_start(lower_dt)
+            conditions.append({"$gt": [vote_time, lower_dt]})
+        if upper_dt:
+            hours["$lte"] = upper_dt
+            conditions.append({"$lte": [vote_time, upper_dt]})
+        async for r in self.db.vote_buckets.aggregate([
+            {"$match": {"hour": hours} if hours else {}},
+            {"$project": {
+                "talent_id": 1,
+                "n": {"$size": {"$filter": {"input": "$offsets", "cond": {"$and": conditions}}}}
+            }},
+            {"$group": {"_id": "$talent_id", "count": {"$sum": "$n"}}}
+        ], allowDiskUse=True):
+            if r["count"]:
+                counts[r["_id"]] = counts.get(r["_id"], 0) + r["count"]
+
+        return counts
+
+    async def recent_votes(self, talent_id: str, limit: int = 50) -> list:
+        """Most recent votes for a talent as {voter_email, created_at} dicts."""
+        votes = await self.db.votes.find(
+            {"talent_id": talent_id}, {"_id": 0, "voter_email": 1, "created_at": 1}
+        ).sort("created_at", DESCENDING).limit(limit).to_list(limit)
+
+        # Buckets come newest hour first; stop once whole hours already cover the limit
+        from_buckets = 0
+        current_hour = None
+        async for bucket in self.db.vote_buckets.find({"talent_id": talent_id}).sort("hour", DESCENDING):
+            if bucket["hour"] != current_hour and from_buckets >= limit:
+                break
+            current_hour = bucket["hour"]
+            hour = _parse_iso(bucket["hour"])
+            for offset, voter in zip(bucket.get("offsets", []), bucket.get("voters", [])):
+                created = hour.timestamp() + offset / 1000
+                votes.append({
+                    "voter_email": voter,
+                    "created_at": datetime.fromtimestamp(created, timezone.utc).isoformat()
+                })
+                from_buckets += 1
+
+        votes.sort(key=lambda v: v["created_at"], reverse=True)
+        return votes[:limit]
+
+
+async def migrate_votes_to_buckets(db, batch_size: int = 5000, max_batches: int = 20) -> dict:
+    """Move vote documents into hour buckets, oldest first.
+
+    Votes cast in a contest keep their contest_id in the bucket key, as
+    record() does, and a group larger than BUCKET_CAPACITY is split
+    across sibling buckets. Every migrated bucket lists the _ids it was
+    built from in `migrated_ids` and is keyed on a hash of that set, so
+    a batch re-run after a crash skips the votes a bucket already holds
+    and rewrites nothing. Only the _ids written in this run (or found in
+    a bucket) are deleted.
+    """
+    migrated = 0
+    for _ in range(max_batches):
+        docs = await db.votes.find({}).sort("_id", ASCENDING).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+
+        ids = [doc["_id"] for doc in docs]
+        done = set()
+        async for bucket in db.vote_buckets.find({"migrated_ids": {"$in": ids}}, {"migrated_ids": 1}):
+            done.update(bucket["migrated_ids"])
+        done.intersection_update(ids)
+
+        groups = {}
+        for doc in docs:
+            if doc["_id"] in done:
+                continue
+            created = _parse_iso(doc.get("created_at") or doc["_id"].generation_time)
+            hour = _hour_start(created)
+            key = (doc.get("talent_id"), doc.get("contest_id"), hour)
+            groups.setdefault(key, []).append((doc, created))
+
+        requests = []
+        for (talent_id, contest_id, hour), votes in groups.items():
+            for start in range(0, len(votes), BUCKET_CAPACITY):
+                chunk = votes[start:start + BUCKET_CAPACITY]
+                chunk_ids = [doc["_id"] for doc, _ in chunk]
+                source = hashlib.sha1(b"".join(oid.binary for oid in chunk_ids)).hexdigest()
+                requests.append(UpdateOne(
+                    {"talent_id": talent_id, "hour": hour, "contest_id": contest_id, "source": source},
+                    {"$setOnInsert": {
+                        "count": len(chunk),
+                        "offsets": [_offset_ms(created, hour) for _, created in chunk],
+                        "voters": [doc.get("voter_email") or "" for doc, _ in chunk],
+                        "migrated_ids": chunk_ids
+                    }},
+                    upsert=True
+                ))
+        if requests:
+            await db.vote_buckets.bulk_write(requests, ordered=False)
+        await db.votes.delete_many({"_id": {"$in": ids}})
+        migrated += len(docs) - len(done)
+
+    remaining = await db.votes.estimated_document_count()
+    logger.info(f"Migrated {migrated} votes to buckets, {remaining} remaining")
+    return {"migrated": migrated, "remaining": remaining}
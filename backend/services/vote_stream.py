@@ -0,0 +1,105 @@
+"""
+Live vote counts pushed to Server-Sent Events subscribers.
+
+A single in-process broadcaster holds the latest count for every talent
+that somebody is watching. Votes only record the new count; a flusher
+task sends at most one message per talent per interval to each
+subscriber, and a periodic refresh picks up votes cast on other workers
+with one query for all watched talents.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBroadcaster:
+    def __init__(self, db, interval: float = 1.0, refresh_interval: float = 10.0, queue_size: int = 64):
+        self.db = db
+        self.interval = interval
+        self.refresh_interval = refresh_interval
+        self.queue_size = queue_size
+        self._subscribers = {}  # talent_id -> set of subscriber queues
+        self._latest = {}  # talent_id -> last known vote count
+        self._pending = set()  # talent_ids changed since the last flush
+        self._task = None
+
+    async def subscribe(self, talent_ids):
+        """Register a subscriber queue and return it with the current counts."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        missing = [tid for tid in talent_ids if tid not in self._latest]
+        if missing:
+            await self._load_counts(missing)
+        for tid in talent_ids:
+            self._subscribers.setdefault(tid, set()).add(queue)
+        self._ensure_started()
+        initial = {tid: self._latest[tid] for tid in talent_ids if tid in self._latest}
+        return queue, initial
+
+    def unsubscribe(self, queue, talent_ids):
+        for tid in talent_ids:
+            queues = self._subscribers.get(tid)
+            if not queues:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[tid]
+                self._latest.pop(tid, None)
+                self._pending.discard(tid)
+
+    def publish(self, talent_id: str, votes: int):
+        """Record a new count; delivery is coalesced by the flusher."""
+        if talent_id not in self._subscribers:
+            return
+        if self._latest.get(talent_id) != votes:
+            self._latest[talent_id] = votes
+            self._pending.add(talent_id)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _load_counts(self, talent_ids):
+        cursor = self.db.talents.find({"id": {"$in": list(talent_ids)}}, {"_id": 0, "id": 1, "votes": 1})
+        async for t in cursor:
+            self._latest[t["id"]] = t.get("votes", 0)
+
+    async def _refresh(self):
+        watched = list(self._subscribers)
+        if not watched:
+            return
+        cursor = self.db.talents.find({"id": {"$in": watched}}, {"_id": 0, "id": 1, "votes": 1})
+        async for t in cursor:
+            self.publish(t["id"], t.get("votes", 0))
+
+    def _flush(self):
+        pending, self._pending = self._pending, set()
+        for tid in pending:
+            message = {"talent_id": tid, "votes": self._latest.get(tid, 0)}
+            for queue in self._subscribers.get(tid, ()):
+                if queue.full():
+                    # Slow consumer: drop its oldest message, counts are cumulative anyway
+                    queue.get_nowait()
+                queue.put_nowait(message)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + self.refresh_interval
+        while self._subscribers:
+            await asyncio.sleep(self.interval)
+            if loop.time() >= next_refresh:
+                next_refresh = loop.time() + self.refresh_interval
+                try:
+                    await self._refresh()
+                except Exception as e:
+                    logger.warning(f"Vote count refresh failed: {e}")
+            self._flush()
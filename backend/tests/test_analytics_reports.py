@@ -0,0 +1,203 @@
+"""
+Test Analytics report APIs - views chart bucketing and raw event export
+Tests GET /api/admin/analytics/daily-views (range, granularity, timezone),
+GET /api/admin/analytics/export/raw (CSV, NDJSON, gzip) and
+POST /api/admin/analytics/query (in-memory column store) and the
+referrer / device breakdowns, ad CTR, live activity and funnels
+"""
+import pytest
+import requests
+import os
+import json
+import gzip
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestDailyViews:
+    """Test the views chart endpoint"""
+
+    def test_default_shape(self):
+        """Default call returns 30 daily {date, views} points"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/daily-views")
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data) == 30
+        assert set(data[0]) == {"date", "views"}
+
+    def test_hourly_in_fractional_timezone(self):
+        """Hourly buckets in Asia/Kolkata (+05:30) use the raw $dateTrunc path"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/daily-views", params={
+            "days": 2, "granularity": "hour", "tz": "Asia/Kolkata"
+        })
+        assert response.status_code == 200
+        assert len(response.json()) == 48
+
+    def test_weekly_with_event_type(self):
+        """Weekly buckets filtered to one event type"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/daily-views", params={
+            "days": 28, "granularity": "week", "event_type": "talent_view"
+        })
+        assert response.status_code == 200
+        assert len(response.json()) == 4
+
+    def test_rejects_bad_parameters(self):
+        """Unknown granularity or timezone returns 400"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/daily-views", params={"granularity": "minute"})
+        assert response.status_code == 400
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/daily-views", params={"tz": "Mars/Olympus"})
+        assert response.status_code == 400
+
+
+class TestRawExport:
+    """Test the streaming raw event export"""
+
+    def test_csv_export(self):
+        """CSV export starts with the header row"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/export/raw", params={"start": "2020-01-01"})
+        assert response.status_code == 200
+        assert response.text.splitlines()[0].startswith("id,event_type,page")
+
+    def test_ndjson_gzip_export(self):
+        """gzip NDJSON export decompresses to one JSON object per line"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/export/raw", params={
+            "format": "ndjson", "gzip": "true", "event_type": "page_view"
+        }, stream=True)
+        assert response.status_code == 200
+        lines = gzip.decompress(response.raw.read()).decode().splitlines()
+        for line in lines[:10]:
+            assert json.loads(line)["event_type"] == "page_view"
+        print(f"Exported {len(lines)} page_view events")
+
+    def test_rejects_bad_range(self):
+        """Unparseable dates return 400"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/export/raw", params={"start": "yesterday"})
+        assert response.status_code == 400
+
+
+class TestAdhocQuery:
+    """Test the ad-hoc query endpoint"""
+
+    def test_count_by_event_type(self):
+        """Counts grouped by event type"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/query", json={"group_by": ["event_type"]})
+        assert response.status_code == 200
+        data = response.json()
+        assert "rows" in data and "elapsed_ms" in data
+        for row in data["rows"]:
+            assert "event_type" in row and "count" in row
+        print(f"Query over {data['in_memory']} events took {data['elapsed_ms']}ms")
+
+    def test_uniques_per_day_with_filter(self):
+        """Distinct sessions per day for page views"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/query", json={
+            "metric": "uniques", "bucket": "day", "filters": {"event_type": "page_view"}
+        })
+        assert response.status_code == 200
+        for row in response.json()["rows"]:
+            assert "bucket" in row and "uniques" in row
+
+    def test_rejects_unknown_dimension(self):
+        """Unknown dimensions and metrics return 400"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/query", json={"group_by": ["password"]})
+        assert response.status_code == 400
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/query", json={"metric": "sum"})
+        assert response.status_code == 400
+
+
+class TestTrafficSources:
+    """Test referrer and device breakdowns"""
+
+    def test_referrers(self):
+        """Referrers are reported as domains with their share"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/referrers", params={"days": 7})
+        assert response.status_code == 200
+        for row in response.json():
+            assert "/" not in row["domain"]
+            assert 0 <= row["share"] <= 1
+
+    def test_devices(self):
+        """Devices endpoint returns device, browser and os breakdowns"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/devices")
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data) == {"device", "browser", "os"}
+        print(f"Devices: {data['device']}")
+
+    def test_rejects_bad_range(self):
+        """days outside 1..366 returns 400"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/referrers", params={"days": 0})
+        assert response.status_code == 400
+
+
+class TestAdCtr:
+    """Test the ad click-through report"""
+
+    def test_ctr_report(self):
+        """Serving ads counts impressions; the report has per-day CTR rows"""
+        requests.get(f"{BASE_URL}/api/advertisements/select", params={"count": 3})
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/ad-ctr", params={"days": 7})
+        assert response.status_code == 200
+        for ad in response.json():
+            assert {"ad_id", "impressions", "clicks", "ctr", "daily"} <= set(ad)
+            for day in ad["daily"]:
+                assert "date" in day and "ctr" in day
+
+    def test_select_distinct_ads(self):
+        """Selection returns distinct active ads"""
+        response = requests.get(f"{BASE_URL}/api/advertisements/select", params={"count": 5})
+        assert response.status_code == 200
+        ids = [ad["id"] for ad in response.json()]
+        assert len(ids) == len(set(ids)) <= 5
+        for ad in response.json():
+            assert ad["is_active"] is True
+
+
+class TestLiveActivity:
+    """Test the in-memory live activity window"""
+
+    def test_live_counts_tracked_event(self):
+        """A tracked page view shows up in the 1-minute window"""
+        requests.post(f"{BASE_URL}/api/analytics/track", json={
+            "event_type": "page_view", "page": "/live-test", "session_id": "live-test-session"
+        }, headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0"})
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/live")
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data) == {"1m", "5m", "15m"}
+        assert data["15m"]["active_sessions"] >= data["1m"]["active_sessions"]
+        for window in data.values():
+            assert {"active_sessions", "events", "top_pages", "top_talents"} <= set(window)
+
+
+class TestFunnels:
+    """Test funnel and path analysis"""
+
+    def test_funnel_is_monotonic(self):
+        """Each step reaches no more sessions than the one before"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/funnel", json={"steps": [
+            {"event_type": "page_view", "page": "/"},
+            {"event_type": "talent_view", "page": "/talent/*"},
+            {"event_type": "vote"}
+        ], "days": 7})
+        assert response.status_code == 200
+        steps = response.json()["steps"]
+        assert len(steps) == 3
+        for previous, step in zip(steps, steps[1:]):
+            assert step["sessions"] <= previous["sessions"]
+
+    def test_top_paths(self):
+        """Paths are lists of "<event_type> <page>" steps"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/paths", params={"length": 2})
+        assert response.status_code == 200
+        for row in response.json():
+            assert 1 <= len(row["path"]) <= 2 and row["sessions"] > 0
+
+    def test_rejects_empty_funnel(self):
+        """A funnel without steps returns 400"""
+        response = requests.post(f"{BASE_URL}/api/admin/analytics/funnel", json={"steps": []})
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,115 @@
+"""
+Test Analytics tracking APIs - single and batched event ingestion
+Tests POST /api/analytics/track, POST /api/analytics/track/batch (JSON and
+sendBeacon text/plain bodies), ingest-time bot filtering, rollups of
+events with malformed referrers and GET /api/admin/analytics/ingest-stats
+"""
+import pytest
+import requests
+import os
+import json
+import time
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+# requests' own user agent is filtered as a bot
+BROWSER = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36"}
+
+
+def session_id():
+    return f"TEST_sess_{uuid.uuid4().hex[:8]}"
+
+
+class TestAnalyticsTracking:
+    """Test event ingestion endpoints"""
+
+    def test_track_single_event(self):
+        """POST /api/analytics/track accepts one event"""
+        response = requests.post(f"{BASE_URL}/api/analytics/track", json={
+            "event_type": "page_view", "page": "/", "session_id": session_id()
+        }, headers=BROWSER)
+        assert response.status_code == 200
+        assert response.json()["message"] == "Tracked"
+
+    def test_track_batch_array(self):
+        """POST /api/analytics/track/batch accepts a JSON array of events"""
+        sid = session_id()
+        events = [{"event_type": "page_view", "page": f"/test/{i}", "session_id": sid} for i in range(5)]
+        response = requests.post(f"{BASE_URL}/api/analytics/track/batch", json=events, headers=BROWSER)
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 5
+        print("Batch of 5 events accepted")
+
+    def test_track_batch_beacon_text_plain(self):
+        """sendBeacon payloads arrive as text/plain {"events": [...]}"""
+        body = json.dumps({"events": [{"event_type": "page_view", "page": "/", "session_id": session_id()}]})
+        response = requests.post(
+            f"{BASE_URL}/api/analytics/track/batch",
+            data=body,
+            headers={**BROWSER, "Content-Type": "text/plain;charset=UTF-8"}
+        )
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 1
+
+    def test_track_batch_rejects_invalid_event(self):
+        """Events failing the schema are rejected with 422"""
+        response = requests.post(f"{BASE_URL}/api/analytics/track/batch", json=[{"page": {"nested": True}}])
+        assert response.status_code == 422
+
+    def test_track_batch_rejects_oversized_batch(self):
+        """More than 100 events per batch returns 413"""
+        events = [{"event_type": "page_view", "page": "/"}] * 101
+        response = requests.post(f"{BASE_URL}/api/analytics/track/batch", json=events)
+        assert response.status_code == 413
+
+    def test_track_batch_filters_bots(self):
+        """Crawler user agents are counted as filtered, not accepted"""
+        events = [{"event_type": "page_view", "page": "/", "session_id": session_id()}] * 3
+        response = requests.post(f"{BASE_URL}/api/analytics/track/batch", json=events, headers={
+            "User-Agent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+        })
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 0
+        assert response.json()["filtered"] == 3
+
+    def test_bot_report(self):
+        """GET /api/admin/analytics/bots reports filtered events per day"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/bots", params={"days": 7})
+        assert response.status_code == 200
+        assert "total" in response.json() and "daily" in response.json()
+
+    def test_malformed_referrer_keeps_batch_in_rollups(self):
+        """A referrer that urlsplit rejects is counted as unknown and the rest of the batch still counts"""
+        def today_views():
+            response = requests.get(f"{BASE_URL}/api/admin/analytics/summary")
+            assert response.status_code == 200
+            return response.json()["traffic"]["today_views"]
+
+        before = today_views()
+        sid = session_id()
+        events = [{"event_type": "page_view", "page": "/", "session_id": sid, "referrer": "http://[abc"}]
+        events += [{"event_type": "page_view", "page": "/", "session_id": sid, "referrer": "https://instagram.com/"}] * 4
+        response = requests.post(f"{BASE_URL}/api/analytics/track/batch", json=events, headers=BROWSER)
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 5
+
+        # The summary is served from a 30s SWR cache; the rollups are written on the next flush
+        deadline = time.time() + 75
+        while today_views() < before + 5:
+            assert time.time() < deadline, "batch with a malformed referrer never reached the summary"
+            time.sleep(5)
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/referrers", params={"days": 1, "limit": 100})
+        assert "unknown" in [row["domain"] for row in response.json()]
+
+    def test_ingest_stats(self):
+        """GET /api/admin/analytics/ingest-stats reports pipeline counters"""
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/ingest-stats")
+        assert response.status_code == 200
+        data = response.json()
+        for key in ("queued", "written", "dropped", "sampled_out", "spooled", "queue_depth", "degraded", "bots", "sampling"):
+            assert key in data
+        print(f"Ingest stats: {data}")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
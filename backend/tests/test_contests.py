@@ -0,0 +1,111 @@
+"""
+Test Contest APIs - time-bounded voting windows with per-contest counters
+Tests POST/PUT/DELETE /api/admin/contests, POST /api/admin/contests/{id}/close,
+GET /api/contests/{id}/results and contest-scoped POST /api/vote
+"""
+import pytest
+import requests
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def iso(delta_hours):
+    return (datetime.now(timezone.utc) + timedelta(hours=delta_hours)).isoformat()
+
+
+class TestContestsAPI:
+    """Test contest lifecycle and contest-scoped voting"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup fixture - stores created contest IDs for cleanup"""
+        self.created_contest_ids = []
+        yield
+        for contest_id in self.created_contest_ids:
+            try:
+                requests.delete(f"{BASE_URL}/api/admin/contests/{contest_id}")
+            except:
+                pass
+
+    def create_contest(self, starts_in=-1, ends_in=24):
+        response = requests.post(f"{BASE_URL}/api/admin/contests", json={
+            "title": f"TEST Contest {uuid.uuid4().hex[:6]}",
+            "starts_at": iso(starts_in),
+            "ends_at": iso(ends_in)
+        })
+        assert response.status_code == 200
+        contest_id = response.json()["id"]
+        self.created_contest_ids.append(contest_id)
+        return contest_id
+
+    def get_approved_talent_id(self):
+        response = requests.get(f"{BASE_URL}/api/talents")
+        assert response.status_code == 200
+        talents = response.json()
+        if not talents:
+            pytest.skip("No approved talents to vote for")
+        return talents[0]["id"]
+
+    def test_create_contest_rejects_inverted_window(self):
+        """POST /api/admin/contests with ends_at before starts_at returns 400"""
+        response = requests.post(f"{BASE_URL}/api/admin/contests", json={
+            "title": "TEST Inverted", "starts_at": iso(2), "ends_at": iso(1)
+        })
+        assert response.status_code == 400
+        print("Inverted voting window rejected")
+
+    def test_contest_vote_increments_contest_counter(self):
+        """Voting with contest_id counts towards the contest standings"""
+        contest_id = self.create_contest()
+        talent_id = self.get_approved_talent_id()
+
+        response = requests.post(f"{BASE_URL}/api/vote", json={"talent_id": talent_id, "contest_id": contest_id})
+        assert response.status_code == 200
+
+        results = requests.get(f"{BASE_URL}/api/contests/{contest_id}/results").json()
+        assert results["status"] == "open"
+        entry = next((r for r in results["results"] if r["talent_id"] == talent_id), None)
+        assert entry is not None
+        assert entry["votes"] == 1
+        print(f"Contest vote recorded for {talent_id}")
+
+    def test_vote_before_window_rejected(self):
+        """Voting for a contest that has not started returns 400"""
+        contest_id = self.create_contest(starts_in=24, ends_in=48)
+        talent_id = self.get_approved_talent_id()
+
+        response = requests.post(f"{BASE_URL}/api/vote", json={"talent_id": talent_id, "contest_id": contest_id})
+        assert response.status_code == 400
+        print("Vote before voting window rejected")
+
+    def test_vote_for_unknown_contest_rejected(self):
+        """Voting with an unknown contest_id returns 400"""
+        talent_id = self.get_approved_talent_id()
+        response = requests.post(f"{BASE_URL}/api/vote", json={"talent_id": talent_id, "contest_id": "no-such-contest"})
+        assert response.status_code == 400
+
+    def test_close_contest_freezes_results(self):
+        """Closing a contest snapshots standings and rejects further votes"""
+        contest_id = self.create_contest()
+        talent_id = self.get_approved_talent_id()
+        requests.post(f"{BASE_URL}/api/vote", json={"talent_id": talent_id, "contest_id": contest_id})
+
+        response = requests.post(f"{BASE_URL}/api/admin/contests/{contest_id}/close")
+        assert response.status_code == 200
+        assert response.json()["total_votes"] == 1
+
+        results = requests.get(f"{BASE_URL}/api/contests/{contest_id}/results").json()
+        assert results["status"] == "closed"
+        assert results["results"][0]["talent_id"] == talent_id
+        assert "closed_at" in results
+
+        response = requests.post(f"{BASE_URL}/api/vote", json={"talent_id": talent_id, "contest_id": contest_id})
+        assert response.status_code == 400
+        print("Closed contest results frozen and voting rejected")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,60 @@
+"""
+Test rate limiting on login endpoints - token buckets keyed by email and client address
+Repeated failed logins for one email from one address must eventually return 429 with Retry-After
+Per-IP buckets must not be escapable by spoofing X-Forwarded-For entries
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+class TestLoginRateLimit:
+    """Test per-(email, address) token buckets on /api/auth/login and /api/talent/login"""
+
+    def exhaust(self, path):
+        email = f"test_ratelimit_{uuid.uuid4().hex[:8]}@example.com"
+        for _ in range(10):
+            response = requests.post(f"{BASE_URL}{path}", json={"email": email, "password": "wrongpass"})
+            if response.status_code == 429:
+                return response
+            assert response.status_code == 401
+        return response
+
+    def test_admin_login_rate_limited(self):
+        """POST /api/auth/login returns 429 after the per-email burst"""
+        response = self.exhaust("/api/auth/login")
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        print(f"Admin login limited, Retry-After: {response.headers['Retry-After']}")
+
+    def test_talent_login_rate_limited(self):
+        """POST /api/talent/login returns 429 after the per-email burst"""
+        response = self.exhaust("/api/talent/login")
+        assert response.status_code == 429
+        assert "Retry-After" in response.headers
+        print(f"Talent login limited, Retry-After: {response.headers['Retry-After']}")
+
+
+class TestForwardedForSpoofing:
+    """Test that client-supplied X-Forwarded-For entries do not pick the bucket"""
+
+    def test_spoofed_leading_entry_shares_bucket(self):
+        """A fresh random leading X-Forwarded-For entry per request still hits the same vote bucket"""
+        statuses = []
+        for _ in range(15):
+            response = requests.post(
+                f"{BASE_URL}/api/vote",
+                json={"talent_id": f"TEST_missing_{uuid.uuid4().hex[:8]}"},
+                headers={"X-Forwarded-For": f"203.0.113.{uuid.uuid4().int % 250 + 1}"}
+            )
+            statuses.append(response.status_code)
+            if response.status_code == 429:
+                break
+        assert 429 in statuses, f"Spoofed addresses escaped the per-IP limit: {statuses}"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -12,6 +12,7 @@ import { ChevronLeft, ChevronRight, Users, Palette, Sparkles, Camera, Briefcase,
 import { Toaster } from "@/components/ui/toaster";
 import { useToast } from "@/hooks/use-toast";
 import ImageUploadWithCrop from "@/components/ImageUploadWithCrop";
+import { trackEvent } from "@/lib/analytics";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -255,13 +256,11 @@ const PartyUpdatesSection = ({ partyEvents }) => {
   
   // Track party view when user hovers/clicks
   const trackPartyView = (partyId) => {
-    const sessionId = sessionStorage.getItem('bfm_session_id') || 'unknown';
-    axios.post(`${API}/analytics/track`, {
+    trackEvent({
       event_type: 'party_view',
       party_id: partyId,
-      page: '/home',
-      session_id: sessionId
-    }).catch(() => {});
+      page: '/home'
+    });
   };
   
   return (
@@ -420,13 +419,11 @@ const AdvertisementSidebar = ({ ads }) => {
   
   // Track ad click
   const trackAdClick = (adId) => {
-    const sessionId = sessionStorage.getItem('bfm_session_id') || 'unknown';
-    axios.post(`${API}/analytics/track`, {
+    trackEvent({
       event_type: 'ad_click',
       ad_id: adId,
-      page: window.location.pathname,
-      session_id: sessionId
-    }).catch(() => {});
+      page: window.location.pathname
+    });
   };
   
   return (
@@ -716,6 +713,7 @@ const TalentsPage = ({ ads }) => {
   const handleVote = async (talentId) => {
     try {
       await axios.post(`${API}/vote`, { talent_id: talentId });
+      trackEvent({ event_type: 'vote', talent_id: talentId, page: window.location.pathname });
       toast({ title: "Vote recorded!" });
       // Refresh
       const res = await axios.get(`${API}/talents?approved_only=true&category=${encodeURIComponent(dbCategory)}`);
@@ -991,13 +989,11 @@ const TalentProfilePage = () => {
         setShowModal(true);
         
         // Track talent view
-        const sessionId = sessionStorage.getItem('bfm_session_id') || 'unknown';
-        axios.post(`${API}/analytics/track`, {
+        trackEvent({
           event_type: 'talent_view',
           talent_id: talentId,
-          page: `/talent/${talentId}`,
-          session_id: sessionId
-        }).catch(() => {});
+          page: `/talent/${talentId}`
+        });
       } catch (err) {
         toast({ title: "Error", description: "Talent not found", variant: "destructive" });
       } finally {
@@ -1010,6 +1006,7 @@ const TalentProfilePage = () => {
   const handleVote = async (id) => {
     try {
       await axios.post(`${API}/talents/${id}/vote`);
+      trackEvent({ event_type: 'vote', talent_id: id, page: window.location.pathname });
       const res = await axios.get(`${API}/talent/${talentId}`);
       setTalent(res.data);
       toast({ title: "Vote recorded!" });
@@ -3138,7 +3135,7 @@ function App() {
     Promise.all([
       axios.get(`${API}/hero-images`),
       axios.get(`${API}/awards?active_only=true`),
-      axios.get(`${API}/advertisements`),
+      axios.get(`${API}/advertisements/select?count=6`),
       axios.get(`${API}/magazine`),
       axios.get(`${API}/music`),
       axios.get(`${API}/video`),
@@ -3170,13 +3167,13 @@ function App() {
     // Track page view
     const trackPageView = () => {
       const path = window.location.pathname;
-      axios.post(`${API}/analytics/track`, {
+      trackEvent({
         event_type: 'page_view',
         page: path,
         session_id: sessionId,
         user_agent: navigator.userAgent,
         referrer: document.referrer
-      }).catch(() => {}); // Silent fail
+      });
     };
 
     trackPageView();
@@ -0,0 +1,58 @@
+import axios from "axios";
+import { API } from "@/lib/constants";
+
+// Client-side batching for analytics events.
+// Events are queued and sent to /analytics/track/batch every few seconds
+// or once enough are waiting; anything left when the page is hidden goes
+// out with navigator.sendBeacon so it survives the unload.
+const BATCH_URL = `${API}/analytics/track/batch`;
+const MAX_BATCH = 20;
+const FLUSH_INTERVAL_MS = 5000;
+
+let queue = [];
+let timer = null;
+
+const takeBatch = () => {
+  const batch = queue.slice(0, MAX_BATCH);
+  queue = queue.slice(MAX_BATCH);
+  return batch;
+};
+
+export const flushEvents = () => {
+  clearTimeout(timer);
+  timer = null;
+  while (queue.length > 0) {
+    axios.post(BATCH_URL, { events: takeBatch() }).catch(() => {}); // Silent fail
+  }
+};
+
+const beaconFlush = () => {
+  if (queue.length === 0) return;
+  if (!navigator.sendBeacon) {
+    flushEvents();
+    return;
+  }
+  while (queue.length > 0) {
+    // A plain string is sent as text/plain, which needs no CORS preflight
+    navigator.sendBeacon(BATCH_URL, JSON.stringify({ events: takeBatch() }));
+  }
+};
+
+export const trackEvent = (event) => {
+  queue.push({
+    session_id: sessionStorage.getItem('bfm_session_id') || 'unknown',
+    ...event
+  });
+  if (queue.length >= MAX_BATCH) {
+    flushEvents();
+  } else if (!timer) {
+    timer = setTimeout(flushEvents, FLUSH_INTERVAL_MS);
+  }
+};
+
+if (typeof window !== "undefined") {
+  window.addEventListener("pagehide", beaconFlush);
+  document.addEventListener("visibilitychange", () => {
+    if (document.visibilityState === "hidden") beaconFlush();
+  });
+}